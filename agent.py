@@ -1,19 +1,59 @@
 # agent.py
+import copy
+import random
+import threading
+from contextlib import contextmanager
 import torch
 import torch.optim as optim
 import torch.nn as nn
 import numpy as np
-from model import DQN
-from replay_buffer import ReplayBuffer
+import metrics
+from model import DQN, EmbeddingDQN
+from cache import TopKCache
+from quantization import quantize_model, topk_overlap
+from item_index import IVFIndex
+from checkpoint import atomic_save
+from replay_buffer import (
+    ArrayReplayBuffer, MmapReplayBuffer, PrioritizedReplayBuffer,
+    CompactReplayBuffer, CompactMmapReplayBuffer
+)
+from state_encoder import SparseStates, CONTINUOUS_COLS
+from config import (
+    ACTION_SPACE, MAX_PRODUCTS, CATALOG_SIZE, ITEM_EMBED_DIM, ITEM_EMBEDDINGS_PATH,
+    TRAIN_NUM_CANDIDATES, TOPK_BLOCK_SIZE, TOPK_INDEX, IVF_NPROBE, IVF_REBUILD_EVERY
+)
 
 class DQNAgent:
-    def __init__(self, state_dim, action_dim, hidden_dim=64, lr=0.001, gamma=0.99):
+    def __init__(self, state_dim, action_dim, hidden_dim=64, lr=0.001, gamma=0.99,
+                 memory_capacity=10000, prioritized_replay=False, per_alpha=0.6, per_beta=0.4,
+                 memory_path=None, compact_replay=False, publish_every=1,
+                 inference_threads=None, train_threads=None, cache_size=0,
+                 precision="fp32", quant_min_overlap=0.9, quant_check_samples=256, quant_check_k=10):
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        self.model = DQN(state_dim, action_dim, hidden_dim).to(self.device)
-        self.target_model = DQN(state_dim, action_dim, hidden_dim).to(self.device)
+        self.model = self._build_model(state_dim, action_dim, hidden_dim).to(self.device)
+        self.target_model = self._build_model(state_dim, action_dim, hidden_dim).to(self.device)
         self.target_model.load_state_dict(self.model.state_dict())
-        self.optimizer = optim.Adam(self.model.parameters(), lr=lr)
-        self.memory = ReplayBuffer()
+        self.lr = lr
+        self.optimizer = self._build_optimizer(lr)
+        # Replay: uniform (mặc định) hoặc prioritized (sum-tree + IS weights)
+        # memory_path: lưu uniform replay trên file mmap, giữ lại qua các lần restart
+        # compact_replay: lưu state dạng nén (bit one-hot + cột liên tục), ~15x nhỏ hơn
+        self.prioritized_replay = prioritized_replay
+        if prioritized_replay:
+            if memory_path is not None or compact_replay:
+                raise ValueError("Prioritized replay chưa hỗ trợ memory_path / compact_replay")
+            self.memory = PrioritizedReplayBuffer(state_dim, capacity=memory_capacity,
+                                                  alpha=per_alpha, beta=per_beta)
+        elif compact_replay and memory_path is not None:
+            self.memory = CompactMmapReplayBuffer(memory_path, state_dim, capacity=memory_capacity,
+                                                  dense_cols=CONTINUOUS_COLS)
+        elif compact_replay:
+            self.memory = CompactReplayBuffer(state_dim, capacity=memory_capacity,
+                                              dense_cols=CONTINUOUS_COLS)
+        elif memory_path is not None:
+            self.memory = MmapReplayBuffer(memory_path, state_dim, capacity=memory_capacity)
+        else:
+            self.memory = ArrayReplayBuffer(state_dim, capacity=memory_capacity)
         self.gamma = gamma
         self.action_dim = action_dim
         
@@ -25,11 +65,47 @@ class DQNAgent:
         # Tracking
         self.is_trained = False  # Chưa có model
         self.train_count = 0
+        
+        # Inference int8 / fp16: dựng từ model float32 mỗi lần publish, top-k trùng với
+        # float32 dưới quant_min_overlap trên mẫu state kiểm tra → dùng float32
+        # Mẫu kiểm tra (held-out): state đã gợi ý gần đây, không lấy từ replay buffer model đã train
+        self.precision = precision
+        self.inference_precision = "fp32"
+        self.quant_min_overlap = quant_min_overlap
+        self.quant_check_samples = quant_check_samples
+        self.quant_check_k = min(quant_check_k, action_dim)
+        self.quant_overlap = None
+        self.quant_fallbacks = 0
+        self.quant_error = None
+        self._served_states = np.zeros((quant_check_samples, state_dim), dtype=np.float32) \
+            if precision != "fp32" else None
+        self._served_count = 0
+        
+        # Double-buffer: inference chạy trên bản copy read-only của model,
+        # publish từ model đang train mỗi publish_every lần train (swap reference)
+        self.train_lock = threading.Lock()
+        self.publish_every = publish_every
+        self.inference_version = 0
+        self.inference_model = None
+        self.publish_inference_model()
+        
+        # Số thread torch cho inference / training (None = mặc định của torch)
+        self.inference_threads = inference_threads
+        self.train_threads = train_threads
+        
+        # Cache top-k theo (state, inference_version), cache_size=0 → tắt
+        self.cache = TopKCache(cache_size) if cache_size > 0 else None
+    
+    def _build_model(self, state_dim, action_dim, hidden_dim):
+        return DQN(state_dim, action_dim, hidden_dim)
+    
+    def _build_optimizer(self, lr):
+        return optim.Adam(self.model.parameters(), lr=lr)
     
     def select_action(self, state):
         """Chọn 1 action (dùng cho training)"""
         if np.random.rand() < self.epsilon:
-            return np.random.randint(0, self.model.fc3.out_features)
+            return np.random.randint(0, self.action_dim)
         state_tensor = torch.FloatTensor(state).unsqueeze(0).to(self.device)
         q_values = self.model(state_tensor)
         return q_values.argmax().item()
@@ -40,29 +116,209 @@ class DQNAgent:
         - Chưa có model (is_trained=False): Random 100%
         - Có model: Epsilon-greedy (epsilon% random, (1-epsilon)% model)
         """
-        # COLD START: Chưa train lần nào → Random hoàn toàn
+        if not self.use_model():
+            # COLD START hoặc EXPLORATION: Random k products
+            return self.random_actions(k)
+        
+        # EXPLOITATION: Dùng model để chọn top k
+        return self.model_top_actions(np.expand_dims(state, 0), [k])[0]
+    
+    def select_top_actions_batch(self, states, ks):
+        """
+        select_top_actions cho cả batch: epsilon-greedy quyết định riêng từng dòng,
+        các dòng dùng model được tính chung trong 1 lần forward
+        """
+        results = [None] * len(ks)
+        model_rows = []
+        for i, k in enumerate(ks):
+            if self.use_model():
+                model_rows.append(i)
+            else:
+                results[i] = self.random_actions(k)
+        
+        if model_rows:
+            top_actions = self.model_top_actions(
+                states[model_rows], [ks[i] for i in model_rows]
+            )
+            for i, actions in zip(model_rows, top_actions):
+                results[i] = actions
+        return results
+    
+    def use_model(self):
+        """
+        Quyết định cho 1 request: dùng model (exploitation) hay random
+        - Chưa train lần nào → luôn random (cold start)
+        - Đã có model → random với xác suất epsilon
+        """
         if not self.is_trained:
-            return list(np.random.choice(self.action_dim, size=k, replace=False))
+            metrics.inc("dqn_recommend_decisions_total", decision="cold_start")
+            return False
+        exploit = np.random.rand() >= self.epsilon
+        metrics.inc("dqn_recommend_decisions_total", decision="exploit" if exploit else "explore")
+        return exploit
+    
+    def random_actions(self, k=10):
+        """Random k products khác nhau (exploration / cold start)"""
+        return list(np.random.choice(self.action_dim, size=k, replace=False))
+    
+    def model_top_actions(self, states, ks):
+        """
+        Top k actions theo Q-value cho cả batch states (1 lần forward)
+        Chạy trên inference_model (snapshot), không tranh chấp với training
         
-        # ĐÃ CÓ MODEL: Epsilon-greedy strategy
-        if np.random.rand() < self.epsilon:
-            # EXPLORATION: Random k products
-            return list(np.random.choice(self.action_dim, size=k, replace=False))
-        else:
-            # EXPLOITATION: Dùng model để chọn top k
-            state_tensor = torch.FloatTensor(state).unsqueeze(0).to(self.device)
-            
-            with torch.no_grad():
-                q_values = self.model(state_tensor)
-            
-            # Lấy top k actions có Q-value cao nhất
-            k = min(k, q_values.shape[1])
-            top_k_indices = torch.topk(q_values, k, dim=1)[1]
+        Args:
+            states: Mảng (batch_size, state_dim) hoặc SparseStates (forward_sparse)
+            ks: Danh sách k cho từng dòng
             
-            result = top_k_indices.squeeze().cpu().numpy()
-            if result.ndim == 0:
-                return [int(result.item())]
-            return [int(x) for x in result.tolist()]
+        Returns:
+            List các list action index, mỗi dòng 1 list
+        """
+        if self._served_states is not None and not isinstance(states, SparseStates):
+            self._record_served_states(states)
+        if self.cache is not None and not isinstance(states, SparseStates):
+            return self._cached_top_actions(states, ks)
+        return self._model_top_actions(states, ks)
+    
+    def _cached_top_actions(self, states, ks):
+        """
+        model_top_actions qua TopKCache: chỉ forward các dòng miss
+        Version lấy trước model → entry không bao giờ gắn version mới hơn model đã tính
+        """
+        version = self.inference_version
+        states = np.asarray(states, dtype=np.float32)
+        keys = [self.cache.key(state) for state in states]
+        results = [self.cache.get(key, version, k) for key, k in zip(keys, ks)]
+        
+        miss_rows = [i for i, actions in enumerate(results) if actions is None]
+        if miss_rows:
+            top_actions = self._model_top_actions(states[miss_rows], [ks[i] for i in miss_rows])
+            for i, actions in zip(miss_rows, top_actions):
+                self.cache.put(keys[i], version, actions)
+                results[i] = actions
+        return results
+    
+    def _model_top_actions(self, states, ks, model=None):
+        if model is None:
+            model = self.inference_model
+        if isinstance(states, SparseStates) and getattr(model, "precision", "fp32") != "fp32":
+            states = states.to_dense()
+        
+        with torch.inference_mode():
+            if isinstance(states, SparseStates):
+                q_values = model.forward_sparse(
+                    torch.as_tensor(states.indices).to(self.device),
+                    torch.as_tensor(states.values).to(self.device),
+                    torch.as_tensor(states.offsets).to(self.device)
+                )
+            else:
+                state_tensor = torch.as_tensor(np.asarray(states, dtype=np.float32)).to(self.device)
+                q_values = model(state_tensor)
+        
+        # Lấy top max(k) một lần rồi cắt cho từng dòng
+        max_k = min(max(ks), q_values.shape[1])
+        top_k_indices = torch.topk(q_values, max_k, dim=1)[1].cpu().numpy()
+        return [[int(x) for x in row[:k]] for row, k in zip(top_k_indices, ks)]
+    
+    def publish_inference_model(self):
+        """
+        Copy model đang train thành bản inference mới rồi swap reference (atomic)
+        Request đang chạy vẫn dùng bản cũ cho tới khi xong
+        """
+        inference_model = copy.deepcopy(self.model).eval()
+        inference_model.requires_grad_(False)
+        self.inference_model = self.prepare_inference_model(inference_model)
+        self.inference_version += 1
+    
+    def prepare_inference_model(self, model):
+        """
+        Chuyển bản inference float32 sang precision đã cấu hình (int8 / fp16)
+        Top-k trùng với float32 dưới quant_min_overlap, lỗi quantize
+        hoặc chưa có state để kiểm tra → trả lại model float32
+        """
+        if self.precision == "fp32":
+            return model
+        
+        active, overlap = "fp32", None
+        states = self._reference_states()
+        if states is None:
+            self.quant_error = "Chưa có state đã gợi ý để kiểm tra top-k"
+        else:
+            try:
+                quantized = quantize_model(copy.deepcopy(model), self.precision)
+                ks = [self.quant_check_k] * len(states)
+                overlap = topk_overlap(self._model_top_actions(states, ks, model),
+                                       self._model_top_actions(states, ks, quantized))
+                self.quant_error = None
+                if overlap >= self.quant_min_overlap:
+                    model, active = quantized, self.precision
+                else:
+                    self.quant_fallbacks += 1
+            except Exception as e:
+                self.quant_error = str(e)
+        
+        if active != self.inference_precision:
+            detail = f"top-{self.quant_check_k} overlap {overlap:.3f}" if overlap is not None else self.quant_error
+            print(f"Inference precision: {self.inference_precision} → {active} ({detail})")
+        self.inference_precision = active
+        self.quant_overlap = overlap
+        if overlap is not None:
+            metrics.set_gauge("dqn_inference_topk_overlap", overlap)
+        return model
+    
+    def _reference_states(self):
+        """
+        Mẫu state kiểm tra top-k: các state đã gợi ý gần đây
+        Chỉ ghi ở đường inference, không bao giờ push vào replay buffer (không đo trên dữ liệu train)
+        """
+        count = min(self._served_count, len(self._served_states))
+        return self._served_states[:count].copy() if count else None
+    
+    def _record_served_states(self, states):
+        """Ghi vòng các state đã gợi ý (không khóa: chỉ là mẫu, ghi đè lẫn nhau không sao)"""
+        states = np.asarray(states, dtype=np.float32)[-len(self._served_states):]
+        positions = (self._served_count + np.arange(len(states))) % len(self._served_states)
+        self._served_states[positions] = states
+        self._served_count += len(states)
+    
+    def quantization_status(self):
+        """Trạng thái inference precision cho /status"""
+        return {
+            "configured": self.precision,
+            "active": self.inference_precision,
+            "topk_overlap": round(self.quant_overlap, 4) if self.quant_overlap is not None else None,
+            "min_overlap": self.quant_min_overlap,
+            "fallbacks": self.quant_fallbacks,
+            "last_error": self.quant_error
+        }
+    
+    def init_inference_thread(self):
+        """
+        Gọi trong thread chạy inference (vd: initializer của InferenceBatcher)
+        Với PyTorch dùng OpenMP, số thread intra-op áp dụng theo từng thread gọi
+        """
+        if self.inference_threads:
+            torch.set_num_threads(self.inference_threads)
+    
+    @contextmanager
+    def inference_threads_scope(self):
+        """
+        init_inference_thread cho 1 lần gọi trên thread dùng chung (threadpool của FastAPI,
+        cũng chạy /train sync): trả lại số thread cũ khi xong
+        """
+        if not self.inference_threads:
+            yield
+            return
+        previous = torch.get_num_threads()
+        torch.set_num_threads(self.inference_threads)
+        try:
+            yield
+        finally:
+            torch.set_num_threads(previous)
+    
+    def init_train_thread(self):
+        """Gọi trong thread chạy training (vd: BackgroundTrainer)"""
+        if self.train_threads:
+            torch.set_num_threads(self.train_threads)
     
     def train_step(self, batch_size=32):
         """
@@ -73,29 +329,52 @@ class DQNAgent:
         - Nếu memory < batch_size: Train trên toàn bộ memory (online learning)
         - Nếu memory >= batch_size: Train trên batch ngẫu nhiên (experience replay)
         """
+        with self.train_lock:
+            self._train_step(batch_size)
+    
+    def _train_step(self, batch_size):
         if len(self.memory) < 1:
             return  # Không có data để train
         
         # Train ngay cả khi chỉ có 1 experience
         actual_batch_size = min(batch_size, len(self.memory))
         
-        states, actions, rewards, next_states, dones = self.memory.sample(actual_batch_size)
-        states = torch.FloatTensor(states).to(self.device)
-        actions = torch.LongTensor(actions).unsqueeze(1).to(self.device)
-        rewards = torch.FloatTensor(rewards).unsqueeze(1).to(self.device)
-        next_states = torch.FloatTensor(next_states).to(self.device)
-        dones = torch.FloatTensor(dones).unsqueeze(1).to(self.device)
+        with metrics.timer("dqn_train_step_seconds", stage="sample"):
+            if self.prioritized_replay:
+                states, actions, rewards, next_states, dones, indices, weights = \
+                    self.memory.sample(actual_batch_size)
+            else:
+                states, actions, rewards, next_states, dones = self.memory.sample(actual_batch_size)
+            states = torch.FloatTensor(states).to(self.device)
+            actions = torch.LongTensor(actions).unsqueeze(1).to(self.device)
+            rewards = torch.FloatTensor(rewards).unsqueeze(1).to(self.device)
+            next_states = torch.FloatTensor(next_states).to(self.device)
+            dones = torch.FloatTensor(dones).unsqueeze(1).to(self.device)
 
-        with torch.no_grad():
-            q_next = self.target_model(next_states).max(1, keepdim=True)[0]
-            q_target = rewards + self.gamma * q_next * (1 - dones)
-        
-        q_values = self.model(states).gather(1, actions)
-        loss = nn.MSELoss()(q_values, q_target)
+        with metrics.timer("dqn_train_step_seconds", stage="forward"):
+            with torch.no_grad():
+                q_next = self._max_next_q(next_states, actions)
+                q_target = rewards + self.gamma * q_next * (1 - dones)
+            
+            q_values = self._q_values(states, actions)
+            td_errors = q_target - q_values
+            if self.prioritized_replay:
+                # Loss có trọng số IS, TD error dùng để cập nhật priority
+                weights = torch.as_tensor(weights).unsqueeze(1).to(self.device)
+                loss = (weights * td_errors.pow(2)).mean()
+                self.memory.update_priorities(indices, td_errors.detach().abs().squeeze(1).cpu().numpy())
+            else:
+                loss = nn.MSELoss()(q_values, q_target)
 
-        self.optimizer.zero_grad()
-        loss.backward()
-        self.optimizer.step()
+        with metrics.timer("dqn_train_step_seconds", stage="backward"):
+            self.optimizer.zero_grad()
+            loss.backward()
+        with metrics.timer("dqn_train_step_seconds", stage="optimizer"):
+            self.optimizer.step()
+        
+        if metrics.enabled:
+            metrics.set_gauge("dqn_train_loss", loss.item())
+            metrics.set_gauge("dqn_td_error_mean", td_errors.detach().abs().mean().item())
         
         # Đánh dấu đã train → có thể dùng model
         if not self.is_trained:
@@ -105,18 +384,67 @@ class DQNAgent:
         
         # Giảm epsilon dần (50% → 10%)
         self.epsilon = max(self.epsilon_min, self.epsilon * self.epsilon_decay)
+        
+        # Publish weights mới cho inference
+        if self.train_count % self.publish_every == 0:
+            with metrics.timer("dqn_train_step_seconds", stage="publish"):
+                self.publish_inference_model()
+    
+    def _q_values(self, states, actions):
+        """Q(s, a) của model đang train cho action đã chọn → (batch_size, 1)"""
+        return self.model(states).gather(1, actions)
+    
+    def _max_next_q(self, next_states, actions):
+        """max_a Q_target(s', a) → (batch_size, 1)"""
+        return self.target_model(next_states).max(1, keepdim=True)[0]
     
     def update_target(self):
-        self.target_model.load_state_dict(self.model.state_dict())
+        with self.train_lock:
+            self.target_model.load_state_dict(self.model.state_dict())
+    
+    def snapshot(self):
+        """Bản sao checkpoint trong RAM, lưu ở thread khác mà không bị train ghi đè"""
+        with self.train_lock:
+            return self._snapshot()
+    
+    def _snapshot(self):
+        return {
+            'model_state_dict': {k: v.detach().clone() for k, v in self.model.state_dict().items()},
+            'target_model_state_dict': {k: v.detach().clone() for k, v in self.target_model.state_dict().items()},
+            'optimizer_state_dict': copy.deepcopy(self.optimizer.state_dict()),
+            'epsilon': self.epsilon,
+            'train_count': self.train_count
+        }
+    
+    def weights_snapshot(self):
+        """(state_dict NumPy của model, epsilon, train_count) tại 1 thời điểm, cho ModelRegistry"""
+        with self.train_lock:
+            state_dict = {k: v.detach().cpu().numpy().copy() for k, v in self.model.state_dict().items()}
+            return state_dict, self.epsilon, self.train_count
+    
+    def swap_weights(self, state_dict):
+        """
+        Thay weights của model + target model (activate / rollback version trong registry)
+        - Optimizer tạo lại: moment của Adam thuộc về weights cũ
+        - Publish inference model mới (swap reference), request đang chạy không bị gián đoạn
+        """
+        with self.train_lock:
+            self.model.load_state_dict(state_dict)
+            self.target_model.load_state_dict(state_dict)
+            self.optimizer = self._build_optimizer(self.lr)
+            self.is_trained = True
+            self.publish_inference_model()
     
     def save_model(self, path="dqn_model.pt"):
-        """Lưu model và optimizer state"""
-        torch.save({
-            'model_state_dict': self.model.state_dict(),
-            'target_model_state_dict': self.target_model.state_dict(),
-            'optimizer_state_dict': self.optimizer.state_dict(),
-            'epsilon': self.epsilon
-        }, path)
+        """Lưu model và optimizer state (ghi file tạm rồi rename)"""
+        with self.train_lock:
+            atomic_save({
+                'model_state_dict': self.model.state_dict(),
+                'target_model_state_dict': self.target_model.state_dict(),
+                'optimizer_state_dict': self.optimizer.state_dict(),
+                'epsilon': self.epsilon,
+                'train_count': self.train_count
+            }, path)
     
     def load_model(self, path="dqn_model.pt"):
         """Load model và optimizer state"""
@@ -125,5 +453,158 @@ class DQNAgent:
         self.target_model.load_state_dict(checkpoint['target_model_state_dict'])
         self.optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
         self.epsilon = checkpoint['epsilon']
+        self.train_count = checkpoint.get('train_count', 0)
         # Đánh dấu đã có model
         self.is_trained = True
+        self.publish_inference_model()
+
+
+class CombinedOptimizer:
+    """Gộp nhiều optimizer thành 1 (cùng interface zero_grad / step / state_dict)"""
+    def __init__(self, *optimizers):
+        self.optimizers = optimizers
+    
+    def zero_grad(self):
+        for optimizer in self.optimizers:
+            optimizer.zero_grad()
+    
+    def step(self):
+        for optimizer in self.optimizers:
+            optimizer.step()
+    
+    def state_dict(self):
+        return {"optimizers": [optimizer.state_dict() for optimizer in self.optimizers]}
+    
+    def load_state_dict(self, state_dict):
+        for optimizer, state in zip(self.optimizers, state_dict["optimizers"]):
+            optimizer.load_state_dict(state)
+
+
+class EmbeddingDQNAgent(DQNAgent):
+    """
+    DQNAgent cho catalog lớn (ACTION_SPACE = "embedding")
+    
+    - Model: EmbeddingDQN, Q(s, a) = state_embedding · item_embedding
+    - Top-k: chấm điểm catalog theo block (block_size sản phẩm / lần), giữ top-k chạy,
+      bộ nhớ không phụ thuộc số sản phẩm
+    - Training: Q(s, a) chỉ tính cho action đã chọn; max_a Q_target(s', a) lấy trên
+      num_candidates sản phẩm sample ngẫu nhiên + các action trong batch (sampled max)
+    - Item embeddings dùng gradient sparse + SparseAdam: mỗi lần train chỉ cập nhật
+      các dòng của action trong batch thay vì cả bảng
+    - topk_index = "ivf": top-k xấp xỉ (IVFIndex), latency gần như không tăng theo catalog
+    """
+    def __init__(self, state_dim, action_dim, embed_dim=32, num_candidates=1024, block_size=16384,
+                 item_embeddings=None, freeze_item_embeddings=False,
+                 topk_index="exact", nprobe=16, index_rebuild_every=1000, **kwargs):
+        self.embed_dim = embed_dim
+        self.num_candidates = num_candidates
+        self.block_size = block_size
+        
+        # topk_index = "ivf": top-k xấp xỉ qua IVFIndex, dựng lại trên thread nền
+        # mỗi index_rebuild_every version (chưa có index → tính chính xác)
+        self.topk_index = topk_index
+        self.nprobe = nprobe
+        self.index_rebuild_every = index_rebuild_every
+        self.item_index = None
+        self.item_index_version = 0
+        self._index_thread = None
+        super().__init__(state_dim, action_dim, **kwargs)
+        
+        if item_embeddings is not None:
+            for model in (self.model, self.target_model):
+                model.load_item_embeddings(item_embeddings, freeze=freeze_item_embeddings)
+            self.publish_inference_model()
+    
+    def _build_model(self, state_dim, action_dim, hidden_dim):
+        return EmbeddingDQN(state_dim, action_dim, hidden_dim, self.embed_dim)
+    
+    def _build_optimizer(self, lr):
+        item_params = [self.model.item_embeddings.weight, self.model.item_bias.weight]
+        tower_params = [p for p in self.model.parameters() if all(p is not q for q in item_params)]
+        return CombinedOptimizer(optim.Adam(tower_params, lr=lr), optim.SparseAdam(item_params, lr=lr))
+    
+    def random_actions(self, k=10):
+        # random.sample trên range: O(k), không hoán vị cả catalog
+        return random.sample(range(self.action_dim), k)
+    
+    def _model_top_actions(self, states, ks, model=None):
+        if model is None:
+            model = self.inference_model
+        if isinstance(states, SparseStates):
+            states = states.to_dense()
+        state_tensor = torch.as_tensor(np.asarray(states, dtype=np.float32)).to(self.device)
+        max_k = min(max(ks), self.action_dim)
+        
+        index = self._current_index(model) if self.topk_index == "ivf" else None
+        if index is not None:
+            with torch.inference_mode():
+                state_emb = model.encode(state_tensor).cpu().numpy()
+            top_k_indices = index.search(
+                state_emb,
+                model.item_embeddings.weight.detach().cpu().numpy(),
+                model.item_bias.weight.detach().cpu().numpy()[:, 0],
+                max_k, self.nprobe
+            )
+            return [[int(x) for x in row[:k]] for row, k in zip(top_k_indices, ks)]
+        
+        with torch.inference_mode():
+            state_emb = model.encode(state_tensor)
+            best_scores, best_indices = None, None
+            for start in range(0, self.action_dim, self.block_size):
+                end = min(start + self.block_size, self.action_dim)
+                scores = model.score_range(state_emb, start, end)
+                scores, indices = torch.topk(scores, min(max_k, end - start), dim=1)
+                indices = indices + start
+                if best_scores is not None:
+                    # Gộp top-k của block với top-k hiện tại
+                    scores = torch.cat((best_scores, scores), dim=1)
+                    indices = torch.cat((best_indices, indices), dim=1)
+                    scores, order = torch.topk(scores, max_k, dim=1)
+                    indices = indices.gather(1, order)
+                best_scores, best_indices = scores, indices
+        
+        top_k_indices = best_indices.cpu().numpy()
+        return [[int(x) for x in row[:k]] for row, k in zip(top_k_indices, ks)]
+    
+    def _current_index(self, model):
+        """Index hiện tại (có thể cũ hơn model); quá index_rebuild_every version thì dựng lại nền"""
+        version = self.inference_version
+        stale = self.item_index is None or version - self.item_index_version >= self.index_rebuild_every
+        if stale and (self._index_thread is None or not self._index_thread.is_alive()):
+            self._index_thread = threading.Thread(target=self._rebuild_index, args=(model, version),
+                                                  name="item-index", daemon=True)
+            self._index_thread.start()
+        return self.item_index
+    
+    def swap_weights(self, state_dict):
+        super().swap_weights(state_dict)
+        # Index dựng từ embeddings cũ: bỏ, tính chính xác cho tới khi dựng lại xong
+        self.item_index = None
+    
+    def _rebuild_index(self, model, version):
+        embeddings = model.item_embeddings.weight.detach().cpu().numpy()
+        index = IVFIndex(embeddings)
+        self.item_index, self.item_index_version = index, version
+    
+    def _q_values(self, states, actions):
+        return self.model.score_actions(self.model.encode(states), actions)
+    
+    def _max_next_q(self, next_states, actions):
+        if self.action_dim <= self.num_candidates:
+            return self.target_model(next_states).max(1, keepdim=True)[0]
+        
+        sampled = torch.randint(0, self.action_dim, (self.num_candidates,), device=self.device)
+        candidates = torch.unique(torch.cat((sampled, actions.squeeze(1))))
+        scores = self.target_model.score_items(self.target_model.encode(next_states), candidates)
+        return scores.max(1, keepdim=True)[0]
+
+
+def create_agent(state_dim, **kwargs):
+    """Tạo agent theo ACTION_SPACE trong config (dense: DQNAgent, embedding: EmbeddingDQNAgent)"""
+    if ACTION_SPACE == "embedding":
+        item_embeddings = np.load(ITEM_EMBEDDINGS_PATH) if ITEM_EMBEDDINGS_PATH else None
+        return EmbeddingDQNAgent(state_dim, CATALOG_SIZE, embed_dim=ITEM_EMBED_DIM,
+                                 num_candidates=TRAIN_NUM_CANDIDATES, block_size=TOPK_BLOCK_SIZE,
+                                 item_embeddings=item_embeddings, topk_index=TOPK_INDEX,
+                                 nprobe=IVF_NPROBE, index_rebuild_every=IVF_REBUILD_EVERY, **kwargs)
+    return DQNAgent(state_dim, MAX_PRODUCTS, **kwargs)
@@ -0,0 +1,260 @@
+# agent_registry.py
+"""
+Agent riêng cho từng segment (storefront / position, ...), chọn theo field "segment" của request
+
+    segments/
+        <segment>/dqn_model.pt   # checkpoint của agent segment (atomic_save)
+        <segment>/replay/        # replay buffer mmap của segment
+
+- Lazy: agent chỉ được tạo + load từ đĩa ở request đầu tiên của segment
+- Chỉ request train (create=True) mới tạo segment mới trên đĩa; request đọc (create=False) của
+  segment chưa có thì không tạo gì (client tự đặt segment → không làm đầy đĩa)
+- Segment mới chỉ được tạo khi có trong allowlist (nếu có) và chưa vượt max_segments,
+  ngược lại → SegmentLimitError (segment đã có trên đĩa vẫn dùng bình thường)
+- Mỗi segment có 1 trainer (OfflineTrainer) dùng chung cho /train và /train/stream
+  → phần lẻ của updates_per_sample được cộng dồn giữa các request
+- Giữ tối đa max_resident agent trong RAM (LRU), agent bị evict được lưu trên thread nền
+  → bộ nhớ không tăng theo số segment (hàng nghìn segment vẫn chỉ max_resident agent)
+- Segment bị evict rồi dùng lại ngay: chờ lưu xong mới load (không đọc checkpoint cũ)
+- Agent đang được request dùng (use()) không bị evict, có thể tạm vượt max_resident
+"""
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from checkpoint import atomic_save
+from config import (
+    SEGMENT_DIR, SEGMENT_MAX_RESIDENT, SEGMENT_CHECKPOINT_EVERY_STEPS, SEGMENT_MAX_COUNT, SEGMENT_ALLOWLIST
+)
+
+SEGMENT_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+MODEL_FILE = "dqn_model.pt"
+
+
+class SegmentLimitError(Exception):
+    """Không được tạo segment mới (ngoài allowlist hoặc đã đủ max_segments)"""
+
+
+class _Entry:
+    def __init__(self, directory):
+        self.directory = directory
+        self.agent = None
+        self.trainer = None
+        self.error = None
+        self.ready = threading.Event()
+        self.lock = threading.Lock()  # push + train của segment (giống stream_lock)
+        self.users = 0
+        self.saved_step = 0
+
+
+class AgentRegistry:
+    def __init__(self, factory, trainer_factory, root=SEGMENT_DIR, max_resident=SEGMENT_MAX_RESIDENT,
+                 checkpoint_every=SEGMENT_CHECKPOINT_EVERY_STEPS, max_segments=SEGMENT_MAX_COUNT,
+                 allowlist=SEGMENT_ALLOWLIST):
+        """
+        Args:
+            factory: factory(directory) → agent mới (replay buffer đặt trong directory)
+            trainer_factory: trainer_factory(agent) → trainer có push(states, actions, ...)
+            max_segments: số segment tối đa (kể cả segment đã có trên đĩa)
+            allowlist: các segment được phép tạo (None = mọi segment)
+        """
+        self.factory = factory
+        self.trainer_factory = trainer_factory
+        self.root = root
+        self.max_resident = max_resident
+        self.checkpoint_every = checkpoint_every
+        self.max_segments = max_segments
+        self.allowlist = set(allowlist) if allowlist is not None else None
+        self._known = None  # segment đã có trên đĩa / đã được phép tạo (đọc thư mục ở lần đầu)
+        self._entries = OrderedDict()
+        self._flushing = {}  # segment → Future đang lưu
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="segment-flush")
+
+        # Tracking
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+        self.saves = 0
+        self.rejected = 0
+        self.last_error = None
+
+    def path(self, segment):
+        if not SEGMENT_PATTERN.match(segment):
+            raise ValueError(f"Segment không hợp lệ: {segment}")
+        return os.path.join(self.root, segment)
+
+    def exists(self, segment):
+        """Segment đã có trạng thái (trong RAM hoặc trên đĩa)"""
+        directory = self.path(segment)
+        with self._lock:
+            if segment in self._entries or segment in self._flushing:
+                return True
+        return os.path.isdir(directory)
+
+    def reserve(self, segment):
+        """
+        Cho phép tạo segment (giữ chỗ trong max_segments), segment đã có → không làm gì
+        Raises: SegmentLimitError nếu segment ngoài allowlist hoặc đã đủ max_segments
+        """
+        self.path(segment)
+        with self._lock:
+            if self._known is None:
+                names = os.listdir(self.root) if os.path.isdir(self.root) else []
+                self._known = {name for name in names
+                               if SEGMENT_PATTERN.match(name) and os.path.isdir(os.path.join(self.root, name))}
+            if segment in self._known:
+                return
+            if self.allowlist is not None and segment not in self.allowlist:
+                self.rejected += 1
+                raise SegmentLimitError(f"Segment không nằm trong allowlist: {segment}")
+            if len(self._known) >= self.max_segments:
+                self.rejected += 1
+                raise SegmentLimitError(f"Đã đủ {self.max_segments} segment, không tạo thêm segment: {segment}")
+            self._known.add(segment)
+
+    @contextmanager
+    def use(self, segment, create=True):
+        """
+        Entry của segment (load nếu chưa có trong RAM), không bị evict trong khối with
+        Entry có agent, trainer và lock (giữ khi push + train)
+        create=False: segment chưa tồn tại → None, không tạo gì trên đĩa
+        create=True: segment mới phải qua reserve() (SegmentLimitError khi vượt giới hạn)
+        """
+        if not create and not self.exists(segment):
+            yield None
+            return
+        if create:
+            self.reserve(segment)
+        entry = self._acquire(segment)
+        try:
+            yield entry
+        finally:
+            with self._lock:
+                entry.users -= 1
+            self._evict()
+
+    def _acquire(self, segment):
+        directory = self.path(segment)
+        with self._lock:
+            entry = self._entries.get(segment)
+            if entry is not None:
+                self._entries.move_to_end(segment)
+                entry.users += 1
+                self.hits += 1
+                loader = False
+            else:
+                entry = _Entry(directory)
+                entry.users = 1
+                self._entries[segment] = entry
+                loader = True
+            pending = self._flushing.get(segment)
+
+        if loader:
+            try:
+                if pending is not None:
+                    pending.result()
+                entry.agent = self._load(directory)
+                entry.trainer = self.trainer_factory(entry.agent)
+                entry.saved_step = entry.agent.train_count
+                with self._lock:
+                    self.loads += 1
+            except Exception as e:
+                entry.error = e
+                with self._lock:
+                    if self._entries.get(segment) is entry:
+                        del self._entries[segment]
+            entry.ready.set()
+        else:
+            entry.ready.wait()
+
+        if entry.error is not None:
+            raise entry.error
+        return entry
+
+    def _load(self, directory):
+        agent = self.factory(directory)
+        model_path = os.path.join(directory, MODEL_FILE)
+        if os.path.exists(model_path):
+            agent.load_model(model_path)
+        return agent
+
+    def _evict(self):
+        """Bỏ agent ít dùng nhất (không có request đang dùng) khi vượt max_resident"""
+        with self._lock:
+            excess = len(self._entries) - self.max_resident
+            if excess <= 0:
+                return
+            for segment, entry in list(self._entries.items()):
+                if excess <= 0:
+                    break
+                if entry.users > 0 or entry.agent is None:
+                    continue
+                del self._entries[segment]
+                self._flushing[segment] = self._executor.submit(self._save, segment, entry)
+                self.evictions += 1
+                excess -= 1
+
+    def maybe_save(self, segment):
+        """Lên lịch lưu segment nếu đã train thêm checkpoint_every lần (gọi sau khi train)"""
+        with self._lock:
+            entry = self._entries.get(segment)
+            if entry is None or entry.agent is None:
+                return False
+            if entry.agent.train_count - entry.saved_step < self.checkpoint_every:
+                return False
+            entry.saved_step = entry.agent.train_count
+            self._executor.submit(self._save, None, entry, True)
+        return True
+
+    def _save(self, segment, entry, force=False):
+        """
+        Lưu checkpoint + flush replay mmap (thread segment-flush)
+        Lúc evict chỉ ghi checkpoint khi có train mới kể từ lần lưu trước
+        """
+        agent = entry.agent
+        try:
+            if force or agent.train_count != entry.saved_step:
+                atomic_save(agent.snapshot(), os.path.join(entry.directory, MODEL_FILE))
+                entry.saved_step = agent.train_count
+            if hasattr(agent.memory, "flush"):
+                agent.memory.flush()
+            self.saves += 1
+            self.last_error = None
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"Không thể lưu agent segment: {e}")
+        finally:
+            if segment is not None:
+                with self._lock:
+                    self._flushing.pop(segment, None)
+
+    def close(self):
+        """Lưu toàn bộ agent còn trong RAM và chờ ghi xong (shutdown)"""
+        with self._lock:
+            entries = [(segment, entry) for segment, entry in self._entries.items() if entry.agent is not None]
+            self._entries.clear()
+        for segment, entry in entries:
+            self._flushing[segment] = self._executor.submit(self._save, segment, entry)
+        self._executor.shutdown(wait=True)
+
+    def stats(self):
+        """Thống kê cho /status"""
+        with self._lock:
+            resident = len(self._entries)
+            flushing = len(self._flushing)
+        return {
+            "resident": resident,
+            "max_resident": self.max_resident,
+            "segments": len(self._known) if self._known is not None else None,
+            "max_segments": self.max_segments,
+            "rejected": self.rejected,
+            "hits": self.hits,
+            "loads": self.loads,
+            "evictions": self.evictions,
+            "pending_flushes": flushing,
+            "saves": self.saves,
+            "last_error": self.last_error
+        }
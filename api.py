@@ -1,14 +1,61 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel, Field, validator
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import PlainTextResponse
 from typing import List, Optional
 import numpy as np
+import hmac
+import json
 import os
+import threading
+import time
+import metrics
 from pathlib import Path
-from agent import DQNAgent
-from state_encoder import encode_state
-from config import MAX_PRODUCTS, CATEGORIES, GENDER_MAP, AGE_MAP, POSITION_MAP
+from agent import create_agent
+from agent_registry import AgentRegistry, SegmentLimitError
+from batcher import InferenceBatcher
+from trainer import BackgroundTrainer
+from checkpoint import CheckpointManager
+from registry import ModelRegistry
+from shared_weights import WeightSubscriber
+from trainer_process import TrainerClient
+from train_offline import OfflineTrainer, validate_records, encode_transitions
+from schemas import RecommendInput, TrainInput, SnapshotInput
+from responses import ORJSONResponse, validation_error_handler
+from state_encoder import encode_state, encode_states, encode_states_sparse
+from config import (
+    NUM_ACTIONS, MODEL_PATH, ADMIN_TOKEN,
+    BATCH_MAX_WAIT_US, BATCH_MAX_SIZE, RECOMMEND_BATCH_MAX_ITEMS,
+    TRAIN_MODE, TRAIN_QUEUE_MAXSIZE, TRAIN_QUEUE_TIMEOUT_SEC, UPDATES_PER_SAMPLE,
+    TARGET_UPDATE_EVERY, STREAM_CHUNK_SIZE, STREAM_UPDATES_PER_SAMPLE, STREAM_MAX_ERRORS, STREAM_MAX_LINE_BYTES,
+    REPLAY_CAPACITY, REPLAY_PATH, REPLAY_COMPACT, SPARSE_INFERENCE, SEGMENT_REPLAY_CAPACITY,
+    CHECKPOINT_EVERY_STEPS, CHECKPOINT_INTERVAL_SEC, BACKUP_DIR, BACKUP_EVERY_STEPS,
+    BACKUP_KEEP_LAST, BACKUP_KEEP_EVERY,
+    PUBLISH_EVERY, INFERENCE_NUM_THREADS, TRAIN_NUM_THREADS, TOPK_CACHE_SIZE,
+    INFERENCE_PRECISION, QUANT_MIN_TOPK_OVERLAP, QUANT_CHECK_SAMPLES, QUANT_CHECK_K,
+    SERVING_MODE, SHARED_WEIGHTS_NAME, WEIGHTS_SYNC_INTERVAL_SEC
+)
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    # Shutdown: trainer nền xử lý nốt hàng đợi, ghi nốt checkpoint
+    if trainer is not None:
+        trainer.stop()
+    if checkpoints is not None:
+        checkpoints.close()
+    if subscriber is not None:
+        subscriber.stop()
+    if segments is not None:
+        segments.close()
+    # Replay buffer mmap: đẩy các trang đã ghi xuống đĩa
+    if hasattr(agent.memory, "flush"):
+        agent.memory.flush()
+
+# Response serialize bằng orjson; route hot path trả thẳng ORJSONResponse (bỏ qua jsonable_encoder)
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+app.add_exception_handler(RequestValidationError, validation_error_handler)
 
 # STATE_DIM calculation:
 # Common: 3(gender) + 5(age) + 7(day) = 15
@@ -16,185 +63,614 @@ app = FastAPI()
 # Position encoding: 3 (one-hot)
 # Total: 15 + 69 + 3 = 87
 STATE_DIM = 87
-ACTION_DIM = MAX_PRODUCTS
-MODEL_PATH = "dqn_model.pt"  # File model chính
+ACTION_DIM = NUM_ACTIONS  # MAX_PRODUCTS hoặc CATALOG_SIZE (ACTION_SPACE = "embedding")
+
+# Inference int8 / fp16 (kèm kiểm tra top-k so với float32)
+QUANT_OPTIONS = dict(precision=INFERENCE_PRECISION, quant_min_overlap=QUANT_MIN_TOPK_OVERLAP,
+                     quant_check_samples=QUANT_CHECK_SAMPLES, quant_check_k=QUANT_CHECK_K)
 
-agent = DQNAgent(STATE_DIM, ACTION_DIM)
+if SERVING_MODE == "worker":
+    # Worker chỉ serve: không giữ replay buffer, không train, không ghi checkpoint
+    agent = create_agent(STATE_DIM, memory_capacity=1,
+                         inference_threads=INFERENCE_NUM_THREADS, cache_size=TOPK_CACHE_SIZE,
+                         **QUANT_OPTIONS)
+else:
+    # Replay buffer mmap (REPLAY_PATH) được mở lại tự động cùng dqn_model.pt
+    agent = create_agent(STATE_DIM, memory_capacity=REPLAY_CAPACITY, memory_path=REPLAY_PATH,
+                         compact_replay=REPLAY_COMPACT, publish_every=PUBLISH_EVERY,
+                         inference_threads=INFERENCE_NUM_THREADS, train_threads=TRAIN_NUM_THREADS,
+                         cache_size=TOPK_CACHE_SIZE, **QUANT_OPTIONS)
+
+# Registry version model (models/), activate / rollback qua /admin/models
+registry = ModelRegistry()
+active_version = registry.manifest()["active"]
 
 # Tự động load model nếu có file tồn tại
-if os.path.exists(MODEL_PATH):
+if SERVING_MODE == "worker" and active_version is not None:
+    # Worker chỉ cần weights: map snapshot của registry, không unpickle checkpoint + optimizer
+    agent.swap_weights(registry.load(active_version))
+    print(f"Đã load model {active_version} từ registry {registry.root}")
+elif os.path.exists(MODEL_PATH):
     try:
         agent.load_model(MODEL_PATH)
         print(f"Đã load model từ {MODEL_PATH}")
         print(f"  - Epsilon: {agent.epsilon:.3f}")
         print(f"  - Model đã được train: {agent.is_trained}")
+        print(f"  - Replay buffer: {len(agent.memory)} experiences")
     except Exception as e:
         print(f"Không thể load model: {e}")
 else:
     print(f"Chưa có model. Sẽ bắt đầu từ đầu (cold start)")
 
-# Data model cho /recommend
-class RecommendInput(BaseModel):
-    raw_data: dict
-    position: str
-    
-    @validator('position')
-    def validate_position(cls, v):
-        if v not in POSITION_MAP:
-            raise ValueError(f"position phải là một trong: {list(POSITION_MAP.keys())}")
-        return v
+# Gom các request /recommend đồng thời thành 1 lần forward
+batcher = InferenceBatcher(agent, max_wait_us=BATCH_MAX_WAIT_US, max_batch_size=BATCH_MAX_SIZE)
+
+checkpoints = None
+trainer = None
+trainer_client = None
+subscriber = None
+
+if SERVING_MODE == "worker":
+    # Transition gửi tới trainer_process.py, weights nạp từ shared memory
+    trainer_client = TrainerClient()
+    subscriber = WeightSubscriber(agent, SHARED_WEIGHTS_NAME, interval_sec=WEIGHTS_SYNC_INTERVAL_SEC)
+    subscriber.start()
+else:
+    # Lưu model nền (atomic, giới hạn tần suất) + backup có retention
+    checkpoints = CheckpointManager(
+        agent, MODEL_PATH,
+        every_steps=CHECKPOINT_EVERY_STEPS,
+        interval_sec=CHECKPOINT_INTERVAL_SEC,
+        backup_dir=BACKUP_DIR,
+        backup_every=BACKUP_EVERY_STEPS,
+        keep_last=BACKUP_KEEP_LAST,
+        keep_every=BACKUP_KEEP_EVERY
+    )
     
-    @validator('raw_data')
-    def validate_raw_data(cls, v):
-        # Gender validation
-        if 'gender' in v and v['gender'] not in GENDER_MAP:
-            raise ValueError(f"gender phải là một trong: {list(GENDER_MAP.keys())}")
-        
-        # Age group validation
-        if 'age_group' in v and v['age_group'] not in AGE_MAP:
-            raise ValueError(f"age_group phải là một trong: {list(AGE_MAP.keys())}")
-        
-        # Day of week validation
-        if 'day_of_week' in v:
-            day = v['day_of_week']
-            if not isinstance(day, int) or day < 1 or day > 7:
-                raise ValueError("day_of_week phải là số nguyên từ 1-7")
-        
-        # Category validation
-        if 'category' in v:
-            cats = v['category'] if isinstance(v['category'], list) else [v['category']]
-            invalid_cats = [c for c in cats if c not in CATEGORIES]
-            if invalid_cats:
-                raise ValueError(f"category không hợp lệ: {invalid_cats}. Phải nằm trong: {CATEGORIES}")
-        
-        # Product IDs validation
-        if 'product_ids' in v:
-            products = v['product_ids'] if isinstance(v['product_ids'], list) else [v['product_ids']]
-            for pid in products:
-                if not isinstance(pid, int) or pid < 1 or pid > MAX_PRODUCTS:
-                    raise ValueError(f"product_id phải là số nguyên từ 1-{MAX_PRODUCTS}")
-        
-        # Numeric fields validation
-        if 'num_products' in v:
-            if not isinstance(v['num_products'], (int, float)) or v['num_products'] < 0:
-                raise ValueError("num_products phải là số không âm")
-        
-        if 'total_value' in v:
-            if not isinstance(v['total_value'], (int, float)) or v['total_value'] < 0:
-                raise ValueError("total_value phải là số không âm")
-        
-        if 'avg_value' in v:
-            if not isinstance(v['avg_value'], (int, float)) or v['avg_value'] < 0:
-                raise ValueError("avg_value phải là số không âm")
-        
-        if 'recent_searches' in v:
-            if not isinstance(v['recent_searches'], (int, float)) or v['recent_searches'] < 0:
-                raise ValueError("recent_searches phải là số không âm")
-        
-        return v
+    # Trainer nền (chỉ dùng khi TRAIN_MODE = "background")
+    if TRAIN_MODE == "background":
+        trainer = BackgroundTrainer(
+            agent, checkpoints,
+            updates_per_sample=UPDATES_PER_SAMPLE,
+            target_update_every=TARGET_UPDATE_EVERY,
+            maxsize=TRAIN_QUEUE_MAXSIZE,
+            put_timeout=TRAIN_QUEUE_TIMEOUT_SEC
+        )
+        trainer.start()
+
+# /train/stream ở chế độ sync: push_batch + train theo STREAM_UPDATES_PER_SAMPLE
+stream_trainer = None
+stream_lock = threading.Lock()
+if trainer_client is None and trainer is None:
+    stream_trainer = OfflineTrainer(agent, updates_per_sample=STREAM_UPDATES_PER_SAMPLE,
+                                    target_update_every=TARGET_UPDATE_EVERY)
+
+# Agent riêng theo segment (request có "segment"): load lazy từ segments/<segment>/, giữ LRU trong RAM
+# Train ngay trong request (như TRAIN_MODE = "sync"); worker mode không hỗ trợ (train ở trainer process)
+def _create_segment_agent(directory):
+    return create_agent(STATE_DIM, memory_capacity=SEGMENT_REPLAY_CAPACITY,
+                        memory_path=os.path.join(directory, "replay"), compact_replay=REPLAY_COMPACT,
+                        publish_every=PUBLISH_EVERY, **QUANT_OPTIONS)
+
+# 1 trainer mỗi segment cho cả /train và /train/stream (phần lẻ của updates_per_sample được giữ lại)
+def _create_segment_trainer(segment_agent):
+    return OfflineTrainer(segment_agent, updates_per_sample=STREAM_UPDATES_PER_SAMPLE,
+                          target_update_every=TARGET_UPDATE_EVERY)
+
+segments = AgentRegistry(_create_segment_agent, _create_segment_trainer) if SERVING_MODE != "worker" else None
+
+# Gauge tính lúc scrape /metrics
+metrics.register_gauge("dqn_epsilon", lambda: agent.epsilon, "Epsilon hiện tại")
+metrics.register_gauge("dqn_train_count", lambda: agent.train_count, "Tổng số lần train")
+metrics.register_gauge("dqn_inference_version", lambda: agent.inference_version, "Version inference model")
+metrics.register_gauge("dqn_replay_size", lambda: None if trainer_client else len(agent.memory),
+                       "Số experience trong replay buffer")
+metrics.register_gauge("dqn_replay_capacity", lambda: None if trainer_client else agent.memory.capacity,
+                       "Dung lượng replay buffer")
+metrics.register_gauge("dqn_train_queue_depth", lambda: trainer.queue.qsize() if trainer else None,
+                       "Số transition chờ trong hàng đợi training")
+metrics.register_gauge("dqn_inference_avg_batch_size", lambda: batcher.stats()["avg_batch_size"],
+                       "Kích thước batch trung bình của InferenceBatcher")
+metrics.register_gauge("dqn_topk_cache_hit_rate", lambda: agent.cache.stats()["hit_rate"] if agent.cache else None,
+                       "Tỷ lệ hit của cache top-k")
+metrics.register_gauge("dqn_segments_resident", lambda: segments.stats()["resident"] if segments else None,
+                       "Số agent segment đang giữ trong RAM")
+metrics.register_gauge("dqn_segment_loads", lambda: segments.loads if segments else None,
+                       "Số lần load agent segment từ đĩa")
+metrics.register_gauge("dqn_segment_evictions", lambda: segments.evictions if segments else None,
+                       "Số agent segment bị evict (LRU)")
+metrics.register_gauge("dqn_inference_quantized", lambda: float(agent.inference_precision != "fp32"),
+                       "1 nếu inference đang dùng model int8 / fp16")
+
+if metrics.enabled:
+    @app.middleware("http")
+    async def measure_request(request: Request, call_next):
+        # Mốc bắt đầu request: handler tính stage "validate" (đọc body + JSON + pydantic)
+        request.state.metrics_start = time.perf_counter()
+        response = await call_next(request)
+        # Label theo route template (vd /admin/models/{version}/activate), không theo URL thô:
+        # URL client tự đặt (404, version, ...) không tạo thêm series
+        route = request.scope.get("route")
+        metrics.observe("dqn_http_request_seconds", time.perf_counter() - request.state.metrics_start,
+                        path=route.path if route is not None else "unmatched")
+        return response
+
+def _observe_validation(request, name):
+    start = getattr(request.state, "metrics_start", None)
+    if start is not None:
+        metrics.observe(name, time.perf_counter() - start, stage="validate")
 
 @app.post("/recommend")
-def recommend(input: RecommendInput):
+async def recommend(input: RecommendInput, request: Request):
     """
-    Gợi ý top 10 sản phẩm dựa trên state
+    Gợi ý top k sản phẩm (mặc định 10) dựa trên state
     
     Strategy:
     - Chưa có model: Random 100%
     - Có model: Epsilon-greedy (epsilon% random, (1-epsilon)% model)
     - Epsilon giảm dần: 50% → 10% theo thời gian
+    - Phần model được gom batch với các request đồng thời (InferenceBatcher)
+    - Có segment: dùng agent của segment, không qua InferenceBatcher
     """
+    _observe_validation(request, "dqn_recommend_seconds")
     try:
         # Encode state từ dữ liệu thô
-        state = encode_state(input.raw_data, input.position)
-        top_actions = agent.select_top_actions(state, k=10)
+        with metrics.timer("dqn_recommend_seconds", stage="encode"):
+            state = encode_state(input.raw_data, input.position)
+        if input.segment is not None:
+            with metrics.timer("dqn_recommend_seconds", stage="inference"):
+                return ORJSONResponse(await run_in_threadpool(_segment_recommend, input.segment, state, input.k))
+        with metrics.timer("dqn_recommend_seconds", stage="inference"):
+            top_actions = await batcher.select_top_actions(state, k=input.k)
         
-        # Convert từ index (0-49) sang product ID (1-50)
-        # Ensure conversion to Python int (not numpy.int32)
-        product_ids = [int(action) + 1 for action in top_actions]
+        return ORJSONResponse(_recommend_response(top_actions))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Lỗi xử lý: {str(e)}")
+
+@app.post("/recommend/batch")
+def recommend_batch(inputs: List[RecommendInput]):
+    """
+    Gợi ý cho nhiều vị trí cùng lúc (vd: home + cart + search trên 1 trang)
+    - Encode toàn bộ trong 1 lần (encode_states)
+    - Epsilon-greedy quyết định riêng từng item, phần model chạy 1 lần forward
+    - Mỗi item có k riêng
+    - SPARSE_INFERENCE: encode dạng thưa, fc1 chỉ cộng các cột active
+    - Item có segment: mỗi segment 1 lần forward trên agent của segment đó
+    - Chạy trên threadpool (không qua InferenceBatcher): áp INFERENCE_NUM_THREADS trong lúc xử lý
+    """
+    if len(inputs) > RECOMMEND_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Tối đa {RECOMMEND_BATCH_MAX_ITEMS} item mỗi request")
+    
+    try:
+        with agent.inference_threads_scope():
+            results = _recommend_batch_results(inputs)
         
-        return {
-            "recommended_products": product_ids,
-            "count": len(product_ids),
-            "strategy": "random" if not agent.is_trained else f"epsilon-greedy (ε={agent.epsilon:.2f})",
-            "model_status": "trained" if agent.is_trained else "cold_start"
-        }
+        return ORJSONResponse({
+            "results": results,
+            "count": len(results)
+        })
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Lỗi xử lý: {str(e)}")
 
-# Data model cho /train
-class TrainInput(BaseModel):
-    raw_data: dict
-    position: str
-    action: int = Field(..., ge=1, le=MAX_PRODUCTS, description=f"Product ID phải từ 1-{MAX_PRODUCTS}")
-    reward: float = Field(..., description="Reward value (có thể âm hoặc dương)")
-    next_raw_data: dict
-    next_position: str
-    done: bool
+def _recommend_batch_results(inputs):
+    encode = encode_states_sparse if SPARSE_INFERENCE else encode_states
+    groups = {}
+    for i, item in enumerate(inputs):
+        groups.setdefault(item.segment, []).append(i)
+    if len(groups) == 1 and None in groups:
+        states = encode([(item.raw_data, item.position) for item in inputs])
+        batch_actions = agent.select_top_actions_batch(states, [item.k for item in inputs])
+        return [_recommend_response(top_actions) for top_actions in batch_actions]
     
-    @validator('position', 'next_position')
-    def validate_positions(cls, v):
-        if v not in POSITION_MAP:
-            raise ValueError(f"position phải là một trong: {list(POSITION_MAP.keys())}")
-        return v
+    results = [None] * len(inputs)
+    for segment, rows in groups.items():
+        states = encode([(inputs[i].raw_data, inputs[i].position) for i in rows])
+        ks = [inputs[i].k for i in rows]
+        if segment is None:
+            batch_actions = [_recommend_response(a) for a in agent.select_top_actions_batch(states, ks)]
+        else:
+            with _segment(segment, create=False) as entry:
+                if entry is None:
+                    batch_actions = [_cold_start_response(k) for k in ks]
+                else:
+                    batch_actions = [_recommend_response(a, entry.agent)
+                                     for a in entry.agent.select_top_actions_batch(states, ks)]
+        for i, result in zip(rows, batch_actions):
+            results[i] = result
+    return results
+
+def _recommend_response(top_actions, source=None):
+    # Convert từ index (0-49) sang product ID (1-50)
+    # Ensure conversion to Python int (not numpy.int32)
+    product_ids = [int(action) + 1 for action in top_actions]
+    source = source or agent
     
-    @validator('raw_data', 'next_raw_data')
-    def validate_raw_data_train(cls, v):
-        # Tái sử dụng validation logic từ RecommendInput
-        return RecommendInput.validate_raw_data(v)
+    return {
+        "recommended_products": product_ids,
+        "count": len(product_ids),
+        "strategy": "random" if not source.is_trained else f"epsilon-greedy (ε={source.epsilon:.2f})",
+        "model_status": "trained" if source.is_trained else "cold_start"
+    }
+
+SEGMENT_UNSUPPORTED = "segment không hỗ trợ khi SERVING_MODE = \"worker\""
+
+def _cold_start_response(k):
+    # Segment chưa có dữ liệu train: random như agent chưa train, không tạo agent
+    response = _recommend_response(agent.random_actions(k))
+    response.update(strategy="random", model_status="cold_start")
+    return response
+
+def _segment(segment, create=True):
+    """Entry của segment (context manager), 400 nếu worker mode, 403 nếu không được tạo segment mới"""
+    if segments is None:
+        raise HTTPException(status_code=400, detail=SEGMENT_UNSUPPORTED)
+    if create:
+        try:
+            segments.reserve(segment)
+        except SegmentLimitError as e:
+            raise HTTPException(status_code=403, detail=str(e))
+    return segments.use(segment, create=create)
+
+def _segment_recommend(segment, state, k):
+    # Chạy trên threadpool (không qua InferenceBatcher) → áp INFERENCE_NUM_THREADS như /recommend/batch
+    with agent.inference_threads_scope(), _segment(segment, create=False) as entry:
+        if entry is None:
+            response = _cold_start_response(k)
+        else:
+            response = _recommend_response(entry.agent.select_top_actions(state, k=k), entry.agent)
+    response["segment"] = segment
+    return response
+
+def _segment_train(input, state, action_index, next_state):
+    """/train cho agent của segment: push + train qua trainer của segment, checkpoint khi đến hạn / bị evict"""
+    with _segment(input.segment) as entry:
+        with entry.lock:
+            entry.trainer.push(state[None], np.array([action_index]), np.array([input.reward], dtype=np.float32),
+                               next_state[None], np.array([input.done]))
+        model_saved = segments.maybe_save(input.segment)
+        segment_agent = entry.agent
+        return {
+            "status": "trained",
+            "segment": input.segment,
+            "epsilon": float(segment_agent.epsilon),
+            "memory_size": len(segment_agent.memory),
+            "train_count": int(segment_agent.train_count),
+            "model_activated": bool(segment_agent.is_trained),
+            "model_saved": model_saved
+        }
 
 @app.post("/train")
-def train_step(input: TrainInput):
+def train_step(input: TrainInput, request: Request):
     """
     Training model từ user feedback
     - Train ngay sau mỗi feedback
     - Auto update target network mỗi 100 lần train
-    - Auto save model mỗi 500 lần train
+    - Lưu model nền theo lịch CHECKPOINT_EVERY_STEPS / CHECKPOINT_INTERVAL_SEC
+    - Backup mỗi BACKUP_EVERY_STEPS lần train vào checkpoints/ (có retention)
+    - TRAIN_MODE = "background": chỉ đưa vào hàng đợi, trainer nền train và save
+    - SERVING_MODE = "worker": gửi transition tới trainer process
+    - Có segment: train agent của segment ngay trong request (mọi TRAIN_MODE)
     """
+    _observe_validation(request, "dqn_train_request_seconds")
     try:
         # Encode state và next_state
-        state = encode_state(input.raw_data, input.position)
-        next_state = encode_state(input.next_raw_data, input.next_position)
+        with metrics.timer("dqn_train_request_seconds", stage="encode"):
+            state = encode_state(input.raw_data, input.position)
+            next_state = encode_state(input.next_raw_data, input.next_position)
         
         # Convert product ID (1-50) về action index (0-49)
         action_index = input.action - 1
         
+        if input.segment is not None:
+            return ORJSONResponse(_segment_train(input, state, action_index, next_state))
+        
+        if trainer_client is not None:
+            try:
+                with metrics.timer("dqn_train_request_seconds", stage="forward"):
+                    accepted, info = trainer_client.submit(state, action_index, input.reward, next_state, input.done)
+            except ConnectionError as e:
+                raise HTTPException(status_code=503, detail=str(e))
+            if not accepted:
+                raise HTTPException(status_code=503, detail="Hàng đợi training đầy, thử lại sau")
+            
+            return ORJSONResponse({
+                "status": "forwarded",
+                "epsilon": float(agent.epsilon),
+                "train_count": int(agent.train_count),
+                "model_activated": bool(agent.is_trained),
+                "model_saved": False,
+                "queue_depth": info["queue_depth"]
+            })
+        
+        if trainer is not None:
+            with metrics.timer("dqn_train_request_seconds", stage="enqueue"):
+                accepted = trainer.submit(state, action_index, input.reward, next_state, input.done)
+            if not accepted:
+                raise HTTPException(status_code=503, detail="Hàng đợi training đầy, thử lại sau")
+            
+            return ORJSONResponse({
+                "status": "queued",
+                "epsilon": float(agent.epsilon),
+                "memory_size": len(agent.memory),
+                "train_count": int(agent.train_count),
+                "model_activated": bool(agent.is_trained),
+                "model_saved": False,
+                "queue_depth": trainer.queue.qsize()
+            })
+        
         # Lưu vào memory
-        agent.memory.push(state, action_index, input.reward, next_state, input.done)
+        with metrics.timer("dqn_train_request_seconds", stage="push"):
+            agent.memory.push(state, action_index, input.reward, next_state, input.done)
         
         # Training
-        agent.train_step()
+        with metrics.timer("dqn_train_request_seconds", stage="train_step"):
+            agent.train_step()
         
         # Auto update target network mỗi 100 trains
-        if agent.train_count % 100 == 0:
-            agent.update_target()
-        
-        # LƯU MODEL SAU MỖI LẦN TRAIN
-        agent.save_model(MODEL_PATH)
+        if agent.train_count % TARGET_UPDATE_EVERY == 0:
+            with metrics.timer("dqn_train_request_seconds", stage="target_update"):
+                agent.update_target()
         
-        # Tạo checkpoint backup mỗi 100 lần train
-        if agent.train_count % 100 == 0:
-            agent.save_model(f"checkpoints/dqn_backup_{agent.train_count}.pt")
+        # Lưu model (snapshot nhanh, ghi file trên thread nền)
+        with metrics.timer("dqn_train_request_seconds", stage="checkpoint"):
+            model_saved = checkpoints.maybe_save()
         
-        return {
+        return ORJSONResponse({
             "status": "trained",
             "epsilon": float(agent.epsilon),
             "memory_size": len(agent.memory),
             "train_count": int(agent.train_count),
             "model_activated": bool(agent.is_trained),
-            "model_saved": True
-        }
+            "model_saved": model_saved
+        })
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Lỗi training: {str(e)}")
 
+@app.post("/train/stream")
+async def train_stream(request: Request):
+    """
+    Ingest nhiều transition trong 1 request (body NDJSON: mỗi dòng 1 JSON giống body /train)
+    - Đọc body theo stream, xử lý theo chunk STREAM_CHUNK_SIZE dòng:
+      parse + validate từng dòng → encode_states cả chunk → push_batch
+    - Dòng lỗi bị bỏ qua, không làm hỏng cả chunk
+    - sync: train STREAM_UPDATES_PER_SAMPLE lần cho mỗi transition, checkpoint theo lịch
+    - background / worker: đưa cả chunk vào hàng đợi trainer (đầy → phần còn lại tính queue_full)
+    - Response: số accepted / rejected / queue_full của từng chunk
+    - Dừng giữa chừng (503: mất kết nối trainer, 413: dòng dài hơn STREAM_MAX_LINE_BYTES):
+      response vẫn có kết quả các chunk đã xử lý + "error", "resume_from_line"
+      (các dòng từ resume_from_line chưa được nhận, gửi lại từ dòng đó)
+    """
+    chunks = []
+    lines = []
+    failure = None
+    try:
+        async for line in _read_lines(request):
+            lines.append(line)
+            if len(lines) >= STREAM_CHUNK_SIZE:
+                chunks.append(await run_in_threadpool(_ingest_chunk, lines, len(chunks)))
+                if "error" in chunks[-1]:
+                    failure = (503, chunks[-1]["error"], lines[0][0])
+                    break
+                lines = []
+        else:
+            if lines:
+                chunks.append(await run_in_threadpool(_ingest_chunk, lines, len(chunks)))
+                if "error" in chunks[-1]:
+                    failure = (503, chunks[-1]["error"], lines[0][0])
+    except _LineTooLong as e:
+        failure = (413, f"Dòng {e.line_no} dài hơn {STREAM_MAX_LINE_BYTES} byte", lines[0][0] if lines else e.line_no)
+    
+    content = {
+        "status": "trained" if stream_trainer is not None else "forwarded" if trainer_client is not None else "queued",
+        "accepted": sum(chunk["accepted"] for chunk in chunks),
+        "rejected": sum(chunk["rejected"] for chunk in chunks),
+        "queue_full": sum(chunk["queue_full"] for chunk in chunks),
+        "chunks": chunks,
+        "epsilon": float(agent.epsilon),
+        "train_count": int(agent.train_count),
+        "model_activated": bool(agent.is_trained)
+    }
+    if failure is None:
+        return content
+    status_code, content["error"], content["resume_from_line"] = failure
+    return ORJSONResponse(content, status_code=status_code)
+
+class _LineTooLong(Exception):
+    def __init__(self, line_no):
+        super().__init__(line_no)
+        self.line_no = line_no
+
+async def _read_lines(request):
+    """
+    (số dòng, nội dung) của các dòng không rỗng trong body NDJSON
+    Phần chưa hết dòng không vượt quá STREAM_MAX_LINE_BYTES → mỗi lần split tốn O(giới hạn), không O(body)
+    """
+    line_no = 0
+    pending = b""
+    async for data in request.stream():
+        pending += data
+        *complete, pending = pending.split(b"\n")
+        for line in complete:
+            line_no += 1
+            if len(line) > STREAM_MAX_LINE_BYTES:
+                raise _LineTooLong(line_no)
+            if line.strip():
+                yield line_no, line
+        if len(pending) > STREAM_MAX_LINE_BYTES:
+            raise _LineTooLong(line_no + 1)
+    if pending.strip():
+        yield line_no + 1, pending
+
+def _ingest_chunk(lines, index):
+    """Parse + validate + encode + push 1 chunk dòng NDJSON (chạy trong threadpool)"""
+    errors = []
+    records, record_lines = [], []
+    with metrics.timer("dqn_train_stream_seconds", stage="validate"):
+        for line_no, line in lines:
+            try:
+                records.append(json.loads(line))
+                record_lines.append(line_no)
+            except ValueError as e:
+                errors.append((line_no, f"JSON không hợp lệ: {e}"))
+        items, invalid = validate_records(records)
+        errors.extend((record_lines[i], error) for i, error in invalid)
+        
+        # Record có segment: push vào agent của segment đó
+        segment_items = {}
+        if any(item.segment is not None for item in items):
+            invalid_rows = {i for i, _ in invalid}
+            item_lines = [line_no for i, line_no in enumerate(record_lines) if i not in invalid_rows]
+            global_items = []
+            for line_no, item in zip(item_lines, items):
+                if item.segment is None:
+                    global_items.append(item)
+                elif segments is None:
+                    errors.append((line_no, SEGMENT_UNSUPPORTED))
+                else:
+                    try:
+                        segments.reserve(item.segment)
+                    except SegmentLimitError as e:
+                        errors.append((line_no, str(e)))
+                        continue
+                    segment_items.setdefault(item.segment, []).append(item)
+            items = global_items
+    
+    total = len(items) + sum(len(group) for group in segment_items.values())
+    accepted = 0
+    error = None
+    if items:
+        with metrics.timer("dqn_train_stream_seconds", stage="encode"):
+            transitions = encode_transitions(items)
+        with metrics.timer("dqn_train_stream_seconds", stage="push"):
+            if trainer_client is not None:
+                try:
+                    accepted, _ = trainer_client.submit_batch(*transitions)
+                except ConnectionError as e:
+                    # Cả chunk chưa được nhận: tính vào queue_full, train_stream ngừng đọc
+                    error = str(e)
+            elif trainer is not None:
+                accepted = trainer.submit_batch(*transitions)
+            else:
+                with stream_lock:
+                    accepted = stream_trainer.push(*transitions)
+                    checkpoints.maybe_save()
+    for segment, group in segment_items.items():
+        with metrics.timer("dqn_train_stream_seconds", stage="encode"):
+            transitions = encode_transitions(group)
+        with metrics.timer("dqn_train_stream_seconds", stage="push"):
+            with _segment(segment) as entry:
+                with entry.lock:
+                    accepted += entry.trainer.push(*transitions)
+                segments.maybe_save(segment)
+    
+    queue_full = total - accepted
+    metrics.inc("dqn_train_stream_records_total", accepted, result="accepted")
+    metrics.inc("dqn_train_stream_records_total", len(errors), result="rejected")
+    metrics.inc("dqn_train_stream_records_total", queue_full, result="queue_full")
+    result = {
+        "chunk": index,
+        "lines": [lines[0][0], lines[-1][0]],
+        "accepted": accepted,
+        "rejected": len(errors),
+        "queue_full": queue_full,
+        "errors": [{"line": line_no, "error": message} for line_no, message in sorted(errors)[:STREAM_MAX_ERRORS]]
+    }
+    if error is not None:
+        result["error"] = error
+    return result
+
+def _check_admin(token):
+    # Chưa đặt DQN_ADMIN_TOKEN → /admin/* bị tắt (không mở swap / rollback weights cho mọi client)
+    if ADMIN_TOKEN is None:
+        raise HTTPException(status_code=403, detail="/admin/* bị tắt: chưa cấu hình DQN_ADMIN_TOKEN")
+    if token is None or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Sai X-Admin-Token")
+
+def _registry_command(op, arg=None):
+    """
+    Chạy thao tác registry ở nơi sở hữu weights: agent của process này,
+    hoặc trainer process (worker) → weights mới tới các worker qua shared memory
+    """
+    try:
+        if trainer_client is not None:
+            return trainer_client.registry(op, arg)
+        result = registry.command(agent, op, arg)
+    except ConnectionError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except (ValueError, RuntimeError) as e:
+        raise HTTPException(status_code=400, detail=f"Lỗi registry: {str(e)}")
+    if op in ("activate", "rollback"):
+        # dqn_model.pt theo weights mới, restart không quay lại model cũ
+        checkpoints.request_save()
+    return result
+
+@app.get("/admin/models")
+def list_models(x_admin_token: Optional[str] = Header(None)):
+    """Danh sách version trong registry, version đang active và version để rollback"""
+    _check_admin(x_admin_token)
+    return _registry_command("list")
+
+@app.post("/admin/models/snapshot")
+def snapshot_model(input: Optional[SnapshotInput] = None, x_admin_token: Optional[str] = Header(None)):
+    """Lưu weights hiện tại thành version mới (chỉ weights, không có optimizer state)"""
+    _check_admin(x_admin_token)
+    return _registry_command("snapshot", input.note if input is not None else None)
+
+@app.post("/admin/models/{version}/activate")
+def activate_model(version: str, x_admin_token: Optional[str] = Header(None)):
+    """
+    Load version (memory-map) rồi swap vào agent, không cần restart
+    /recommend đang chạy dùng nốt model cũ, request sau dùng model mới
+    """
+    _check_admin(x_admin_token)
+    return _registry_command("activate", version)
+
+@app.post("/admin/models/rollback")
+def rollback_model(x_admin_token: Optional[str] = Header(None)):
+    """Swap về weights trước lần activate gần nhất"""
+    _check_admin(x_admin_token)
+    return _registry_command("rollback")
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Metrics theo định dạng Prometheus text (latency từng stage, loss, TD error, hàng đợi, ...)"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/status")
 def get_status():
     """Lấy thông tin trạng thái agent"""
+    trainer_status = trainer.status() if trainer is not None else None
+    memory_size = len(agent.memory)
+    if trainer_client is not None:
+        # Worker: replay buffer nằm ở trainer process
+        try:
+            trainer_status = trainer_client.status()
+            memory_size = trainer_status["memory_size"]
+        except ConnectionError as e:
+            trainer_status = {"running": False, "last_error": str(e)}
+    
     return {
         "epsilon": float(agent.epsilon),
-        "memory_size": len(agent.memory),
+        "memory_size": memory_size,
         "train_count": int(agent.train_count),
         "model_activated": bool(agent.is_trained),
         "state_dim": STATE_DIM,
         "action_dim": ACTION_DIM,
-        "strategy": "random (cold_start)" if not agent.is_trained else f"epsilon-greedy (ε={agent.epsilon:.2f})"
+        "strategy": "random (cold_start)" if not agent.is_trained else f"epsilon-greedy (ε={agent.epsilon:.2f})",
+        "inference_version": int(agent.inference_version),
+        "inference_precision": agent.quantization_status(),
+        "inference_batching": batcher.stats(),
+        "topk_cache": agent.cache.stats() if agent.cache is not None else None,
+        "serving_mode": SERVING_MODE,
+        "train_mode": TRAIN_MODE,
+        "trainer": trainer_status,
+        "weights": subscriber.status() if subscriber is not None else None,
+        "checkpoint": checkpoints.status() if checkpoints is not None else None,
+        "segments": segments.stats() if segments is not None else None
     }
@@ -0,0 +1,94 @@
+# api_inference.py
+"""
+API chỉ gợi ý (replica inference), không import torch
+
+    python numpy_inference.py export      # dqn_model.pt → dqn_weights.npy + dqn_weights.json
+    uvicorn api_inference:app --workers 4
+
+- Dùng NumpyAgent (weights memory-mapped, các worker dùng chung page cache)
+- Chỉ có /recommend, /recommend/batch, /status; /train vẫn chạy trên api.py
+- Export lại weights rồi restart replica để nhận model mới
+"""
+from fastapi import FastAPI, HTTPException
+from fastapi.exceptions import RequestValidationError
+from typing import List
+from batcher import InferenceBatcher
+from numpy_inference import NumpyAgent
+from schemas import RecommendInput
+from responses import ORJSONResponse, validation_error_handler
+from state_encoder import encode_state, encode_states, STATE_DIM
+from config import (
+    NUMPY_WEIGHTS_PATH, BATCH_MAX_WAIT_US, BATCH_MAX_SIZE, RECOMMEND_BATCH_MAX_ITEMS
+)
+
+app = FastAPI(default_response_class=ORJSONResponse)
+app.add_exception_handler(RequestValidationError, validation_error_handler)
+
+agent = NumpyAgent(NUMPY_WEIGHTS_PATH)
+print(f"Đã load weights NumPy từ {NUMPY_WEIGHTS_PATH}")
+print(f"  - Epsilon: {agent.epsilon:.3f}")
+print(f"  - Train count: {agent.train_count}")
+
+batcher = InferenceBatcher(agent, max_wait_us=BATCH_MAX_WAIT_US, max_batch_size=BATCH_MAX_SIZE)
+
+@app.post("/recommend")
+async def recommend(input: RecommendInput):
+    """Gợi ý top k sản phẩm (giống api.py, forward bằng NumPy)"""
+    _reject_segment([input])
+    try:
+        state = encode_state(input.raw_data, input.position)
+        top_actions = await batcher.select_top_actions(state, k=input.k)
+        return ORJSONResponse(_recommend_response(top_actions))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Lỗi xử lý: {str(e)}")
+
+@app.post("/recommend/batch")
+def recommend_batch(inputs: List[RecommendInput]):
+    """Gợi ý cho nhiều vị trí cùng lúc (giống api.py)"""
+    if len(inputs) > RECOMMEND_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Tối đa {RECOMMEND_BATCH_MAX_ITEMS} item mỗi request")
+    _reject_segment(inputs)
+
+    try:
+        states = encode_states([(item.raw_data, item.position) for item in inputs])
+        batch_actions = agent.select_top_actions_batch(states, [item.k for item in inputs])
+
+        results = [_recommend_response(top_actions) for top_actions in batch_actions]
+        return ORJSONResponse({
+            "results": results,
+            "count": len(results)
+        })
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Lỗi xử lý: {str(e)}")
+
+def _reject_segment(inputs):
+    # Replica chỉ có 1 model (agent chung), agent theo segment nằm ở api.py
+    if any(item.segment is not None for item in inputs):
+        raise HTTPException(status_code=400, detail="Replica inference không hỗ trợ segment")
+
+def _recommend_response(top_actions):
+    # Convert từ index (0-49) sang product ID (1-50)
+    product_ids = [int(action) + 1 for action in top_actions]
+
+    return {
+        "recommended_products": product_ids,
+        "count": len(product_ids),
+        "strategy": "random" if not agent.is_trained else f"epsilon-greedy (ε={agent.epsilon:.2f})",
+        "model_status": "trained" if agent.is_trained else "cold_start"
+    }
+
+@app.get("/status")
+def get_status():
+    """Trạng thái replica inference"""
+    return {
+        "epsilon": float(agent.epsilon),
+        "train_count": int(agent.train_count),
+        "model_activated": bool(agent.is_trained),
+        "state_dim": STATE_DIM,
+        "action_dim": agent.action_dim,
+        "strategy": "random (cold_start)" if not agent.is_trained else f"epsilon-greedy (ε={agent.epsilon:.2f})",
+        "inference_backend": "numpy",
+        "inference_version": int(agent.inference_version),
+        "inference_batching": batcher.stats(),
+        "weights_path": NUMPY_WEIGHTS_PATH
+    }
@@ -0,0 +1,96 @@
+# batcher.py
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+
+class InferenceBatcher:
+    """
+    Gom các request /recommend đồng thời thành 1 batch để chạy 1 lần forward
+
+    - Chờ tối đa max_wait_us micro-giây hoặc đến khi đủ max_batch_size request
+    - Cold start và epsilon-greedy vẫn quyết định riêng cho từng request
+      (request random trả về ngay, không vào hàng đợi)
+    - Forward chạy trên 1 thread riêng để không chặn event loop
+    """
+    def __init__(self, agent, max_wait_us=500, max_batch_size=64):
+        self.agent = agent
+        self.max_wait = max_wait_us / 1_000_000
+        self.max_batch_size = max_batch_size
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference",
+                                            initializer=agent.init_inference_thread)
+        self._loop = None
+        self._queue = None
+        self._worker = None
+
+        # Tracking
+        self.batch_count = 0
+        self.request_count = 0
+
+    async def select_top_actions(self, state, k=10):
+        """Tương đương agent.select_top_actions nhưng phần model được gom batch"""
+        if not self.agent.use_model():
+            return self.agent.random_actions(k)
+
+        self._ensure_worker()
+        future = self._loop.create_future()
+        self._queue.put_nowait((state, k, future))
+        return await future
+
+    def _ensure_worker(self):
+        # Gắn hàng đợi với event loop đang chạy (tạo lại nếu loop thay đổi)
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+
+    async def _collect(self):
+        """Lấy 1 batch từ hàng đợi: chờ request đầu tiên rồi gom thêm trong max_wait"""
+        items = [await self._queue.get()]
+        deadline = self._loop.time() + self.max_wait
+
+        while len(items) < self.max_batch_size:
+            if not self._queue.empty():
+                items.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - self._loop.time()
+            if timeout <= 0:
+                break
+            try:
+                items.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return items
+
+    async def _run(self):
+        while True:
+            items = await self._collect()
+            states = np.stack([state for state, _, _ in items])
+            ks = [k for _, k, _ in items]
+
+            try:
+                results = await self._loop.run_in_executor(
+                    self._executor, self.agent.model_top_actions, states, ks
+                )
+            except Exception as e:
+                for _, _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.batch_count += 1
+            self.request_count += len(items)
+            for (_, _, future), actions in zip(items, results):
+                if not future.done():
+                    future.set_result(actions)
+
+    def stats(self):
+        """Thống kê batching cho /status"""
+        return {
+            "batches": self.batch_count,
+            "requests": self.request_count,
+            "avg_batch_size": round(self.request_count / self.batch_count, 2) if self.batch_count else 0.0,
+            "max_wait_us": int(self.max_wait * 1_000_000),
+            "max_batch_size": self.max_batch_size
+        }
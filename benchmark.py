@@ -0,0 +1,281 @@
+# benchmark.py
+"""
+Benchmark các hot path: encode → infer → train → save, và end-to-end /recommend, /train
+
+    python benchmark.py --out bench.json                    # chạy đầy đủ, lưu JSON
+    python benchmark.py --quick --only micro                # chạy nhanh phần micro
+    python benchmark.py --out new.json --compare bench.json --threshold 0.2
+        # so với lần chạy trước, exit 1 nếu p50 chậm hơn quá 20%
+
+- Micro: encode_state / encode_states, ReplayBuffer.sample (theo kích thước buffer
+  và batch size), model_top_actions, DQNAgent.train_step, save_model
+- End-to-end: FastAPI TestClient trong thư mục tạm (không đụng dqn_model.pt / replay_data),
+  gửi request đồng thời theo --concurrency
+- Kết quả: p50/p95/p99 (micro-giây), mean và throughput (ops/s)
+- Seed cố định, số thread torch cố định (--threads) để các lần chạy so sánh được
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import torch
+from agent import DQNAgent
+from replay_buffer import ArrayReplayBuffer, MmapReplayBuffer, CompactReplayBuffer
+from state_encoder import encode_state, encode_states, STATE_DIM, CONTINUOUS_COLS
+from config import CATEGORIES, MAX_PRODUCTS, MODEL_PATH
+
+
+def percentile_stats(latencies, elapsed=None):
+    """Thống kê từ danh sách latency (giây); elapsed: tổng thời gian thực (khi chạy song song)"""
+    latencies = np.asarray(latencies, dtype=np.float64) * 1e6
+    elapsed = elapsed if elapsed is not None else latencies.sum() / 1e6
+    return {
+        "n": int(len(latencies)),
+        "p50_us": round(float(np.percentile(latencies, 50)), 2),
+        "p95_us": round(float(np.percentile(latencies, 95)), 2),
+        "p99_us": round(float(np.percentile(latencies, 99)), 2),
+        "mean_us": round(float(latencies.mean()), 2),
+        "ops_per_sec": round(len(latencies) / elapsed, 2) if elapsed > 0 else 0.0
+    }
+
+
+def measure(fn, iterations, warmup=10):
+    """Chạy fn iterations lần, đo từng lần"""
+    for _ in range(warmup):
+        fn()
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+    return percentile_stats(latencies)
+
+
+def random_raw_data(rng, position):
+    raw_data = {
+        "gender": ["Male", "Female", "Other"][rng.integers(3)],
+        "age_group": ["U20", "U30", "U40", "U50", "U60"][rng.integers(5)],
+        "day_of_week": int(rng.integers(1, 8)),
+    }
+    if position == "search":
+        raw_data["recent_searches"] = int(rng.integers(0, 50))
+    elif position == "cart":
+        products = [int(p) for p in rng.choice(MAX_PRODUCTS, 3, replace=False) + 1]
+        raw_data.update({
+            "num_products": len(products),
+            "total_value": float(rng.uniform(1e5, 1e7)),
+            "avg_value": float(rng.uniform(1e5, 2e6)),
+            "products": products,
+            "category": [str(c) for c in rng.choice(CATEGORIES, 2, replace=False)],
+        })
+    else:
+        raw_data.update({
+            "top_products": [int(p) for p in rng.choice(MAX_PRODUCTS, 5, replace=False) + 1],
+            "top_categories": [str(c) for c in rng.choice(CATEGORIES, 2, replace=False)],
+        })
+    return raw_data
+
+
+def random_items(rng, n):
+    positions = ["search", "cart", "home"]
+    items = []
+    for i in range(n):
+        position = positions[i % 3]
+        items.append((random_raw_data(rng, position), position))
+    return items
+
+
+def fill_buffer(buffer, rng, size):
+    states = encode_states(random_items(rng, min(size, 3000)))
+    for start in range(0, size, len(states)):
+        n = min(len(states), size - start)
+        buffer.push_batch(states[:n], rng.integers(0, MAX_PRODUCTS, n), rng.random(n, dtype=np.float32),
+                          states[::-1][:n], np.zeros(n, dtype=np.bool_))
+
+
+def run_micro(args, rng, workdir):
+    results = {}
+    iterations = args.iterations
+
+    # encode
+    items = random_items(rng, 256)
+    for position in ("search", "cart", "home"):
+        raw_data = random_raw_data(rng, position)
+        results[f"encode_state/{position}"] = measure(lambda: encode_state(raw_data, position), iterations)
+    for batch_size in args.batch_sizes:
+        batch = items[:batch_size]
+        results[f"encode_states/batch={batch_size}"] = measure(lambda: encode_states(batch), iterations)
+
+    # replay sample
+    for kind in ("array", "mmap", "compact"):
+        for size in args.buffer_sizes:
+            if kind == "array":
+                buffer = ArrayReplayBuffer(STATE_DIM, capacity=size)
+            elif kind == "mmap":
+                buffer = MmapReplayBuffer(os.path.join(workdir, f"replay_{size}"), STATE_DIM, capacity=size)
+            else:
+                buffer = CompactReplayBuffer(STATE_DIM, capacity=size, dense_cols=CONTINUOUS_COLS)
+            fill_buffer(buffer, rng, size)
+            for batch_size in args.batch_sizes:
+                results[f"replay_sample/{kind}/size={size}/batch={batch_size}"] = measure(
+                    lambda: buffer.sample(batch_size), iterations)
+
+    # inference + train + save
+    agent = DQNAgent(STATE_DIM, MAX_PRODUCTS, memory_capacity=max(args.buffer_sizes))
+    fill_buffer(agent.memory, rng, max(args.buffer_sizes))
+    agent.train_step()
+    states = encode_states(items)
+    for batch_size in args.batch_sizes:
+        batch = states[:batch_size]
+        results[f"model_top_actions/batch={batch_size}"] = measure(
+            lambda: agent.model_top_actions(batch, [10] * len(batch)), iterations)
+        results[f"train_step/batch={batch_size}"] = measure(
+            lambda: agent.train_step(batch_size), max(iterations // 5, 20))
+
+    path = os.path.join(workdir, "bench_model.pt")
+    results["save_model"] = measure(lambda: agent.save_model(path), max(iterations // 10, 10), warmup=2)
+    return results
+
+
+def run_e2e(args, rng, workdir):
+    """Load test /recommend và /train qua TestClient (api.py import trong thư mục tạm)"""
+    from fastapi.testclient import TestClient
+
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    if os.path.exists(os.path.join(repo_dir, MODEL_PATH)) and not args.cold_start:
+        shutil.copy(os.path.join(repo_dir, MODEL_PATH), os.path.join(workdir, MODEL_PATH))
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        import api
+        recommend_bodies = []
+        train_bodies = []
+        for raw_data, position in random_items(rng, 300):
+            recommend_bodies.append({"raw_data": raw_data, "position": position, "k": 10})
+            train_bodies.append({
+                "raw_data": raw_data, "position": position,
+                "action": int(rng.integers(1, MAX_PRODUCTS + 1)), "reward": float(rng.choice([-1.0, 1.0, 5.0])),
+                "next_raw_data": raw_data, "next_position": position, "done": False
+            })
+
+        results = {}
+        with TestClient(api.app) as client:
+            for name, url, bodies in (("recommend", "/recommend", recommend_bodies),
+                                      ("recommend_batch", "/recommend/batch", None),
+                                      ("train", "/train", train_bodies)):
+                if bodies is None:
+                    bodies = [recommend_bodies[i:i + 3] for i in range(0, len(recommend_bodies), 3)]
+
+                def call(i):
+                    start = time.perf_counter()
+                    response = client.post(url, json=bodies[i % len(bodies)])
+                    latency = time.perf_counter() - start
+                    if response.status_code != 200:
+                        raise RuntimeError(f"{url} trả về {response.status_code}: {response.text}")
+                    return latency
+
+                for i in range(min(20, args.requests)):
+                    call(i)
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+                    latencies = list(pool.map(call, range(args.requests)))
+                stats = percentile_stats(latencies, time.perf_counter() - start)
+                results[f"e2e/{name}/concurrency={args.concurrency}"] = stats
+        return results
+    finally:
+        os.chdir(cwd)
+
+
+def compare(results, baseline, threshold):
+    """So sánh p50 với baseline, trả về danh sách benchmark bị chậm hơn threshold"""
+    regressions = []
+    print(f"\n{'benchmark':<52} {'base p50':>10} {'new p50':>10} {'change':>8}")
+    for name, stats in results.items():
+        if name not in baseline:
+            continue
+        old, new = baseline[name]["p50_us"], stats["p50_us"]
+        change = (new - old) / old if old > 0 else 0.0
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<52} {old:>10.1f} {new:>10.1f} {change:>+7.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark encode → infer → train → save và API")
+    parser.add_argument("--only", choices=["micro", "e2e"], default=None)
+    parser.add_argument("--quick", action="store_true", help="Ít lần lặp / kích thước nhỏ hơn")
+    parser.add_argument("--iterations", type=int, default=None, help="Số lần đo mỗi micro-benchmark")
+    parser.add_argument("--buffer-sizes", type=int, nargs="+", default=None)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=None)
+    parser.add_argument("--requests", type=int, default=None, help="Số request mỗi endpoint (e2e)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Số request đồng thời (e2e)")
+    parser.add_argument("--cold-start", action="store_true", help="e2e không copy dqn_model.pt")
+    parser.add_argument("--threads", type=int, default=1, help="torch.set_num_threads")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help="Lưu kết quả JSON")
+    parser.add_argument("--compare", default=None, help="File JSON baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Tỷ lệ chậm hơn tối đa cho phép (p50)")
+    args = parser.parse_args()
+
+    args.iterations = args.iterations or (100 if args.quick else 500)
+    args.buffer_sizes = args.buffer_sizes or ([1000, 10000] if args.quick else [1000, 10000, 100000])
+    args.batch_sizes = args.batch_sizes or [32, 128]
+    args.requests = args.requests or (100 if args.quick else 500)
+
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    torch.manual_seed(args.seed)
+    torch.set_num_threads(args.threads)
+    rng = np.random.default_rng(args.seed)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        if args.only in (None, "micro"):
+            results.update(run_micro(args, rng, workdir))
+        if args.only in (None, "e2e"):
+            results.update(run_e2e(args, rng, workdir))
+
+    print(f"{'benchmark':<52} {'p50 (us)':>10} {'p95 (us)':>10} {'p99 (us)':>10} {'ops/s':>10}")
+    for name, stats in results.items():
+        print(f"{name:<52} {stats['p50_us']:>10.1f} {stats['p95_us']:>10.1f} "
+              f"{stats['p99_us']:>10.1f} {stats['ops_per_sec']:>10.1f}")
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "torch": torch.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args)
+        },
+        "results": results
+    }
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nĐã lưu kết quả vào {args.out}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} benchmark chậm hơn {args.threshold:.0%} so với {args.compare}")
+            sys.exit(1)
+        print(f"\nKhông có benchmark nào chậm hơn {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
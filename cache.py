@@ -0,0 +1,68 @@
+# cache.py
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+class TopKCache:
+    """
+    LRU cache kết quả top-k của model theo state
+
+    - Key: blake2b của bytes state đã encode (float32)
+    - Mỗi entry gắn version của inference model lúc tính → version khác thì coi như miss,
+      không bao giờ trả kết quả của model cũ
+    - Lưu danh sách top-k dài nhất đã tính, request k nhỏ hơn dùng lại phần đầu
+    - Chỉ cache phần exploitation; epsilon-greedy vẫn quyết định riêng từng request
+    """
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Tracking
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(state):
+        return hashlib.blake2b(np.ascontiguousarray(state, dtype=np.float32).tobytes(),
+                               digest_size=16).digest()
+
+    def get(self, key, version, k):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version or len(entry[1]) < k:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1][:k]
+
+    def put(self, key, version, actions):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version and len(entry[1]) >= len(actions):
+                return
+            self._entries[key] = (version, actions)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Thống kê cache cho /status"""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
@@ -0,0 +1,174 @@
+# checkpoint.py
+import os
+import re
+import tempfile
+import threading
+import time
+import torch
+import metrics
+
+
+def atomic_save(checkpoint, path):
+    """
+    Lưu checkpoint an toàn: ghi ra file tạm cùng thư mục rồi rename (atomic)
+    → crash giữa chừng không bao giờ để lại file hỏng
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            with metrics.timer("dqn_save_seconds", stage="serialize"):
+                torch.save(checkpoint, f)
+                f.flush()
+            with metrics.timer("dqn_save_seconds", stage="fsync"):
+                os.fsync(f.fileno())
+        with metrics.timer("dqn_save_seconds", stage="rename"):
+            os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class CheckpointManager:
+    """
+    Lưu model bất đồng bộ, giới hạn tần suất và dọn backup cũ
+
+    - maybe_save(): gọi sau mỗi lần train (trên thread train). Chỉ lưu khi đủ
+      every_steps lần train hoặc quá interval_sec giây kể từ lần lưu trước
+    - Snapshot state dicts (copy nhanh trong RAM), ghi file trên thread nền;
+      nếu thread đang ghi thì chỉ giữ snapshot mới nhất
+    - Backup mỗi backup_every lần train vào backup_dir, giữ keep_last bản mới nhất
+      và mỗi bản thứ keep_every (tính theo số thứ tự backup)
+    """
+    BACKUP_PATTERN = re.compile(r"^dqn_backup_(\d+)\.pt$")
+
+    def __init__(self, agent, model_path, every_steps=10, interval_sec=5.0,
+                 backup_dir="checkpoints", backup_every=100, keep_last=5, keep_every=10):
+        self.agent = agent
+        self.model_path = model_path
+        self.every_steps = every_steps
+        self.interval_sec = interval_sec
+        self.backup_dir = backup_dir
+        self.backup_every = backup_every
+        self.keep_last = keep_last
+        self.keep_every = keep_every
+
+        self._last_save_step = agent.train_count
+        self._last_backup_step = agent.train_count
+        self._last_save_time = time.monotonic()
+
+        # Snapshot chờ ghi (chỉ giữ bản mới nhất)
+        self._pending = None
+        self._writing = False
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="checkpoint-writer", daemon=True)
+        self._thread.start()
+
+        # Tracking
+        self.saves = 0
+        self.skipped = 0
+        self.last_save_sec = 0.0
+        self.last_error = None
+
+    def maybe_save(self):
+        """Lên lịch lưu nếu đến hạn. Trả về True nếu đã tạo snapshot"""
+        steps = self.agent.train_count - self._last_save_step
+        if steps <= 0:
+            return False
+        elapsed = time.monotonic() - self._last_save_time
+        if steps < self.every_steps and elapsed < self.interval_sec:
+            return False
+        self._schedule()
+        return True
+
+    def request_save(self):
+        """Lên lịch lưu ngay, kể cả khi chưa có train mới (vd: sau khi swap weights)"""
+        self._schedule()
+
+    def flush(self, timeout=30.0):
+        """Lưu trạng thái hiện tại (nếu có train mới) và chờ ghi xong"""
+        if self.agent.train_count != self._last_save_step:
+            self._schedule()
+        with self._cond:
+            self._cond.wait_for(lambda: self._pending is None and not self._writing, timeout)
+
+    def close(self):
+        self.flush()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def _schedule(self):
+        train_count = self.agent.train_count
+        # Backup khi vượt qua mốc backup_every kể từ backup trước
+        backup = (self.backup_every > 0 and
+                  train_count // self.backup_every > self._last_backup_step // self.backup_every)
+
+        with metrics.timer("dqn_save_seconds", stage="snapshot"):
+            snapshot = self.agent.snapshot()
+        self._last_save_step = train_count
+        self._last_save_time = time.monotonic()
+        if backup:
+            self._last_backup_step = train_count
+
+        with self._cond:
+            if self._pending is not None:
+                self.skipped += 1
+                # Không làm mất backup của snapshot bị thay thế
+                backup = backup or self._pending[2]
+            self._pending = (snapshot, train_count, backup)
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending is not None or self._closed)
+                if self._pending is None:
+                    return
+                snapshot, train_count, backup = self._pending
+                self._pending = None
+                self._writing = True
+
+            try:
+                start = time.monotonic()
+                atomic_save(snapshot, self.model_path)
+                if backup:
+                    atomic_save(snapshot, os.path.join(self.backup_dir, f"dqn_backup_{train_count}.pt"))
+                    self._apply_retention()
+                self.saves += 1
+                self.last_save_sec = time.monotonic() - start
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Không thể lưu checkpoint: {e}")
+            finally:
+                with self._cond:
+                    self._writing = False
+                    self._cond.notify_all()
+
+    def _apply_retention(self):
+        """Giữ keep_last backup mới nhất + mỗi backup thứ keep_every, xóa phần còn lại"""
+        steps = sorted(
+            int(m.group(1)) for m in map(self.BACKUP_PATTERN.match, os.listdir(self.backup_dir)) if m
+        )
+        keep = set(steps[-self.keep_last:]) if self.keep_last > 0 else set()
+        if self.keep_every > 0:
+            keep.update(s for s in steps if (s // self.backup_every) % self.keep_every == 0)
+
+        for step in steps:
+            if step not in keep:
+                os.remove(os.path.join(self.backup_dir, f"dqn_backup_{step}.pt"))
+
+    def status(self):
+        """Trạng thái lưu checkpoint cho /status"""
+        return {
+            "saves": self.saves,
+            "skipped": self.skipped,
+            "last_saved_train_count": self._last_save_step,
+            "last_save_sec": round(self.last_save_sec, 4),
+            "last_error": self.last_error
+        }
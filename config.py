@@ -1,4 +1,5 @@
 # config.py
+import os
 # Các tham số chuẩn hóa cho DQN state encoder
 
 # Boundaries cho normalization về [0, 1]
@@ -34,9 +35,111 @@ AGE_MAP = {
 # Products
 MAX_PRODUCTS = 50  # Sản phẩm mã từ 1->50
 
+# Action space
+# "dense": fc3 chấm điểm MAX_PRODUCTS sản phẩm (DQN)
+# "embedding": Q = state embedding · item embedding cho CATALOG_SIZE sản phẩm (EmbeddingDQN)
+#   State vẫn chỉ one-hot MAX_PRODUCTS sản phẩm đầu (products / top_products)
+ACTION_SPACE = os.environ.get("DQN_ACTION_SPACE", "dense")
+CATALOG_SIZE = 100000           # Số sản phẩm khi ACTION_SPACE = "embedding" (mã 1->CATALOG_SIZE)
+ITEM_EMBED_DIM = 32             # Số chiều embedding
+ITEM_EMBEDDINGS_PATH = None     # File .npy (CATALOG_SIZE, ITEM_EMBED_DIM) khởi tạo item embeddings
+TOPK_BLOCK_SIZE = 16384         # Số sản phẩm chấm điểm mỗi block khi lấy top-k
+TOPK_INDEX = "exact"            # "exact": chấm điểm cả catalog theo block, "ivf": index xấp xỉ (IVFIndex)
+IVF_NPROBE = 16                 # Số cụm xét mỗi truy vấn (ivf)
+IVF_REBUILD_EVERY = 20          # Dựng lại index mỗi N version của inference model (ivf)
+                                # (20 version × PUBLISH_EVERY = 50 → ~1000 lần train)
+TRAIN_NUM_CANDIDATES = 1024     # Số sản phẩm sample để tính max Q(s', a) khi train
+NUM_ACTIONS = CATALOG_SIZE if ACTION_SPACE == "embedding" else MAX_PRODUCTS
+
 # Position encoding
 POSITION_MAP = {
     "search": 0,
     "cart": 1,
     "home": 2
 }
+
+# Micro-batching cho /recommend
+BATCH_MAX_WAIT_US = 500         # Thời gian chờ tối đa để gom batch (micro-giây)
+BATCH_MAX_SIZE = 64             # Số request tối đa trong 1 batch
+RECOMMEND_BATCH_MAX_ITEMS = 100 # Số item tối đa trong 1 request /recommend/batch
+
+# Model
+MODEL_PATH = "dqn_model.pt"     # File model chính
+NUMPY_WEIGHTS_PATH = "dqn_weights.npy"  # Weights export cho inference NumPy (không cần torch)
+REGISTRY_DIR = "models"          # Registry các version model (weights + manifest.json)
+REGISTRY_KEEP_AUTO = 5          # Số snapshot tự động ("auto: ...", tạo khi activate) được giữ lại
+ADMIN_TOKEN = os.environ.get("DQN_ADMIN_TOKEN") or None  # Header X-Admin-Token cho /admin/* (None = tắt /admin/*)
+
+# Training
+# "sync": /train encode + train + save ngay trong request
+# "background": /train chỉ đưa transition vào hàng đợi, trainer nền xử lý
+TRAIN_MODE = "sync"
+TRAIN_QUEUE_MAXSIZE = 10000     # Số transition tối đa chờ trong hàng đợi
+TRAIN_QUEUE_TIMEOUT_SEC = 0.05  # Chờ tối đa khi hàng đợi đầy trước khi trả 503
+UPDATES_PER_SAMPLE = 1.0        # Số lần train cho mỗi transition (có thể < 1)
+TARGET_UPDATE_EVERY = 100       # Update target network mỗi N lần train
+
+# Streaming ingestion (POST /train/stream, body NDJSON: mỗi dòng 1 transition như /train)
+STREAM_CHUNK_SIZE = 1024        # Số dòng validate + encode + push mỗi chunk
+STREAM_UPDATES_PER_SAMPLE = UPDATES_PER_SAMPLE  # Số lần train cho mỗi transition (sync)
+STREAM_MAX_ERRORS = 10          # Số lỗi chi tiết tối đa trả về mỗi chunk
+STREAM_MAX_LINE_BYTES = 1 << 20 # Dòng dài hơn → 413, ngừng đọc (không buffer body không có "\n")
+
+# Inference snapshot (double-buffer)
+# Publish weights cho inference mỗi N lần train
+# embedding: mỗi lần publish copy cả bảng item (CATALOG_SIZE × ITEM_EMBED_DIM, ~12.8 MB),
+# tốn hơn cả 1 bước train SparseAdam → publish thưa hơn (inference trễ tối đa N lần train)
+PUBLISH_EVERY = 50 if ACTION_SPACE == "embedding" else 1
+INFERENCE_NUM_THREADS = None    # Số thread torch cho inference: /recommend, /recommend/batch, segment (None = mặc định)
+TRAIN_NUM_THREADS = None        # Số thread torch cho training (None = mặc định)
+SPARSE_INFERENCE = False        # /recommend/batch: encode thưa + fc1 gather-sum (forward_sparse)
+TOPK_CACHE_SIZE = 10000         # Số state tối đa trong cache top-k (0 = tắt cache)
+
+# Inference precision (chỉ API serve, trainer vẫn train float32)
+# "fp32": mặc định, "int8": dynamic quantization nn.Linear, "fp16": weights float16
+# Dựng lại mỗi lần publish; top-k trùng với float32 thấp hơn QUANT_MIN_TOPK_OVERLAP → dùng float32
+# Dựng + kiểm tra tốn vài ms mỗi lần publish → nên tăng PUBLISH_EVERY khi train sync
+INFERENCE_PRECISION = "fp32"
+QUANT_MIN_TOPK_OVERLAP = 0.9    # Tỷ lệ trùng top-k tối thiểu so với float32
+QUANT_CHECK_SAMPLES = 256       # Số state vừa gợi ý (held-out, không từ replay) dùng để kiểm tra
+QUANT_CHECK_K = 10              # k khi so sánh top-k
+
+# Checkpoint (ghi nền, atomic)
+CHECKPOINT_EVERY_STEPS = 10     # Lưu model mỗi N lần train
+CHECKPOINT_INTERVAL_SEC = 5.0   # ... hoặc mỗi N giây (nếu có train mới)
+BACKUP_DIR = "checkpoints"      # Thư mục backup
+BACKUP_EVERY_STEPS = 100        # Tạo backup mỗi N lần train
+BACKUP_KEEP_LAST = 5            # Giữ N backup mới nhất
+BACKUP_KEEP_EVERY = 10          # ... và mỗi backup thứ M (lưu trữ lâu dài)
+
+# Replay buffer
+REPLAY_CAPACITY = 10000         # Số experience tối đa trong replay buffer
+REPLAY_PATH = "replay_data"     # Thư mục replay buffer mmap (None = chỉ giữ trong RAM)
+REPLAY_COMPACT = False          # Lưu state nén (bit one-hot + cột liên tục), ~15x ít bộ nhớ
+                                # Đổi giá trị cần xóa REPLAY_PATH cũ (định dạng file khác nhau)
+
+# Agent riêng theo segment (field "segment" của request: storefront, position, ...)
+SEGMENT_DIR = "segments"        # segments/<segment>/dqn_model.pt + replay/ (mmap)
+SEGMENT_MAX_RESIDENT = 32       # Số agent segment giữ trong RAM (LRU), còn lại nằm trên đĩa
+SEGMENT_REPLAY_CAPACITY = 5000  # Replay buffer mỗi segment
+SEGMENT_CHECKPOINT_EVERY_STEPS = 100  # Lưu agent segment mỗi N lần train (ngoài lúc bị evict)
+SEGMENT_MAX_COUNT = 256         # Số segment tối đa trên đĩa (~3.5MB / segment), segment mới vượt quá → 403
+# Danh sách segment được phép (DQN_SEGMENT_ALLOWLIST="shop-a,shop-b"), None = mọi segment (trong SEGMENT_MAX_COUNT)
+SEGMENT_ALLOWLIST = [s.strip() for s in os.environ["DQN_SEGMENT_ALLOWLIST"].split(",") if s.strip()] \
+    if os.environ.get("DQN_SEGMENT_ALLOWLIST") else None
+
+# Multi-worker serving
+# "standalone": 1 process vừa serve vừa train (mặc định)
+# "worker": API worker chỉ serve, transition gửi tới trainer_process.py,
+#           weights đọc từ shared memory (DQN_SERVING_MODE=worker uvicorn api:app --workers N)
+SERVING_MODE = os.environ.get("DQN_SERVING_MODE", "standalone")
+TRAINER_ADDRESS = ("127.0.0.1", 6001)   # Địa chỉ IPC của trainer process
+# Khóa xác thực IPC trainer ↔ worker (multiprocessing.connection unpickle mọi message → bắt buộc bí mật)
+# Không có mặc định: thiếu cả 2 thì trainer_process.py / worker không khởi động
+TRAINER_AUTHKEY = os.environ.get("DQN_TRAINER_AUTHKEY")
+TRAINER_AUTHKEY_FILE = os.environ.get("DQN_TRAINER_AUTHKEY_FILE")  # File chứa khóa (vd: Docker / k8s secret)
+SHARED_WEIGHTS_NAME = "dqn_weights"     # Tên vùng shared memory chứa weights
+WEIGHTS_SYNC_INTERVAL_SEC = 0.05        # Chu kỳ publish / kiểm tra version weights
+
+# Metrics (/metrics, định dạng Prometheus)
+METRICS_ENABLED = os.environ.get("DQN_METRICS", "1") != "0"  # Tắt: hot path không đo gì
@@ -0,0 +1,66 @@
+# item_index.py
+import numpy as np
+
+
+class IVFIndex:
+    """
+    Index xấp xỉ cho top-k theo tích vô hướng (state embedding · item embedding)
+
+    - Gom item embeddings thành n_clusters cụm bằng k-means (mặc định √N cụm)
+    - Search: chấm điểm các tâm cụm, chỉ xét item trong nprobe cụm tốt nhất,
+      điểm của item được tính chính xác trên embeddings hiện tại
+    - Chi phí mỗi truy vấn ~ n_clusters + nprobe * N / n_clusters thay vì N
+    - Index dựng từ embeddings tại 1 thời điểm, embeddings thay đổi sau đó chỉ làm
+      lệch việc chọn cụm (recall), không làm sai điểm
+    """
+    def __init__(self, embeddings, n_clusters=None, iters=5, seed=0):
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        n = len(embeddings)
+        n_clusters = min(n, n_clusters or max(1, int(np.sqrt(n))))
+        rng = np.random.default_rng(seed)
+
+        centroids = embeddings[rng.choice(n, n_clusters, replace=False)].copy()
+        for _ in range(iters):
+            assign = self._assign(embeddings, centroids)
+            order = np.argsort(assign, kind="stable")
+            counts = np.bincount(assign, minlength=n_clusters)
+            nonempty = counts > 0
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[nonempty]
+            sums = np.add.reduceat(embeddings[order], starts, axis=0)
+            centroids[nonempty] = sums / counts[nonempty, None]
+
+        assign = self._assign(embeddings, centroids)
+        self.centroids = centroids
+        self.order = np.argsort(assign, kind="stable")
+        self.offsets = np.searchsorted(assign[self.order], np.arange(n_clusters + 1))
+        self.num_items = n
+
+    @staticmethod
+    def _assign(embeddings, centroids, block_size=16384):
+        """Cụm gần nhất (L2) của mỗi embedding, tính theo block để giới hạn bộ nhớ"""
+        half_norms = 0.5 * (centroids ** 2).sum(axis=1)
+        assign = np.empty(len(embeddings), dtype=np.int64)
+        for start in range(0, len(embeddings), block_size):
+            block = embeddings[start:start + block_size]
+            assign[start:start + block_size] = np.argmax(block @ centroids.T - half_norms, axis=1)
+        return assign
+
+    def search(self, state_emb, embeddings, bias, k, nprobe=16):
+        """
+        Top k item cho từng dòng state_emb (B, d) → mảng (B, k) index item, điểm giảm dần
+        embeddings (N, d), bias (N,): giá trị hiện tại của model
+        """
+        nprobe = min(nprobe, len(self.centroids))
+        centroid_scores = state_emb @ self.centroids.T
+        probes = np.argpartition(-centroid_scores, nprobe - 1, axis=1)[:, :nprobe]
+
+        results = np.empty((len(state_emb), k), dtype=np.int64)
+        for row, (query, probe) in enumerate(zip(state_emb, probes)):
+            candidates = np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in probe])
+            if len(candidates) < k:
+                # Cụm được chọn quá ít item → xét cả catalog
+                candidates = np.arange(self.num_items)
+            scores = embeddings[candidates] @ query + bias[candidates]
+            top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+            results[row] = candidates[top[np.argsort(-scores[top], kind="stable")]]
+        return results
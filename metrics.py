@@ -0,0 +1,188 @@
+# metrics.py
+"""
+Đo latency từng stage + counters / gauges, xuất theo định dạng Prometheus text (/metrics)
+
+    with metrics.timer("dqn_train_step_seconds", stage="backward"):
+        loss.backward()
+    metrics.inc("dqn_recommend_decisions_total", decision="explore")
+    metrics.set_gauge("dqn_train_loss", loss.item())
+    metrics.register_gauge("dqn_replay_size", lambda: len(agent.memory), "...")
+
+- Đồng hồ monotonic (time.perf_counter), histogram theo bucket cố định
+- METRICS_ENABLED = False: timer() trả về context manager rỗng dùng chung,
+  inc / observe / set_gauge return ngay → hot path gần như không tốn gì
+"""
+import bisect
+import threading
+import time
+from config import METRICS_ENABLED
+
+enabled = METRICS_ENABLED
+
+# Bucket latency (giây): 50us → 10s
+LATENCY_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+HELP = {
+    "dqn_http_request_seconds": "Thời gian xử lý request theo endpoint",
+    "dqn_recommend_seconds": "Latency từng stage của /recommend",
+    "dqn_train_request_seconds": "Latency từng stage của /train",
+    "dqn_train_stream_seconds": "Latency từng stage khi xử lý 1 chunk của /train/stream",
+    "dqn_train_stream_records_total": "Số transition /train/stream: accepted / rejected / queue_full",
+    "dqn_train_step_seconds": "Latency từng stage của DQNAgent.train_step",
+    "dqn_save_seconds": "Latency từng stage khi lưu checkpoint",
+    "dqn_recommend_decisions_total": "Số quyết định gợi ý: explore / exploit / cold_start",
+    "dqn_train_loss": "Loss của lần train gần nhất",
+    "dqn_td_error_mean": "Trung bình |TD error| của batch train gần nhất",
+    "dqn_inference_topk_overlap": "Tỷ lệ trùng top-k của model int8 / fp16 so với float32 (lần publish gần nhất)",
+}
+
+_lock = threading.Lock()
+_histograms = {}   # (name, labels) → [bucket counts, sum, count]
+_counters = {}     # (name, labels) → value
+_gauges = {}       # (name, labels) → value
+_gauge_callbacks = {}  # name → (fn, help)
+
+
+class _Timer:
+    __slots__ = ("name", "labels", "start")
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        _observe(self.name, self.labels, time.perf_counter() - self.start)
+        return False
+
+
+class _NoopTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopTimer()
+
+
+def _key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def timer(name, **labels):
+    """Context manager đo thời gian 1 stage vào histogram name"""
+    if not enabled:
+        return _NOOP
+    return _Timer(name, _key(labels))
+
+
+def observe(name, value, **labels):
+    if enabled:
+        _observe(name, _key(labels), value)
+
+
+def _observe(name, labels, value):
+    with _lock:
+        entry = _histograms.get((name, labels))
+        if entry is None:
+            entry = _histograms[(name, labels)] = [[0] * len(LATENCY_BUCKETS), 0.0, 0]
+        index = bisect.bisect_left(LATENCY_BUCKETS, value)
+        if index < len(LATENCY_BUCKETS):
+            entry[0][index] += 1
+        entry[1] += value
+        entry[2] += 1
+
+
+def inc(name, amount=1, **labels):
+    if not enabled:
+        return
+    key = (name, _key(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def set_gauge(name, value, **labels):
+    if not enabled:
+        return
+    with _lock:
+        _gauges[(name, _key(labels))] = value
+
+
+def register_gauge(name, fn, help=""):
+    """Gauge tính lúc scrape (vd: kích thước replay buffer, độ sâu hàng đợi)"""
+    _gauge_callbacks[name] = (fn, help)
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+        _gauges.clear()
+
+
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+def _header(lines, name, kind, help_text):
+    lines.append(f"# HELP {name} {help_text or HELP.get(name, name)}")
+    lines.append(f"# TYPE {name} {kind}")
+
+
+def render():
+    """Toàn bộ metrics theo Prometheus text exposition format"""
+    with _lock:
+        histograms = {k: (list(v[0]), v[1], v[2]) for k, v in _histograms.items()}
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+
+    lines = []
+    for name in sorted({name for name, _ in histograms}):
+        _header(lines, name, "histogram", None)
+        for (metric, labels), (buckets, total, count) in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, bucket_count in zip(LATENCY_BUCKETS, buckets):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', repr(bound))])} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+    for name in sorted({name for name, _ in counters}):
+        _header(lines, name, "counter", None)
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+
+    for name in sorted({name for name, _ in gauges}):
+        _header(lines, name, "gauge", None)
+        for (metric, labels), value in sorted(gauges.items()):
+            if metric == name:
+                lines.append(f"{name}{_format_labels(labels)} {float(value)}")
+
+    for name, (fn, help_text) in sorted(_gauge_callbacks.items()):
+        try:
+            value = fn()
+        except Exception:
+            continue
+        if value is None:
+            continue
+        _header(lines, name, "gauge", help_text)
+        lines.append(f"{name} {float(value)}")
+
+    return "\n".join(lines) + "\n"
@@ -1,6 +1,7 @@
 # model.py
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 
 class DQN(nn.Module):
     def __init__(self, state_dim, action_dim, hidden_dim=128):
@@ -36,3 +37,89 @@ class DQN(nn.Module):
         x = self.relu(self.fc2(x))
         x = self.fc3(x)  # No activation on output (Q-values)
         return x
+    
+    def forward_sparse(self, indices, values, offsets):
+        """
+        Forward pass với state dạng thưa (SparseStates)
+        
+        fc1 = tổng có trọng số các cột weight active + bias (EmbeddingBag),
+        bằng đúng fc1 dense nhưng bỏ qua các cột 0
+        
+        Args:
+            indices, values, offsets: tensor theo định dạng SparseStates
+            
+        Returns:
+            Q-values tensor (batch_size, action_dim)
+        """
+        x = F.embedding_bag(indices, self.fc1.weight.t(), offsets,
+                            mode="sum", per_sample_weights=values) + self.fc1.bias
+        x = self.relu(x)
+        x = self.relu(self.fc2(x))
+        x = self.fc3(x)
+        return x
+
+
+class EmbeddingDQN(nn.Module):
+    def __init__(self, state_dim, num_items, hidden_dim=64, embed_dim=32):
+        """
+        DQN cho catalog lớn: Q(s, a) = state_embedding(s) · item_embedding(a) + item_bias(a)
+        
+        Số tham số theo số sản phẩm chỉ nằm ở bảng embedding (num_items * (embed_dim + 1)),
+        chấm điểm 1 tập sản phẩm bất kỳ không cần tính cả catalog
+        
+        Args:
+            state_dim: Số chiều của state vector
+            num_items: Số sản phẩm trong catalog
+            hidden_dim: Số neurons trong hidden layers của state tower
+            embed_dim: Số chiều embedding
+        """
+        super(EmbeddingDQN, self).__init__()
+        
+        # State tower
+        self.fc1 = nn.Linear(state_dim, hidden_dim)
+        self.fc2 = nn.Linear(hidden_dim, hidden_dim)
+        self.state_proj = nn.Linear(hidden_dim, embed_dim)
+        
+        # Item embeddings (learned, hoặc load từ ngoài qua load_item_embeddings)
+        # sparse=True: gradient chỉ chứa các dòng được lookup (train bằng SparseAdam)
+        self.item_embeddings = nn.Embedding(num_items, embed_dim, sparse=True)
+        self.item_bias = nn.Embedding(num_items, 1, sparse=True)
+        nn.init.normal_(self.item_embeddings.weight, std=0.1)
+        nn.init.zeros_(self.item_bias.weight)
+        
+        self.relu = nn.ReLU()
+    
+    @property
+    def num_items(self):
+        return self.item_embeddings.num_embeddings
+    
+    def load_item_embeddings(self, embeddings, freeze=False):
+        """Khởi tạo item embeddings từ mảng (num_items, embed_dim)"""
+        self.item_embeddings.weight.data.copy_(torch.as_tensor(embeddings, dtype=torch.float32))
+        self.item_embeddings.weight.requires_grad_(not freeze)
+    
+    def encode(self, x):
+        """State tensor (batch_size, state_dim) → state embedding (batch_size, embed_dim)"""
+        x = self.relu(self.fc1(x))
+        x = self.relu(self.fc2(x))
+        return self.state_proj(x)
+    
+    def score_range(self, state_emb, start, end):
+        """Q-values cho các sản phẩm [start, end) → (batch_size, end - start), chỉ dùng cho inference"""
+        return state_emb @ self.item_embeddings.weight[start:end].t() + self.item_bias.weight[start:end].t()
+    
+    def score_items(self, state_emb, item_ids):
+        """Q-values cho tập sản phẩm item_ids dùng chung cả batch → (batch_size, len(item_ids))"""
+        return state_emb @ self.item_embeddings(item_ids).t() + self.item_bias(item_ids).t()
+    
+    def score_actions(self, state_emb, actions):
+        """Q-value của action từng dòng, actions (batch_size, 1) → (batch_size, 1)"""
+        item_emb = self.item_embeddings(actions.squeeze(1))
+        return (state_emb * item_emb).sum(dim=1, keepdim=True) + self.item_bias(actions).squeeze(2)
+    
+    def forward(self, x):
+        """
+        Q-values cho toàn bộ catalog (batch_size, num_items)
+        Catalog lớn nên dùng encode + score_range theo block (EmbeddingDQNAgent)
+        """
+        return self.score_range(self.encode(x), 0, self.num_items)
@@ -0,0 +1,290 @@
+# numpy_inference.py
+"""
+Inference DQN chỉ dùng NumPy (không import torch) cho các replica chỉ gợi ý
+
+- export: chuyển weights từ checkpoint (.pt) sang 1 file .npy phẳng + file .json mô tả
+- NumpyDQN: memory-map file .npy, forward 87→64→64→50 bằng NumPy
+- NumpyAgent: cùng interface gợi ý với DQNAgent (dùng được với InferenceBatcher)
+
+CLI:
+    python numpy_inference.py export [--checkpoint dqn_model.pt] [--out dqn_weights.npy]
+    python numpy_inference.py check      # so sánh với DQN.forward
+    python numpy_inference.py startup    # thời gian khởi động + RSS: numpy vs torch
+"""
+import argparse
+import json
+import os
+import numpy as np
+from config import MODEL_PATH, NUMPY_WEIGHTS_PATH
+
+# Thứ tự tham số trong file: (tên trong state_dict, transpose?)
+LAYERS = [
+    ("fc1.weight", True), ("fc1.bias", False),
+    ("fc2.weight", True), ("fc2.bias", False),
+    ("fc3.weight", True), ("fc3.bias", False),
+]
+
+
+def meta_path(path):
+    return os.path.splitext(path)[0] + ".json"
+
+
+def save_weights(state_dict, path, layers=LAYERS, **meta):
+    """
+    Ghi weights ra file .npy phẳng (float32, weight đã transpose sẵn cho x @ W)
+    và file .json (shape/offset từng layer + metadata). Ghi file tạm rồi rename
+
+    layers: [(tên trong state_dict, transpose?)], mặc định LAYERS của DQN
+    """
+    arrays, layer_meta, offset = [], [], 0
+    for name, transpose in layers:
+        array = np.asarray(state_dict[name], dtype=np.float32)
+        if transpose:
+            array = array.T
+        arrays.append(np.ascontiguousarray(array).reshape(-1))
+        layer_meta.append({"name": name, "shape": list(array.shape), "offset": offset, "transposed": transpose})
+        offset += array.size
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, np.concatenate(arrays))
+    os.replace(tmp_path, path)
+
+    tmp_meta = meta_path(path) + ".tmp"
+    with open(tmp_meta, "w", encoding="utf-8") as f:
+        json.dump({"layers": layer_meta, **meta}, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_meta, meta_path(path))
+
+
+def load_weights(path):
+    """
+    Đọc file của save_weights: (dict tên → view memory-mapped, metadata)
+    Chỉ map file, dữ liệu được đọc từ đĩa khi truy cập lần đầu
+    """
+    with open(meta_path(path), encoding="utf-8") as f:
+        meta = json.load(f)
+    flat = np.load(path, mmap_mode="r")
+
+    params = {}
+    for layer in meta["layers"]:
+        size = int(np.prod(layer["shape"]))
+        params[layer["name"]] = flat[layer["offset"]:layer["offset"] + size].reshape(layer["shape"])
+    return params, meta
+
+
+def export_checkpoint(checkpoint_path=MODEL_PATH, out_path=NUMPY_WEIGHTS_PATH):
+    """Export model_state_dict từ checkpoint torch sang định dạng NumPy"""
+    import torch  # Chỉ cần torch khi export
+
+    checkpoint = torch.load(checkpoint_path, map_location="cpu")
+    if "fc3.weight" not in checkpoint["model_state_dict"]:
+        raise ValueError("Inference NumPy chỉ hỗ trợ model DQN (ACTION_SPACE = \"dense\")")
+    state_dict = {k: v.numpy() for k, v in checkpoint["model_state_dict"].items()}
+    save_weights(state_dict, out_path,
+                 epsilon=float(checkpoint["epsilon"]),
+                 train_count=int(checkpoint.get("train_count", 0)),
+                 is_trained=True)
+
+
+class NumpyDQN:
+    """Forward pass DQN bằng NumPy trên weights memory-mapped"""
+    def __init__(self, path=NUMPY_WEIGHTS_PATH):
+        params, self.meta = load_weights(path)
+        self.w1, self.b1 = params["fc1.weight"], params["fc1.bias"]
+        self.w2, self.b2 = params["fc2.weight"], params["fc2.bias"]
+        self.w3, self.b3 = params["fc3.weight"], params["fc3.bias"]
+        self.state_dim = self.w1.shape[0]
+        self.action_dim = self.w3.shape[1]
+
+    def forward(self, states):
+        """states (batch_size, state_dim) → Q-values (batch_size, action_dim)"""
+        x = np.maximum(states @ self.w1 + self.b1, 0)
+        x = np.maximum(x @ self.w2 + self.b2, 0)
+        return x @ self.w3 + self.b3
+
+
+def top_k(q_values, k):
+    """Top k index theo Q-value giảm dần cho từng dòng (argpartition rồi sort k phần tử)"""
+    k = min(k, q_values.shape[1])
+    if k < q_values.shape[1]:
+        candidates = np.argpartition(-q_values, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.broadcast_to(np.arange(k), q_values.shape)
+    order = np.argsort(-np.take_along_axis(q_values, candidates, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+class NumpyAgent:
+    """
+    Agent chỉ gợi ý (không train) dùng NumpyDQN
+    - Cold start / epsilon-greedy giống DQNAgent
+    - epsilon, is_trained lấy từ metadata khi export
+    """
+    def __init__(self, path=NUMPY_WEIGHTS_PATH):
+        self.path = path
+        self.inference_version = 0
+        self.load()
+
+    def load(self):
+        model = NumpyDQN(self.path)
+        self.action_dim = model.action_dim
+        self.epsilon = model.meta.get("epsilon", 0.5)
+        self.train_count = model.meta.get("train_count", 0)
+        self.is_trained = model.meta.get("is_trained", True)
+        self.inference_model = model
+        self.inference_version += 1
+
+    def init_inference_thread(self):
+        pass
+
+    def use_model(self):
+        if not self.is_trained:
+            return False
+        return np.random.rand() >= self.epsilon
+
+    def random_actions(self, k=10):
+        return list(np.random.choice(self.action_dim, size=k, replace=False))
+
+    def model_top_actions(self, states, ks):
+        q_values = self.inference_model.forward(np.asarray(states, dtype=np.float32))
+        top_k_indices = top_k(q_values, max(ks))
+        return [[int(x) for x in row[:k]] for row, k in zip(top_k_indices, ks)]
+
+    def select_top_actions(self, state, k=10):
+        if not self.use_model():
+            return self.random_actions(k)
+        return self.model_top_actions(np.expand_dims(state, 0), [k])[0]
+
+    def select_top_actions_batch(self, states, ks):
+        results = [None] * len(ks)
+        model_rows = []
+        for i, k in enumerate(ks):
+            if self.use_model():
+                model_rows.append(i)
+            else:
+                results[i] = self.random_actions(k)
+
+        if model_rows:
+            top_actions = self.model_top_actions(states[model_rows], [ks[i] for i in model_rows])
+            for i, actions in zip(model_rows, top_actions):
+                results[i] = actions
+        return results
+
+
+def check_equivalence(checkpoint_path=MODEL_PATH, num_states=2048, seed=0):
+    """So sánh NumpyDQN với DQN.forward trên state thật (encode_states) + state ngẫu nhiên"""
+    import tempfile
+    import torch
+    from model import DQN
+    from state_encoder import encode_states
+    from config import CATEGORIES
+
+    checkpoint = torch.load(checkpoint_path, map_location="cpu")
+    state_dict = checkpoint["model_state_dict"]
+    model = DQN(state_dict["fc1.weight"].shape[1], state_dict["fc3.weight"].shape[0],
+                state_dict["fc1.weight"].shape[0])
+    model.load_state_dict(state_dict)
+    model.eval()
+
+    rng = np.random.default_rng(seed)
+    items = []
+    for i in range(num_states):
+        position = ["search", "cart", "home"][i % 3]
+        items.append(({
+            "gender": ["Male", "Female", "Other"][rng.integers(3)],
+            "age_group": ["U20", "U30", "U40", "U50", "U60"][rng.integers(5)],
+            "day_of_week": int(rng.integers(1, 8)),
+            "recent_searches": int(rng.integers(0, 60)),
+            "num_products": int(rng.integers(0, 25)),
+            "total_value": float(rng.uniform(0, 3e7)),
+            "avg_value": float(rng.uniform(0, 3e6)),
+            "products": [int(p) for p in rng.choice(50, 5, replace=False) + 1],
+            "category": list(rng.choice(CATEGORIES, 2, replace=False)),
+            "top_products": [int(p) for p in rng.choice(50, 5, replace=False) + 1],
+            "top_categories": list(rng.choice(CATEGORIES, 2, replace=False)),
+        }, position))
+    states = np.concatenate([
+        encode_states(items),
+        rng.random((num_states, state_dict["fc1.weight"].shape[1]), dtype=np.float32)
+    ])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "weights.npy")
+        save_weights({k: v.numpy() for k, v in state_dict.items()}, path)
+        numpy_model = NumpyDQN(path)
+        q_numpy = numpy_model.forward(states)
+        with torch.no_grad():
+            q_torch = model(torch.from_numpy(states)).numpy()
+
+        max_diff = float(np.abs(q_numpy - q_torch).max())
+        top_torch = torch.topk(torch.from_numpy(q_torch), 10, dim=1)[1].numpy()
+        top_numpy = top_k(q_numpy, 10)
+        top_match = float((top_torch == top_numpy).all(axis=1).mean())
+        del numpy_model
+
+    print(f"So sánh {len(states)} states: max |ΔQ| = {max_diff:.2e}, top-10 trùng khớp: {top_match:.2%}")
+    return max_diff < 1e-4 and top_match > 0.99
+
+
+STARTUP_SCRIPTS = {
+    "numpy": (
+        "from numpy_inference import NumpyAgent\n"
+        "agent = NumpyAgent({weights!r})\n"
+    ),
+    "torch": (
+        "from agent import DQNAgent\n"
+        "from state_encoder import STATE_DIM\n"
+        "from config import MAX_PRODUCTS\n"
+        "agent = DQNAgent(STATE_DIM, MAX_PRODUCTS)\n"
+        "agent.load_model({checkpoint!r})\n"
+    ),
+}
+
+
+def compare_startup(checkpoint_path=MODEL_PATH, weights_path=NUMPY_WEIGHTS_PATH):
+    """Đo thời gian khởi động (import + load + 1 lần gợi ý) và RSS của 2 backend"""
+    import subprocess
+    import sys
+
+    measure = (
+        "import time, resource\n"
+        "start = time.perf_counter()\n"
+        "{setup}"
+        "import numpy as np\n"
+        "agent.model_top_actions(np.zeros((1, 87), dtype=np.float32), [10])\n"
+        "elapsed = time.perf_counter() - start\n"
+        "import sys\n"
+        "print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, 'torch' in sys.modules)\n"
+    )
+    print(f"{'backend':<8} {'startup (s)':>12} {'max RSS (MB)':>14} {'torch loaded':>13}")
+    for backend, setup in STARTUP_SCRIPTS.items():
+        code = measure.format(setup=setup.format(weights=weights_path, checkpoint=checkpoint_path))
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                             check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        elapsed, rss_kb, torch_loaded = out.stdout.split()[-3:]
+        print(f"{backend:<8} {float(elapsed):>12.3f} {int(rss_kb) / 1024:>14.1f} {torch_loaded:>13}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inference DQN bằng NumPy")
+    parser.add_argument("command", choices=["export", "check", "startup"])
+    parser.add_argument("--checkpoint", default=MODEL_PATH)
+    parser.add_argument("--out", default=NUMPY_WEIGHTS_PATH)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_checkpoint(args.checkpoint, args.out)
+        print(f"Đã export weights từ {args.checkpoint} sang {args.out}")
+    elif args.command == "check":
+        if not check_equivalence(args.checkpoint):
+            raise SystemExit("NumpyDQN không khớp với DQN.forward")
+    else:
+        if not os.path.exists(args.out):
+            export_checkpoint(args.checkpoint, args.out)
+        compare_startup(args.checkpoint, args.out)
+
+
+if __name__ == "__main__":
+    main()
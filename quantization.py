@@ -0,0 +1,62 @@
+# quantization.py
+"""
+Inference model độ chính xác thấp cho CPU
+
+- "int8": dynamic quantization các lớp nn.Linear (weights int8, activations lượng tử hóa
+  theo từng batch lúc chạy), cần torch.ao.quantization + quantized engine (fbgemm / x86 / qnnpack)
+- "fp16": weights nn.Linear lưu float16, input / output của từng lớp vẫn là float32
+- nn.Embedding (item embeddings của EmbeddingDQN) giữ nguyên float32
+- Model trả về có thuộc tính precision; forward_sparse chỉ dùng được với "fp32"
+"""
+import warnings
+import torch
+import torch.nn as nn
+
+PRECISIONS = ("fp32", "int8", "fp16")
+
+
+def int8_available():
+    """torch có dynamic quantization và ít nhất 1 quantized engine không"""
+    try:
+        from torch.ao.quantization import quantize_dynamic  # noqa: F401
+    except ImportError:
+        return False
+    engines = getattr(torch.backends, "quantized", None)
+    return engines is not None and any(e != "none" for e in engines.supported_engines)
+
+
+def quantize_model(model, precision):
+    """
+    Bản inference của model (float32, đã eval) theo precision
+    model được sửa tại chỗ với "fp16" → truyền vào bản copy
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"precision không hợp lệ: {precision} (chọn {', '.join(PRECISIONS)})")
+    if precision == "int8":
+        if not int8_available():
+            raise RuntimeError("torch không hỗ trợ dynamic quantization int8 trên máy này")
+        from torch.ao.quantization import quantize_dynamic
+        with warnings.catch_warnings():
+            # torch.ao.quantization báo deprecated ở các bản mới, vẫn chạy được
+            warnings.simplefilter("ignore")
+            model = quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+    elif precision == "fp16":
+        for module in model.modules():
+            if isinstance(module, nn.Linear):
+                _half_linear(module)
+    model.precision = precision
+    return model
+
+
+def _half_linear(module):
+    module.half()
+    module.register_forward_pre_hook(lambda m, args: tuple(a.half() for a in args))
+    module.register_forward_hook(lambda m, args, output: output.float())
+
+
+def topk_overlap(reference, candidate):
+    """Tỷ lệ trùng trung bình giữa 2 danh sách top-k (theo từng dòng), 1.0 = giống hệt"""
+    total = 0.0
+    for ref_row, cand_row in zip(reference, candidate):
+        total += len(set(ref_row) & set(cand_row)) / max(len(ref_row), 1)
+    return total / max(len(reference), 1)
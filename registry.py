@@ -0,0 +1,149 @@
+# registry.py
+"""
+Registry các version model (chỉ weights) trong 1 thư mục local
+
+    models/
+        manifest.json       # danh sách version, version đang active / trước đó
+        v0001.npy + .json   # weights phẳng float32 (numpy_inference.save_weights)
+        v0002.npy + .json
+
+- Snapshot không chứa optimizer state → nhỏ, load bằng memory-map, không unpickle
+- Model DQN dense lưu theo LAYERS của numpy_inference → api_inference đọc thẳng được
+- activate(): load weights (ngoài train_lock) rồi swap vào agent; request /recommend
+  đang chạy vẫn dùng inference model cũ tới khi xong
+- Trước mỗi lần activate, weights hiện tại được snapshot lại → rollback luôn là 1 lần swap
+  Chưa train gì từ lần activate trước → weights hiện tại chính là version active, không snapshot lại
+  (rollback 2 lần liên tiếp = quay về chỗ cũ, không tạo version mới)
+- Chỉ giữ keep_auto snapshot tự động mới nhất (không xóa version active / previous)
+"""
+import json
+import os
+import re
+import threading
+import time
+import numpy as np
+import torch
+from numpy_inference import LAYERS, save_weights, load_weights, meta_path
+from config import REGISTRY_DIR, REGISTRY_KEEP_AUTO
+
+MANIFEST = "manifest.json"
+AUTO_NOTE = "auto: "
+VERSION_PATTERN = re.compile(r"^v(\d+)$")
+
+
+class ModelRegistry:
+    def __init__(self, root=REGISTRY_DIR, keep_auto=REGISTRY_KEEP_AUTO):
+        self.root = root
+        self.keep_auto = keep_auto
+        self._lock = threading.Lock()
+        self._activate_lock = threading.Lock()
+
+    def path(self, version):
+        if not VERSION_PATTERN.match(version):
+            raise ValueError(f"Version không hợp lệ: {version}")
+        return os.path.join(self.root, f"{version}.npy")
+
+    def manifest(self):
+        try:
+            with open(os.path.join(self.root, MANIFEST), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"active": None, "previous": None, "versions": []}
+
+    def _write_manifest(self, manifest):
+        os.makedirs(self.root, exist_ok=True)
+        path = os.path.join(self.root, MANIFEST)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(path + ".tmp", path)
+
+    def snapshot(self, agent, note=None):
+        """Lưu weights hiện tại của agent thành version mới, trả về entry trong manifest"""
+        state_dict, epsilon, train_count = agent.weights_snapshot()
+        with self._lock:
+            manifest = self.manifest()
+            number = max((int(VERSION_PATTERN.match(v["version"]).group(1)) for v in manifest["versions"]),
+                         default=0) + 1
+            version = f"v{number:04d}"
+            # DQN dense: thứ tự + transpose giống file export → dùng được với NumpyDQN
+            dense = set(state_dict) == {name for name, _ in LAYERS}
+            layers = LAYERS if dense else [(name, False) for name in state_dict]
+            entry = {
+                "version": version,
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "train_count": int(train_count),
+                "epsilon": float(epsilon),
+                "note": note
+            }
+            save_weights(state_dict, self.path(version), layers=layers, **entry)
+            manifest["versions"].append(entry)
+            self._write_manifest(manifest)
+        return entry
+
+    def load(self, version):
+        """state_dict (torch tensors, đúng shape của model) của 1 version"""
+        if not os.path.exists(self.path(version)):
+            raise ValueError(f"Không tìm thấy version {version} trong {self.root}")
+        params, meta = load_weights(self.path(version))
+        state_dict = {}
+        for layer in meta["layers"]:
+            array = params[layer["name"]]
+            if layer.get("transposed"):
+                array = array.T
+            state_dict[layer["name"]] = torch.from_numpy(np.array(array))
+        return state_dict
+
+    def activate(self, agent, version):
+        """
+        Swap weights của version vào agent (load trước, chỉ giữ train_lock lúc swap)
+        Weights đang dùng được snapshot lại làm "previous" để rollback
+        """
+        state_dict = self.load(version)
+        with self._activate_lock:
+            manifest = self.manifest()
+            if manifest["active"] is not None and manifest.get("active_train_count") == agent.train_count:
+                # Chưa train từ lần activate trước: weights hiện tại = version active
+                previous = manifest["active"]
+            else:
+                previous = self.snapshot(agent, note=f"{AUTO_NOTE}trước khi activate {version}")["version"]
+            agent.swap_weights(state_dict)
+            with self._lock:
+                manifest = self.manifest()
+                manifest["active"], manifest["previous"] = version, previous
+                manifest["active_train_count"] = int(agent.train_count)
+                self._prune(manifest)
+                self._write_manifest(manifest)
+        print(f"Đã activate model {version} (rollback: {previous})")
+        return {"active": version, "previous": previous,
+                "inference_version": int(agent.inference_version)}
+
+    def _prune(self, manifest):
+        """Xóa snapshot tự động cũ, giữ keep_auto bản mới nhất + version active / previous"""
+        auto = [v["version"] for v in manifest["versions"] if (v.get("note") or "").startswith(AUTO_NOTE)]
+        keep = set(auto[-self.keep_auto:]) if self.keep_auto > 0 else set()
+        keep.update((manifest["active"], manifest["previous"]))
+        removed = set(auto) - keep
+        for version in removed:
+            for path in (self.path(version), meta_path(self.path(version))):
+                if os.path.exists(path):
+                    os.remove(path)
+        manifest["versions"] = [v for v in manifest["versions"] if v["version"] not in removed]
+
+    def rollback(self, agent):
+        """Swap về version trước lần activate gần nhất"""
+        previous = self.manifest()["previous"]
+        if previous is None:
+            raise ValueError("Chưa activate version nào, không có gì để rollback")
+        return self.activate(agent, previous)
+
+    def command(self, agent, op, arg=None):
+        """Thao tác từ endpoint /admin/models (api.py hoặc trainer process qua IPC)"""
+        if op == "list":
+            return self.manifest()
+        if op == "snapshot":
+            return self.snapshot(agent, note=arg)
+        if op == "activate":
+            return self.activate(agent, arg)
+        if op == "rollback":
+            return self.rollback(agent)
+        raise ValueError(f"Thao tác registry không hợp lệ: {op}")
@@ -1,5 +1,7 @@
 # replay_buffer.py
+import os
 import random
+import threading
 from collections import deque
 import numpy as np
 
@@ -10,6 +12,10 @@ class ReplayBuffer:
     def push(self, state, action, reward, next_state, done):
         self.memory.append((state, action, reward, next_state, done))
     
+    def push_batch(self, states, actions, rewards, next_states, dones):
+        for experience in zip(states, actions, rewards, next_states, dones):
+            self.memory.append(experience)
+    
     def sample(self, batch_size):
         """
         Sample batch với ưu tiên cho experience mới nhất
@@ -44,3 +50,328 @@ class ReplayBuffer:
     
     def __len__(self):
         return len(self.memory)
+
+
+class ArrayReplayBuffer:
+    """
+    Replay buffer dạng ring trên mảng NumPy cấp phát trước
+
+    - states/next_states: (capacity, state_dim) float32
+    - actions/rewards/dones: (capacity,)
+    - Chi phí sample chỉ phụ thuộc batch_size, không phụ thuộc capacity
+    - Giữ quy tắc của ReplayBuffer: luôn lấy experience mới nhất
+    - push / push_batch / sample giữ _lock: cập nhật cursor (đọc-sửa-ghi meta) an toàn khi
+      nhiều thread cùng push (threadpool của FastAPI), như deque.append của ReplayBuffer
+    """
+    def __init__(self, state_dim, capacity=10000):
+        self.state_dim = state_dim
+        self.capacity = capacity
+        self._lock = threading.RLock()
+        self._allocate(state_dim, capacity)
+    
+    def _fields(self, state_dim, capacity):
+        """Tên mảng → (shape, dtype) lưu trong buffer"""
+        return {
+            "states": ((capacity, state_dim), np.float32),
+            "next_states": ((capacity, state_dim), np.float32),
+            "actions": ((capacity,), np.int64),
+            "rewards": ((capacity,), np.float32),
+            "dones": ((capacity,), np.bool_),
+        }
+    
+    def _allocate(self, state_dim, capacity):
+        for name, (shape, dtype) in self._fields(state_dim, capacity).items():
+            setattr(self, name, np.zeros(shape, dtype=dtype))
+        # [write cursor, size]
+        self.meta = np.zeros(2, dtype=np.int64)
+    
+    def _write_states(self, idx, states, next_states):
+        self.states[idx] = states
+        self.next_states[idx] = next_states
+    
+    def _read_states(self, idx):
+        return self.states[idx], self.next_states[idx]
+    
+    @property
+    def pos(self):
+        return int(self.meta[0])
+    
+    @property
+    def size(self):
+        return int(self.meta[1])
+    
+    def push(self, state, action, reward, next_state, done):
+        with self._lock:
+            i = self.pos
+            self._write_states(i, state, next_state)
+            self.actions[i] = action
+            self.rewards[i] = reward
+            self.dones[i] = done
+            # Cập nhật cursor sau khi đã ghi xong dữ liệu
+            self.meta[1] = min(self.size + 1, self.capacity)
+            self.meta[0] = (i + 1) % self.capacity
+    
+    def push_batch(self, states, actions, rewards, next_states, dones):
+        """
+        Ghi nhiều experience 1 lần (vector hóa, quay vòng khi đầy)
+        Trả về vị trí đã ghi trong buffer
+        """
+        n = len(actions)
+        with self._lock:
+            if n > self.capacity:
+                # Chỉ những experience cuối cùng còn lại trong buffer
+                skip = n - self.capacity
+                self.meta[0] = (self.pos + skip) % self.capacity
+                states, actions, rewards = states[skip:], actions[skip:], rewards[skip:]
+                next_states, dones = next_states[skip:], dones[skip:]
+                n = self.capacity
+            
+            idx = (self.pos + np.arange(n)) % self.capacity
+            self._write_states(idx, states, next_states)
+            self.actions[idx] = actions
+            self.rewards[idx] = rewards
+            self.dones[idx] = dones
+            self.meta[1] = min(self.size + n, self.capacity)
+            self.meta[0] = (self.pos + n) % self.capacity
+            return idx
+    
+    def _physical(self, logical):
+        """Logical index (0 = cũ nhất) → vị trí trong mảng"""
+        start = (self.pos - self.size) % self.capacity
+        return (start + logical) % self.capacity
+    
+    def sample_indices(self, batch_size):
+        """
+        Chọn vị trí các experience cho 1 batch
+        - Luôn lấy experience mới nhất (ở đầu batch)
+        - Random (batch_size - 1) experiences cũ, không lặp
+        """
+        size = self.size
+        if size == 0:
+            raise ValueError("Cannot sample from empty buffer")
+        
+        newest = (self.pos - 1) % self.capacity
+        if size == 1:
+            return np.array([newest])
+        if size <= batch_size:
+            # Ít hơn batch_size → lấy tất cả (cũ → mới)
+            return self._physical(np.arange(size))
+        
+        # random.sample trên range: O(batch_size), không copy buffer
+        old = np.fromiter(random.sample(range(size - 1), batch_size - 1), dtype=np.int64,
+                          count=batch_size - 1)
+        return np.concatenate(([newest], self._physical(old)))
+    
+    def sample(self, batch_size):
+        with self._lock:
+            idx = self.sample_indices(batch_size)
+            states, next_states = self._read_states(idx)
+            return states, self.actions[idx], self.rewards[idx], next_states, self.dones[idx]
+    
+    def __len__(self):
+        return self.size
+
+
+class MmapReplayBuffer(ArrayReplayBuffer):
+    """
+    ArrayReplayBuffer lưu trên file memory-mapped (.npy) trong thư mục path
+
+    - Mỗi mảng trong _fields là 1 file: states.npy, next_states.npy, actions.npy, ...
+    - meta.npy: [write cursor, size]
+    - push ghi thẳng vào mmap → không cần bước save, mở lại khi khởi động là dùng được ngay
+    """
+    def __init__(self, path, state_dim, capacity=10000):
+        self.path = path
+        super().__init__(state_dim, capacity)
+    
+    def _allocate(self, state_dim, capacity):
+        os.makedirs(self.path, exist_ok=True)
+        meta_file = os.path.join(self.path, "meta.npy")
+        reopen = os.path.exists(meta_file)
+        
+        self.field_names = []
+        for name, (shape, dtype) in self._fields(state_dim, capacity).items():
+            setattr(self, name, self._open(name, shape, dtype, reopen))
+            self.field_names.append(name)
+        self.meta = self._open("meta", (2,), np.int64, reopen)
+    
+    def _open(self, name, shape, dtype, reopen):
+        file = os.path.join(self.path, f"{name}.npy")
+        if not reopen:
+            return np.lib.format.open_memmap(file, mode="w+", dtype=dtype, shape=shape)
+        
+        if not os.path.exists(file):
+            raise ValueError(f"Replay buffer tại {self.path} không khớp cấu hình: thiếu {name}.npy")
+        array = np.lib.format.open_memmap(file, mode="r+")
+        if array.shape != shape or array.dtype != dtype:
+            raise ValueError(
+                f"Replay buffer tại {self.path} không khớp cấu hình: "
+                f"{name} có shape {array.shape}, cần {shape}"
+            )
+        return array
+    
+    def flush(self):
+        """Ghi các trang đã thay đổi xuống đĩa (chống mất dữ liệu khi OS crash)"""
+        for name in self.field_names:
+            getattr(self, name).flush()
+        self.meta.flush()
+
+
+class CompactReplayBuffer(ArrayReplayBuffer):
+    """
+    ArrayReplayBuffer lưu state dạng nén (cho state của encode_state)
+
+    - Mọi cột nhị phân (one-hot, padding): 1 bit/cột (np.packbits)
+    - Các cột liên tục (dense_cols): giữ nguyên float32
+    - 87 chiều: 11 byte bit + 3 * 4 byte thay cho 348 byte mỗi state (~15x nhỏ hơn)
+    - sample giải nén về float32 dense → train_step không đổi
+    Chỉ lossless khi ngoài dense_cols, state chỉ có giá trị 0/1
+    """
+    def __init__(self, state_dim, capacity=10000, dense_cols=()):
+        self.dense_cols = np.asarray(dense_cols, dtype=np.int64)
+        ArrayReplayBuffer.__init__(self, state_dim, capacity)
+    
+    def _fields(self, state_dim, capacity):
+        fields = super()._fields(state_dim, capacity)
+        bits_shape = (capacity, (state_dim + 7) // 8)
+        dense_shape = (capacity, len(self.dense_cols))
+        del fields["states"], fields["next_states"]
+        fields.update({
+            "state_bits": (bits_shape, np.uint8),
+            "state_dense": (dense_shape, np.float32),
+            "next_state_bits": (bits_shape, np.uint8),
+            "next_state_dense": (dense_shape, np.float32),
+        })
+        return fields
+    
+    def _pack(self, states):
+        states = np.asarray(states, dtype=np.float32)
+        return np.packbits(states != 0, axis=-1), states[..., self.dense_cols]
+    
+    def _unpack(self, bits, dense):
+        states = np.unpackbits(bits, axis=-1, count=self.state_dim).astype(np.float32)
+        states[..., self.dense_cols] = dense
+        return states
+    
+    def _write_states(self, idx, states, next_states):
+        self.state_bits[idx], self.state_dense[idx] = self._pack(states)
+        self.next_state_bits[idx], self.next_state_dense[idx] = self._pack(next_states)
+    
+    def _read_states(self, idx):
+        return (self._unpack(self.state_bits[idx], self.state_dense[idx]),
+                self._unpack(self.next_state_bits[idx], self.next_state_dense[idx]))
+
+
+class CompactMmapReplayBuffer(CompactReplayBuffer, MmapReplayBuffer):
+    """CompactReplayBuffer lưu trên file memory-mapped (giống MmapReplayBuffer)"""
+    def __init__(self, path, state_dim, capacity=10000, dense_cols=()):
+        self.path = path
+        CompactReplayBuffer.__init__(self, state_dim, capacity, dense_cols)
+
+
+class SumTree:
+    """
+    Cây tổng cho prioritized replay (lá = priority của từng vị trí trong buffer)
+
+    - update: O(log N), cập nhật cả batch theo từng tầng
+    - find: tìm lá theo prefix-sum, O(log N) cho cả batch
+    """
+    def __init__(self, capacity):
+        # Số lá làm tròn lên lũy thừa của 2 để mọi lá cùng độ sâu
+        self.leaf_offset = 1 << max(0, (capacity - 1).bit_length())
+        self.tree = np.zeros(2 * self.leaf_offset, dtype=np.float64)
+    
+    def total(self):
+        return float(self.tree[1])
+    
+    def get(self, indices):
+        return self.tree[np.asarray(indices) + self.leaf_offset]
+    
+    def update(self, indices, priorities):
+        idx = np.asarray(indices, dtype=np.int64) + self.leaf_offset
+        self.tree[idx] = priorities
+        # Tính lại tổng từ các node con, từng tầng lên tới gốc
+        idx = np.unique(idx // 2)
+        while idx[0] >= 1:
+            self.tree[idx] = self.tree[2 * idx] + self.tree[2 * idx + 1]
+            idx = np.unique(idx // 2)
+    
+    def find(self, values):
+        """Trả về vị trí lá ứng với mỗi giá trị prefix-sum trong [0, total)"""
+        values = np.array(values, dtype=np.float64)
+        idx = np.ones(len(values), dtype=np.int64)
+        while idx[0] < self.leaf_offset:
+            left = 2 * idx
+            left_sum = self.tree[left]
+            go_right = values >= left_sum
+            values = np.where(go_right, values - left_sum, values)
+            idx = np.where(go_right, left + 1, left)
+        return idx - self.leaf_offset
+
+
+class PrioritizedReplayBuffer(ArrayReplayBuffer):
+    """
+    Prioritized experience replay (proportional) trên ArrayReplayBuffer
+
+    - Experience mới nhận priority lớn nhất hiện tại → chắc chắn được học
+    - Vẫn luôn lấy experience mới nhất, phần còn lại sample theo priority^alpha
+    - sample trả thêm indices và importance-sampling weights (beta tăng dần về 1)
+    - Sau khi train, gọi update_priorities với TD errors của batch
+    """
+    def __init__(self, state_dim, capacity=10000, alpha=0.6, beta=0.4,
+                 beta_increment=0.001, eps=1e-5):
+        super().__init__(state_dim, capacity)
+        self.alpha = alpha
+        self.beta = beta
+        self.beta_increment = beta_increment
+        self.eps = eps
+        self.tree = SumTree(capacity)
+        self.max_priority = 1.0
+    
+    def push(self, state, action, reward, next_state, done):
+        with self._lock:
+            i = self.pos
+            super().push(state, action, reward, next_state, done)
+            self.tree.update([i], self.max_priority ** self.alpha)
+    
+    def push_batch(self, states, actions, rewards, next_states, dones):
+        with self._lock:
+            idx = super().push_batch(states, actions, rewards, next_states, dones)
+            self.tree.update(idx, self.max_priority ** self.alpha)
+            return idx
+    
+    def sample_indices(self, batch_size):
+        size = self.size
+        if size == 0:
+            raise ValueError("Cannot sample from empty buffer")
+        if size <= batch_size:
+            return self._physical(np.arange(size))
+        
+        # Newest + (batch_size - 1) mẫu phân tầng theo priority
+        newest = (self.pos - 1) % self.capacity
+        n = batch_size - 1
+        segment = self.tree.total() / n
+        values = (np.arange(n) + np.random.rand(n)) * segment
+        # Chặn sai số làm tròn rơi vào vị trí chưa có dữ liệu
+        sampled = np.minimum(self.tree.find(values), size - 1)
+        return np.concatenate(([newest], sampled))
+    
+    def sample(self, batch_size):
+        with self._lock:
+            idx = self.sample_indices(batch_size)
+            
+            # Importance-sampling weights, chuẩn hóa theo max trong batch
+            probs = self.tree.get(idx) / self.tree.total()
+            weights = (self.size * probs) ** (-self.beta)
+            weights = (weights / weights.max()).astype(np.float32)
+            self.beta = min(1.0, self.beta + self.beta_increment)
+            
+            states, next_states = self._read_states(idx)
+            return (states, self.actions[idx], self.rewards[idx],
+                    next_states, self.dones[idx], idx, weights)
+    
+    def update_priorities(self, indices, td_errors):
+        priorities = np.abs(td_errors) + self.eps
+        with self._lock:
+            self.max_priority = max(self.max_priority, float(priorities.max()))
+            self.tree.update(indices, priorities ** self.alpha)
@@ -0,0 +1,22 @@
+# responses.py
+# Response class + exception handler dùng chung cho api.py và api_inference.py
+import orjson
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse
+from schemas import legacy_errors
+
+
+class ORJSONResponse(JSONResponse):
+    """
+    JSONResponse serialize bằng orjson (nhanh hơn json của stdlib, nhận được cả numpy scalar / array)
+    Route trả thẳng ORJSONResponse(...) thì bỏ qua cả bước jsonable_encoder của FastAPI
+    """
+    def render(self, content):
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+
+
+async def validation_error_handler(request, exc: RequestValidationError):
+    """422 như handler mặc định của FastAPI, thông báo lỗi raw_data / position giữ như trước"""
+    errors = legacy_errors(exc.errors(), {"body": exc.body})
+    return ORJSONResponse(status_code=422, content={"detail": jsonable_encoder(errors)})
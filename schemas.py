@@ -0,0 +1,147 @@
+# schemas.py
+# Data models (pydantic) cho request của API và offline trainer
+#
+# raw_data là TypedDict có kiểu cho từng field → pydantic-core validate toàn bộ
+# (không chạy code Python cho từng field), kết quả vẫn là dict cho state_encoder
+from typing import List, Literal, Optional, Union
+from typing_extensions import Annotated, TypedDict
+from pydantic import BaseModel, ConfigDict, Field, StrictFloat, StrictInt
+from config import MAX_PRODUCTS, NUM_ACTIONS, CATEGORIES, GENDER_MAP, AGE_MAP, POSITION_MAP
+
+Gender = Literal[tuple(GENDER_MAP)]
+AgeGroup = Literal[tuple(AGE_MAP)]
+Category = Literal[tuple(CATEGORIES)]
+Position = Literal[tuple(POSITION_MAP)]
+ProductId = Annotated[StrictInt, Field(ge=1, le=NUM_ACTIONS)]
+Segment = Annotated[str, Field(pattern=r"^[A-Za-z0-9_-]{1,64}$", description="Agent riêng của segment (None = agent chung)")]
+NonNegative = Union[Annotated[StrictInt, Field(ge=0)], Annotated[StrictFloat, Field(ge=0)]]
+
+
+# raw_data theo position, mọi field đều không bắt buộc (state_encoder có giá trị mặc định)
+class CommonRawData(TypedDict, total=False):
+    gender: Gender
+    age_group: AgeGroup
+    day_of_week: Annotated[StrictInt, Field(ge=1, le=7)]
+
+
+class SearchRawData(CommonRawData, total=False):
+    recent_searches: NonNegative
+
+
+class CartRawData(CommonRawData, total=False):
+    num_products: NonNegative
+    total_value: NonNegative
+    avg_value: NonNegative
+    products: List[StrictInt]
+    product_ids: Union[List[ProductId], ProductId]
+    category: Union[List[Category], Category]
+
+
+class HomeRawData(CommonRawData, total=False):
+    top_products: List[StrictInt]
+    top_categories: List[str]
+
+
+class RawData(SearchRawData, CartRawData, HomeRawData, total=False):
+    """
+    raw_data của mọi position: field nào có mặt thì được kiểm tra, không phụ thuộc position
+    Field lạ được giữ nguyên (như raw_data: dict trước đây)
+    """
+    __pydantic_config__ = ConfigDict(extra="allow")
+
+
+# Data model cho /recommend
+class RecommendInput(BaseModel):
+    raw_data: RawData
+    position: Position
+    k: int = Field(10, ge=1, le=MAX_PRODUCTS, description=f"Số sản phẩm gợi ý (1-{MAX_PRODUCTS})")
+    segment: Optional[Segment] = None
+
+# Data model cho /train
+class TrainInput(BaseModel):
+    raw_data: RawData
+    position: Position
+    action: int = Field(..., ge=1, le=NUM_ACTIONS, description=f"Product ID phải từ 1-{NUM_ACTIONS}")
+    reward: float = Field(..., description="Reward value (có thể âm hoặc dương)")
+    next_raw_data: RawData
+    next_position: Position
+    done: bool
+    segment: Optional[Segment] = None
+
+# Data model cho /admin/models/snapshot
+class SnapshotInput(BaseModel):
+    note: Optional[str] = Field(None, description="Ghi chú cho version (vd: nguồn dữ liệu train)")
+
+
+# Thông báo lỗi giữ nguyên như bản validator cũ (client có thể đang hiển thị / parse)
+POSITION_ERROR = f"position phải là một trong: {list(POSITION_MAP.keys())}"
+
+
+def raw_data_error(v):
+    """Thông báo lỗi đầu tiên của raw_data theo đúng thứ tự kiểm tra cũ, None nếu không có"""
+    if 'gender' in v and v['gender'] not in GENDER_MAP:
+        return f"gender phải là một trong: {list(GENDER_MAP.keys())}"
+    if 'age_group' in v and v['age_group'] not in AGE_MAP:
+        return f"age_group phải là một trong: {list(AGE_MAP.keys())}"
+    if 'day_of_week' in v:
+        day = v['day_of_week']
+        if not isinstance(day, int) or day < 1 or day > 7:
+            return "day_of_week phải là số nguyên từ 1-7"
+    if 'category' in v:
+        cats = v['category'] if isinstance(v['category'], list) else [v['category']]
+        invalid_cats = [c for c in cats if c not in CATEGORIES]
+        if invalid_cats:
+            return f"category không hợp lệ: {invalid_cats}. Phải nằm trong: {CATEGORIES}"
+    if 'product_ids' in v:
+        products = v['product_ids'] if isinstance(v['product_ids'], list) else [v['product_ids']]
+        for pid in products:
+            if not isinstance(pid, int) or pid < 1 or pid > NUM_ACTIONS:
+                return f"product_id phải là số nguyên từ 1-{NUM_ACTIONS}"
+    for field in ('num_products', 'total_value', 'avg_value', 'recent_searches'):
+        if field in v and (not isinstance(v[field], (int, float)) or v[field] < 0):
+            return f"{field} phải là số không âm"
+    return None
+
+
+def legacy_errors(errors, root):
+    """
+    Đổi lỗi của pydantic-core về dạng cũ: mỗi raw_data lỗi → 1 lỗi "Value error, ..." ở mức
+    raw_data, position sai → "Value error, position phải là ...". Lỗi khác giữ nguyên
+    Chỉ chạy khi request lỗi, không ảnh hưởng hot path
+
+    Args:
+        errors: ValidationError.errors()
+        root: dữ liệu mà loc trỏ vào (vd {"body": body} với RequestValidationError)
+    """
+    result = []
+    seen = set()
+    for error in errors:
+        loc = tuple(error["loc"])
+        field = next((i for i, part in enumerate(loc) if part in ("raw_data", "next_raw_data")), None)
+        if field is not None:
+            key = loc[:field + 1]
+            raw_data = _lookup(root, key)
+            message = raw_data_error(raw_data) if isinstance(raw_data, dict) else None
+            if message is not None:
+                if key not in seen:
+                    seen.add(key)
+                    result.append(_value_error(key, message, raw_data))
+                continue
+        elif loc and loc[-1] in ("position", "next_position") and error["type"] == "literal_error":
+            error = _value_error(loc, POSITION_ERROR, error["input"])
+        result.append(error)
+    return result
+
+
+def _lookup(root, loc):
+    for part in loc:
+        try:
+            root = root[part]
+        except (KeyError, IndexError, TypeError):
+            return None
+    return root
+
+
+def _value_error(loc, message, value):
+    return {"type": "value_error", "loc": loc, "msg": f"Value error, {message}",
+            "input": value, "ctx": {"error": {}}}
@@ -0,0 +1,190 @@
+# shared_weights.py
+import copy
+import threading
+import time
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+import torch
+
+
+def flatten_state_dict(state_dict):
+    """Nối toàn bộ tham số thành 1 mảng float32 (theo thứ tự của state_dict)"""
+    return torch.cat([v.detach().reshape(-1).float().cpu() for v in state_dict.values()]).numpy()
+
+
+def unflatten_state_dict(flat, template):
+    """Cắt mảng phẳng thành state_dict theo shape của template"""
+    state_dict, offset = {}, 0
+    for key, value in template.items():
+        n = value.numel()
+        state_dict[key] = torch.from_numpy(np.array(flat[offset:offset + n])).view(value.shape)
+        offset += n
+    return state_dict
+
+
+def _untracked(shm):
+    # Vùng nhớ phải sống qua các lần restart trainer/worker:
+    # không để resource_tracker tự xóa khi process thoát
+    try:
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+    return shm
+
+
+class SharedWeights:
+    """
+    Vùng shared memory chứa weights DQN cho nhiều process inference
+
+    Layout:
+    - int64[4]: seq (seqlock, lẻ = đang ghi), version, train_count, is_trained
+    - float64: epsilon
+    - float32[num_params]: tham số model (thứ tự state_dict)
+
+    Trainer process tạo vùng nhớ (create=True) và publish, API workers map để đọc.
+    Vùng nhớ được giữ lại khi trainer restart (version tiếp tục tăng) để
+    workers đang map không bị mất kết nối
+    """
+    HEADER_BYTES = 64
+
+    def __init__(self, name, num_params, create=False):
+        self.name = name
+        self.num_params = num_params
+        size = self.HEADER_BYTES + num_params * 4
+
+        if create:
+            try:
+                self.shm = _untracked(SharedMemory(name=name))
+                if self.shm.size < size:
+                    # Model đổi kích thước → tạo lại vùng nhớ
+                    self.shm.close()
+                    self.shm.unlink()
+                    raise FileNotFoundError(name)
+            except FileNotFoundError:
+                self.shm = _untracked(SharedMemory(name=name, create=True, size=size))
+        else:
+            self.shm = _untracked(SharedMemory(name=name))
+            if self.shm.size < size:
+                raise ValueError(f"Shared memory {name} nhỏ hơn kích thước model ({self.shm.size} < {size})")
+
+        buf = self.shm.buf
+        self._header = np.ndarray((4,), dtype=np.int64, buffer=buf, offset=0)
+        self._epsilon = np.ndarray((1,), dtype=np.float64, buffer=buf, offset=32)
+        self._params = np.ndarray((num_params,), dtype=np.float32, buffer=buf, offset=self.HEADER_BYTES)
+        if create:
+            # Trainer trước có thể chết giữa 2 lần tăng seq → seq lẻ mãi, reader không đọc được
+            # và publish sau chạy với seq chẵn khi đang ghi: làm tròn lên số chẵn trước lần publish đầu
+            self._header[0] += self._header[0] % 2
+        else:
+            self._params.flags.writeable = False
+
+    def version(self):
+        return int(self._header[1])
+
+    def publish(self, state_dict, epsilon, train_count, is_trained):
+        """
+        Ghi weights mới, tăng version (seqlock: reader thấy seq lẻ hoặc seq đổi sẽ đọc lại)
+        """
+        flat = flatten_state_dict(state_dict)
+        self._header[0] += 1
+        self._params[:] = flat
+        self._epsilon[0] = epsilon
+        self._header[1] += 1
+        self._header[2] = train_count
+        self._header[3] = int(is_trained)
+        self._header[0] += 1
+        return int(self._header[1])
+
+    def read(self, retries=100):
+        """Đọc bản nhất quán: (version, epsilon, train_count, is_trained, params) hoặc None"""
+        for _ in range(retries):
+            seq = int(self._header[0])
+            if seq % 2 == 1:
+                time.sleep(0.0001)
+                continue
+            params = self._params.copy()
+            epsilon = float(self._epsilon[0])
+            version, train_count, is_trained = (int(x) for x in self._header[1:4])
+            if int(self._header[0]) == seq:
+                return version, epsilon, train_count, bool(is_trained), params
+        return None
+
+    def close(self):
+        # Bỏ các view numpy trước khi đóng buffer
+        del self._header, self._epsilon, self._params
+        self.shm.close()
+
+
+class WeightSubscriber:
+    """
+    Thread trong API worker: theo dõi version trong shared memory,
+    có version mới thì nạp vào agent.inference_model (swap reference)
+    """
+    def __init__(self, agent, name, interval_sec=0.05):
+        self.agent = agent
+        self.name = name
+        self.interval_sec = interval_sec
+        self.shared = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="weight-subscriber", daemon=True)
+
+        # Tracking
+        self.version = 0  # Version shared memory đã nạp
+        self.updates = 0
+        self.last_error = None
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        if self.shared is not None:
+            self.shared.close()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self.shared is None:
+                    num_params = sum(p.numel() for p in self.agent.model.parameters())
+                    self.shared = SharedWeights(self.name, num_params)
+                self.refresh()
+                self.last_error = None
+            except FileNotFoundError:
+                self.last_error = "Trainer chưa publish weights"
+            except Exception as e:
+                self.last_error = str(e)
+            self._stop.wait(self.interval_sec)
+
+    def refresh(self):
+        version = self.shared.version()
+        if version == 0 or version == self.version:
+            return
+        snapshot = self.shared.read()
+        if snapshot is None:
+            return
+
+        version, epsilon, train_count, is_trained, params = snapshot
+        # Dựng từ model float32 (inference_model có thể đã quantize int8 / fp16)
+        model = copy.deepcopy(self.agent.model).eval()
+        model.requires_grad_(False)
+        model.load_state_dict(unflatten_state_dict(params, model.state_dict()))
+        self.agent.inference_model = self.agent.prepare_inference_model(model)
+        # Version của shared memory đánh số khác version local (cache top-k, IVF index theo version local)
+        # → tăng version local như publish_inference_model, version shared chỉ giữ ở self.version
+        self.agent.inference_version += 1
+        self.agent.epsilon = epsilon
+        self.agent.train_count = train_count
+        self.agent.is_trained = is_trained
+        self.version = version
+        self.updates += 1
+
+    def status(self):
+        return {
+            "shared_memory": self.name,
+            "attached": self.shared is not None,
+            "version": self.version,
+            "updates": self.updates,
+            "last_error": self.last_error
+        }
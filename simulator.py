@@ -0,0 +1,306 @@
+# simulator.py
+"""
+Mô phỏng người mua (synthetic shoppers) + vòng lặp kín để đo tốc độ học của engine
+
+    python simulator.py                                   # chạy tới khi đạt 90% hit rate tối ưu
+    python simulator.py --target-hit-rate 0.6 --max-seconds 60 --out sim.json
+    python simulator.py --updates-per-sample 0.25 --batch-size 64
+
+ShopperSimulator:
+- Mỗi user có gender / age_group (quan sát được) → thuộc 1 segment (ẩn)
+- Mỗi segment thích 1 nhóm nhỏ sản phẩm (xác suất click cao), còn lại click rất thấp
+- raw_data cho search / cart / home đúng các field encode_state dùng
+  (cart / home chứa sản phẩm segment thích, có nhiễu)
+- Phản hồi cho top-k gợi ý tính vectorized: click theo xác suất của segment,
+  sản phẩm click đầu tiên là action, mua (reward 1.0) hoặc chỉ click (reward 0.5);
+  không click → sản phẩm đầu danh sách với --skip-reward (mặc định 0, bỏ qua nếu "none").
+  Mỗi user là 1 session 1 bước (done=True)
+
+Vòng lặp kín: mỗi vòng users_per_round user mới → encode_states → select_top_actions_batch
+(epsilon-greedy như API) → phản hồi → push_batch + train (OfflineTrainer).
+Định kỳ đo hit rate greedy trên nhóm user đánh giá cố định:
+    hit rate = P(ít nhất 1 click trong top-k), tính theo xác suất (không lấy mẫu)
+
+Báo cáo: transitions/s, thời gian tới target hit rate (không tính thời gian đánh giá),
+CPU time, max RSS. Seed cố định → các lần chạy so sánh được với nhau.
+"""
+import argparse
+import json
+import platform
+import random
+import resource
+import time
+import numpy as np
+import torch
+from agent import create_agent
+from train_offline import OfflineTrainer
+from state_encoder import encode_states, STATE_DIM
+from config import (
+    CATEGORIES, GENDER_MAP, AGE_MAP, POSITION_MAP, MAX_PRODUCTS, NUM_ACTIONS,
+    REPLAY_CAPACITY, UPDATES_PER_SAMPLE, TARGET_UPDATE_EVERY
+)
+
+GENDERS = list(GENDER_MAP)
+AGE_GROUPS = list(AGE_MAP)
+POSITIONS = list(POSITION_MAP)
+
+
+class ShopperSimulator:
+    def __init__(self, num_products=NUM_ACTIONS, num_segments=8, liked_per_segment=5,
+                 base_click=0.01, purchase_rate=0.3, skip_reward=0.0, seed=0):
+        self.rng = np.random.default_rng(seed)
+        self.num_products = num_products
+        self.num_segments = num_segments
+        self.purchase_rate = purchase_rate
+        self.skip_reward = skip_reward
+
+        # (gender, age_group) → segment, gán ngẫu nhiên theo seed
+        combos = len(GENDERS) * len(AGE_GROUPS)
+        self.segment_of = self.rng.permutation(combos) % num_segments
+
+        # Sở thích ẩn: liked_per_segment sản phẩm click 30-70%, còn lại base_click
+        self.preferences = np.full((num_segments, num_products), base_click, dtype=np.float64)
+        self.liked = np.empty((num_segments, liked_per_segment), dtype=np.int64)
+        for segment in range(num_segments):
+            liked = self.rng.choice(num_products, liked_per_segment, replace=False)
+            self.liked[segment] = liked
+            self.preferences[segment, liked] = self.rng.uniform(0.3, 0.7, liked_per_segment)
+        self.product_category = self.rng.integers(len(CATEGORIES), size=num_products)
+
+    def sample_users(self, n, rng=None):
+        """n user mới: chỉ số gender, age_group, position và segment ẩn"""
+        rng = rng or self.rng
+        genders = rng.integers(len(GENDERS), size=n)
+        ages = rng.integers(len(AGE_GROUPS), size=n)
+        return {
+            "gender": genders,
+            "age_group": ages,
+            "position": rng.integers(len(POSITIONS), size=n),
+            "day_of_week": rng.integers(1, 8, size=n),
+            "segment": self.segment_of[genders * len(AGE_GROUPS) + ages]
+        }
+
+    def raw_data(self, users, rng=None):
+        """Danh sách (raw_data, position) cho encode_states"""
+        rng = rng or self.rng
+        n = len(users["segment"])
+        # Sản phẩm trong context: 1-4 sản phẩm, ~70% từ nhóm segment thích, còn lại ngẫu nhiên
+        counts = rng.integers(1, 5, size=n)
+        from_liked = rng.random((n, 4)) < 0.7
+        liked = self.liked[users["segment"][:, None], rng.integers(self.liked.shape[1], size=(n, 4))]
+        context = np.where(from_liked, liked, rng.integers(self.num_products, size=(n, 4))) + 1
+        recent_searches = rng.integers(0, 30, size=n)
+        prices = rng.uniform(50000, 500000, size=(n, 4))
+
+        items = []
+        for i in range(n):
+            position = POSITIONS[users["position"][i]]
+            raw_data = {
+                "gender": GENDERS[users["gender"][i]],
+                "age_group": AGE_GROUPS[users["age_group"][i]],
+                "day_of_week": int(users["day_of_week"][i]),
+            }
+            products = [int(p) for p in dict.fromkeys(context[i, :counts[i]]) if p <= MAX_PRODUCTS]
+            categories = list(dict.fromkeys(CATEGORIES[self.product_category[p - 1]] for p in products))
+            if position == "search":
+                raw_data["recent_searches"] = int(recent_searches[i])
+            elif position == "cart":
+                total_value = float(prices[i, :len(products)].sum())
+                raw_data.update({
+                    "num_products": len(products),
+                    "total_value": total_value,
+                    "avg_value": total_value / len(products) if products else 0.0,
+                    "products": products,
+                    "category": categories
+                })
+            else:
+                raw_data.update({"top_products": products, "top_categories": categories})
+            items.append((raw_data, position))
+        return items
+
+    def click_probs(self, segments, actions):
+        """Xác suất click (n, k) cho các action index đã gợi ý"""
+        return self.preferences[segments[:, None], actions]
+
+    def respond(self, users, actions):
+        """
+        Phản hồi của user cho top-k gợi ý (actions: (n, k) action index)
+        Không click: transition cho sản phẩm đầu danh sách với skip_reward
+        (skip_reward=None → không có transition)
+        Returns: (mask user có transition, action, reward)
+        """
+        n = len(actions)
+        clicks = self.rng.random(actions.shape) < self.click_probs(users["segment"], actions)
+        clicked = clicks.any(axis=1)
+        # argmax = 0 khi không click → sản phẩm đầu danh sách
+        chosen = actions[np.arange(n), clicks.argmax(axis=1)]
+        rewards = np.where(self.rng.random(n) < self.purchase_rate, 1.0, 0.5).astype(np.float32)
+        if self.skip_reward is None:
+            return clicked, chosen, rewards
+        rewards[~clicked] = self.skip_reward
+        return np.ones(n, dtype=np.bool_), chosen, rewards
+
+    def hit_rate(self, segments, actions):
+        """P(ít nhất 1 click trong top-k), trung bình trên các user"""
+        probs = self.click_probs(segments, actions)
+        return float(np.mean(1 - np.prod(1 - probs, axis=1)))
+
+    def oracle_hit_rate(self, segments, k):
+        """Hit rate nếu gợi ý đúng top-k sản phẩm mỗi segment thích nhất"""
+        best = np.argsort(-self.preferences, axis=1)[:, :k]
+        return self.hit_rate(segments, best[segments])
+
+    def random_hit_rate(self, segments, k):
+        """Hit rate kỳ vọng của gợi ý ngẫu nhiên"""
+        prefs = self.preferences[segments]
+        return float(np.mean(1 - (1 - prefs.mean(axis=1)) ** k))
+
+
+def evaluate(agent, sim, eval_users, eval_states, k):
+    """Hit rate greedy (không exploration) trên nhóm user đánh giá"""
+    if not agent.is_trained:
+        actions = np.array([agent.random_actions(k) for _ in range(len(eval_states))])
+    else:
+        actions = np.array(agent.model_top_actions(eval_states, [k] * len(eval_states)))
+    return sim.hit_rate(eval_users["segment"], actions)
+
+
+def run(agent, sim, args):
+    """Vòng lặp kín simulator ↔ agent, trả về báo cáo"""
+    trainer = OfflineTrainer(agent, batch_size=args.batch_size,
+                             updates_per_sample=args.updates_per_sample,
+                             target_update_every=TARGET_UPDATE_EVERY)
+    eval_rng = np.random.default_rng(args.seed + 1)
+    eval_users = sim.sample_users(args.eval_users, eval_rng)
+    eval_states = encode_states(sim.raw_data(eval_users, eval_rng))
+    oracle = sim.oracle_hit_rate(eval_users["segment"], args.k)
+    target = args.target_hit_rate if args.target_hit_rate is not None else 0.9 * oracle
+
+    print(f"Hit rate: random {sim.random_hit_rate(eval_users['segment'], args.k):.3f}, "
+          f"oracle {oracle:.3f}, target {target:.3f}")
+
+    history = []
+    recommendations = 0
+    train_time = 0.0
+    time_to_target = None
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    hit_rate = evaluate(agent, sim, eval_users, eval_states, args.k)
+
+    for round_index in range(1, args.max_rounds + 1):
+        start = time.perf_counter()
+        users = sim.sample_users(args.users_per_round)
+        states = encode_states(sim.raw_data(users))
+        actions = np.array(agent.select_top_actions_batch(states, [args.k] * len(states)), dtype=np.int64)
+        observed, chosen, rewards = sim.respond(users, actions)
+
+        if observed.any():
+            # Mỗi user mô phỏng là 1 session 1 bước (done)
+            rows = np.flatnonzero(observed)
+            trainer.push(states[rows], chosen[rows], rewards[rows], states[rows],
+                         np.ones(len(rows), dtype=np.bool_))
+        recommendations += len(states)
+        train_time += time.perf_counter() - start
+
+        if round_index % args.eval_every == 0:
+            hit_rate = evaluate(agent, sim, eval_users, eval_states, args.k)
+            history.append({
+                "round": round_index,
+                "train_sec": round(train_time, 3),
+                "transitions": trainer.accepted,
+                "train_count": int(agent.train_count),
+                "hit_rate": round(hit_rate, 4)
+            })
+            print(f"  round {round_index}: {train_time:.1f}s, {trainer.accepted} transitions, "
+                  f"train_count={agent.train_count}, hit rate {hit_rate:.3f}")
+            if time_to_target is None and hit_rate >= target:
+                time_to_target = train_time
+                if not args.continue_after_target:
+                    break
+        if train_time >= args.max_seconds:
+            break
+
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    return {
+        "target_hit_rate": round(target, 4),
+        "oracle_hit_rate": round(oracle, 4),
+        "final_hit_rate": round(hit_rate, 4),
+        "time_to_target_sec": round(time_to_target, 3) if time_to_target is not None else None,
+        "rounds": round_index,
+        "recommendations": recommendations,
+        "transitions": trainer.accepted,
+        "train_count": int(agent.train_count),
+        "train_sec": round(train_time, 3),
+        "transitions_per_sec": round(trainer.accepted / max(train_time, 1e-9), 1),
+        "recommendations_per_sec": round(recommendations / max(train_time, 1e-9), 1),
+        "wall_sec": round(wall, 3),
+        "cpu_sec": round(cpu, 3),
+        "cpu_utilization": round(cpu / max(wall, 1e-9), 3),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "history": history
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vòng lặp kín simulator người mua ↔ DQN agent")
+    parser.add_argument("--users-per-round", type=int, default=2048, help="Số user mô phỏng mỗi vòng")
+    parser.add_argument("--k", type=int, default=10, help="Số sản phẩm gợi ý mỗi user")
+    parser.add_argument("--segments", type=int, default=8, help="Số segment ẩn")
+    parser.add_argument("--liked", type=int, default=5, help="Số sản phẩm mỗi segment thích")
+    parser.add_argument("--skip-reward", default="0",
+                        help="Reward khi không click sản phẩm nào (\"none\": không tạo transition)")
+    parser.add_argument("--target-hit-rate", type=float, default=None,
+                        help="Hit rate cần đạt (mặc định 90%% hit rate tối ưu)")
+    parser.add_argument("--continue-after-target", action="store_true",
+                        help="Chạy tiếp tới --max-seconds / --max-rounds sau khi đạt target")
+    parser.add_argument("--max-seconds", type=float, default=120.0, help="Giới hạn thời gian train")
+    parser.add_argument("--max-rounds", type=int, default=10000)
+    parser.add_argument("--eval-users", type=int, default=2000, help="Số user của nhóm đánh giá")
+    parser.add_argument("--eval-every", type=int, default=2, help="Đánh giá mỗi N vòng")
+    parser.add_argument("--updates-per-sample", type=float, default=UPDATES_PER_SAMPLE)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--replay-capacity", type=int, default=REPLAY_CAPACITY)
+    parser.add_argument("--compact-replay", action="store_true")
+    parser.add_argument("--threads", type=int, default=1, help="torch.set_num_threads")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help="Lưu báo cáo JSON")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    torch.manual_seed(args.seed)
+    torch.set_num_threads(args.threads)
+
+    agent = create_agent(STATE_DIM, memory_capacity=args.replay_capacity, compact_replay=args.compact_replay)
+    sim = ShopperSimulator(agent.action_dim, num_segments=args.segments,
+                           liked_per_segment=args.liked, seed=args.seed,
+                           skip_reward=None if args.skip_reward == "none" else float(args.skip_reward))
+    report = run(agent, sim, args)
+
+    print(f"\nTarget hit rate {report['target_hit_rate']:.3f} (oracle {report['oracle_hit_rate']:.3f}), "
+          f"cuối cùng {report['final_hit_rate']:.3f}")
+    if report["time_to_target_sec"] is not None:
+        print(f"Đạt target sau {report['time_to_target_sec']:.1f}s train")
+    else:
+        print("Chưa đạt target")
+    print(f"{report['transitions']} transitions / {report['recommendations']} lượt gợi ý trong "
+          f"{report['train_sec']:.1f}s: {report['transitions_per_sec']:,.0f} transitions/s, "
+          f"{report['recommendations_per_sec']:,.0f} gợi ý/s")
+    print(f"CPU {report['cpu_sec']:.1f}s ({report['cpu_utilization']:.0%} của wall {report['wall_sec']:.1f}s), "
+          f"max RSS {report['max_rss_mb']:.0f} MB")
+
+    if args.out:
+        report["meta"] = {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "args": vars(args)
+        }
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Đã lưu báo cáo vào {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 # state_encoder.py
+from typing import NamedTuple
 import numpy as np
 from config import (
     GENDER_MAP, AGE_MAP, CATEGORIES, MAX_PRODUCTS, POSITION_MAP,
@@ -6,6 +7,33 @@ from config import (
     AVG_VALUE_MIN, AVG_VALUE_MAX, RECENT_SEARCHES_MAX
 )
 
+STATE_DIM = 87
+
+# Offset của từng block feature trong state vector (dùng cho encode_states)
+GENDER_OFFSET = 0
+AGE_OFFSET = GENDER_OFFSET + 3
+DAY_OFFSET = AGE_OFFSET + 5
+SPECIFIC_OFFSET = DAY_OFFSET + 7                 # 15: bắt đầu phần đặc thù theo vị trí
+POSITION_OFFSET = STATE_DIM - len(POSITION_MAP)  # 84: position one-hot ở cuối
+
+# search: recent_searches(1) + keyword(5) + padding
+SEARCH_RECENT_COL = SPECIFIC_OFFSET
+# cart: num_products, total_value, avg_value + products + categories
+CART_NUM_PRODUCTS_COL = SPECIFIC_OFFSET
+CART_TOTAL_VALUE_COL = SPECIFIC_OFFSET + 1
+CART_AVG_VALUE_COL = SPECIFIC_OFFSET + 2
+CART_PRODUCT_OFFSET = SPECIFIC_OFFSET + 3
+CART_CATEGORY_OFFSET = CART_PRODUCT_OFFSET + MAX_PRODUCTS
+# home: top products + top categories
+HOME_PRODUCT_OFFSET = SPECIFIC_OFFSET
+HOME_CATEGORY_OFFSET = HOME_PRODUCT_OFFSET + MAX_PRODUCTS
+# Các cột có thể nhận giá trị liên tục (còn lại chỉ 0/1) → CompactReplayBuffer
+CONTINUOUS_COLS = (CART_NUM_PRODUCTS_COL, CART_TOTAL_VALUE_COL, CART_AVG_VALUE_COL)
+
+GENDER_INDEX = {g: vec.index(1) for g, vec in GENDER_MAP.items()}
+AGE_INDEX = {a: vec.index(1) for a, vec in AGE_MAP.items()}
+CATEGORY_INDEX = {c: i for i, c in enumerate(CATEGORIES)}
+
 
 def normalize_value(value, min_val, max_val):
     """
@@ -97,6 +125,8 @@ def encode_state(raw_data: dict, position: str):
         # Number of products, total/avg, keyword padding
         state_vec.extend([0,0,0])
         state_vec.extend([0]*5)
+        # Padding để đồng nhất với search (69 chiều)
+        state_vec.append(0)
 
     else:
         raise ValueError("Position must be one of 'search','cart','home'")
@@ -118,3 +148,146 @@ def encode_state(raw_data: dict, position: str):
         print(f"  Total: {len(result)}")
     
     return result
+
+
+def _collect_entries(items):
+    """
+    Gom các ô khác 0 của batch (raw_data, position):
+    - one-hot: (rows, cols), giá trị 1
+    - liên tục: (rows, cols, values) đã chuẩn hóa (cùng công thức normalize_value)
+    """
+    # One-hot: gom (row, col) rồi gán 1 lần
+    rows, cols = [], []
+    # Feature liên tục: gom (row, col, value, min, max) rồi chuẩn hóa vector hóa
+    cont_rows, cont_cols, cont_values, cont_mins, cont_maxs = [], [], [], [], []
+    
+    for i, (raw_data, position) in enumerate(items):
+        pos = position.lower()
+        if pos not in POSITION_MAP:
+            raise ValueError("Position must be one of 'search','cart','home'")
+        
+        rows.append(i)
+        cols.append(GENDER_OFFSET + GENDER_INDEX.get(raw_data.get("gender", "Other"), 2))
+        rows.append(i)
+        cols.append(AGE_OFFSET + AGE_INDEX.get(raw_data.get("age_group", "U20"), 0))
+        day_of_week = raw_data.get("day_of_week", 1)
+        if 1 <= day_of_week <= 7:
+            rows.append(i)
+            cols.append(DAY_OFFSET + day_of_week - 1)
+        
+        if pos == "search":
+            cont_rows.append(i)
+            cont_cols.append(SEARCH_RECENT_COL)
+            cont_values.append(raw_data.get("recent_searches", 0))
+            cont_mins.append(0)
+            cont_maxs.append(RECENT_SEARCHES_MAX)
+        
+        elif pos == "cart":
+            cont_rows.extend((i, i, i))
+            cont_cols.extend((CART_NUM_PRODUCTS_COL, CART_TOTAL_VALUE_COL, CART_AVG_VALUE_COL))
+            cont_values.extend((
+                raw_data.get("num_products", 0),
+                raw_data.get("total_value", 0),
+                raw_data.get("avg_value", 0)
+            ))
+            cont_mins.extend((0, TOTAL_VALUE_MIN, AVG_VALUE_MIN))
+            cont_maxs.extend((NUM_PRODUCTS_MAX, TOTAL_VALUE_MAX, AVG_VALUE_MAX))
+            
+            for pid in raw_data.get("products", []):
+                if 1 <= pid <= MAX_PRODUCTS:
+                    rows.append(i)
+                    cols.append(CART_PRODUCT_OFFSET + pid - 1)
+            for cat in raw_data.get("category", []):
+                if cat in CATEGORY_INDEX:
+                    rows.append(i)
+                    cols.append(CART_CATEGORY_OFFSET + CATEGORY_INDEX[cat])
+        
+        else:  # home
+            for pid in raw_data.get("top_products", []):
+                if 1 <= pid <= MAX_PRODUCTS:
+                    rows.append(i)
+                    cols.append(HOME_PRODUCT_OFFSET + pid - 1)
+            for cat in raw_data.get("top_categories", []):
+                if cat in CATEGORY_INDEX:
+                    rows.append(i)
+                    cols.append(HOME_CATEGORY_OFFSET + CATEGORY_INDEX[cat])
+        
+        rows.append(i)
+        cols.append(POSITION_OFFSET + POSITION_MAP[pos])
+    
+    if cont_rows:
+        # Tính float64 rồi ép float32 giống encode_state
+        values = np.asarray(cont_values, dtype=np.float64)
+        mins = np.asarray(cont_mins, dtype=np.float64)
+        maxs = np.asarray(cont_maxs, dtype=np.float64)
+        cont_values = np.clip((values - mins) / (maxs - mins), 0.0, 1.0).astype(np.float32)
+    
+    return rows, cols, cont_rows, cont_cols, cont_values
+
+
+def encode_states(items):
+    """
+    Encode batch (raw_data, position) thành ma trận float32 (N, 87)
+    
+    - Ghi thẳng vào ma trận cấp phát trước theo offset của từng block
+    - Kết quả giống hệt encode_state cho từng dòng
+    """
+    states = np.zeros((len(items), STATE_DIM), dtype=np.float32)
+    rows, cols, cont_rows, cont_cols, cont_values = _collect_entries(items)
+    
+    states[rows, cols] = 1
+    if cont_rows:
+        states[cont_rows, cont_cols] = cont_values
+    
+    return states
+
+
+class SparseStates(NamedTuple):
+    """
+    Batch state dạng thưa (định dạng của EmbeddingBag):
+    - indices: cột khác 0 của tất cả các dòng, nối liền (int64)
+    - values: giá trị tương ứng (float32, one-hot = 1)
+    - offsets: vị trí bắt đầu của từng dòng trong indices (int64, N phần tử)
+    """
+    indices: np.ndarray
+    values: np.ndarray
+    offsets: np.ndarray
+    
+    def __len__(self):
+        return len(self.offsets)
+    
+    def __getitem__(self, rows):
+        """Lấy các dòng rows (list/mảng index) → SparseStates mới, giống states[rows] của bản dense"""
+        rows = np.asarray(rows, dtype=np.int64)
+        counts = np.diff(self.offsets, append=len(self.indices))[rows]
+        offsets = np.concatenate(([0], np.cumsum(counts)[:-1])).astype(np.int64)
+        positions = np.repeat(self.offsets[rows] - offsets, counts) + np.arange(counts.sum())
+        return SparseStates(self.indices[positions], self.values[positions], offsets)
+    
+    def to_dense(self):
+        states = np.zeros((len(self.offsets), STATE_DIM), dtype=np.float32)
+        rows = np.repeat(np.arange(len(self.offsets)), np.diff(self.offsets, append=len(self.indices)))
+        states[rows, self.indices] = self.values
+        return states
+
+
+def encode_states_sparse(items):
+    """
+    Encode batch (raw_data, position) thành SparseStates
+    
+    - Chỉ giữ các ô active (~10-20/87), to_dense() giống hệt encode_states
+    - One-hot trùng (vd: products lặp lại) chỉ tính 1 lần như bản dense
+    """
+    rows, cols, cont_rows, cont_cols, cont_values = _collect_entries(items)
+    
+    # Khóa row * STATE_DIM + col: loại trùng + sắp xếp theo dòng trong 1 lần
+    one_hot_keys = np.unique(np.asarray(rows, dtype=np.int64) * STATE_DIM + np.asarray(cols, dtype=np.int64))
+    cont_keys = np.asarray(cont_rows, dtype=np.int64) * STATE_DIM + np.asarray(cont_cols, dtype=np.int64)
+    keys = np.concatenate((one_hot_keys, cont_keys))
+    values = np.concatenate((np.ones(len(one_hot_keys), dtype=np.float32),
+                             np.asarray(cont_values, dtype=np.float32)))
+    order = np.argsort(keys, kind="stable")
+    keys, values = keys[order], values[order]
+    
+    offsets = np.searchsorted(keys // STATE_DIM, np.arange(len(items)))
+    return SparseStates(keys % STATE_DIM, values, offsets.astype(np.int64))
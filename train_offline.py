@@ -0,0 +1,252 @@
+# train_offline.py
+"""
+Offline bulk training từ file log tương tác (JSONL / CSV, có thể nén .gz)
+
+Mỗi record có dạng giống body của /train:
+    raw_data, position, action, reward, next_raw_data, next_position, done
+(CSV: raw_data và next_raw_data là chuỗi JSON)
+
+Đọc file theo kiểu streaming (generator) nên file lớn hơn RAM vẫn chạy được:
+    đọc → validate (TrainInput) → encode theo chunk (encode_states) → push_batch
+    → train updates_per_sample lần cho mỗi transition → lặp lại theo số epoch
+Dòng JSON / CSV hỏng (vd file bị cắt giữa chừng) được bỏ qua như record không hợp lệ (in file:dòng).
+Checkpoint mà api.py load khi khởi động được ghi mỗi --save-every chunk và khi kết thúc
+(kể cả khi bị lỗi / Ctrl+C giữa chừng → không mất phần đã train).
+
+Ví dụ:
+    python train_offline.py logs/2024-*.jsonl.gz --epochs 3 --updates-per-sample 0.5
+"""
+import argparse
+import csv
+import gzip
+import itertools
+import json
+import os
+import time
+import numpy as np
+from pydantic import ValidationError
+from agent import create_agent
+from schemas import TrainInput, legacy_errors
+from state_encoder import encode_states, STATE_DIM
+from config import (
+    MODEL_PATH, REPLAY_CAPACITY, UPDATES_PER_SAMPLE, TARGET_UPDATE_EVERY
+)
+
+
+def open_text(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    return open(path, "r", encoding="utf-8", newline="")
+
+
+class ParseError:
+    """Record không parse được (thay cho record trong stream, validate_records đếm như record lỗi)"""
+    def __init__(self, path, line_no, error):
+        self.message = f"{path}:{line_no}: {error}"
+
+
+def read_jsonl(path):
+    with open_text(path) as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                yield ParseError(path, line_no, f"JSON không hợp lệ: {e}")
+
+
+def read_csv(path):
+    with open_text(path) as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            try:
+                row["raw_data"] = json.loads(row["raw_data"])
+                row["next_raw_data"] = json.loads(row["next_raw_data"])
+                row["done"] = row["done"].strip().lower() in ("1", "true", "yes")
+            except (ValueError, TypeError, AttributeError) as e:
+                # TypeError / AttributeError: dòng thiếu cột (giá trị None)
+                yield ParseError(path, reader.line_num, f"dòng CSV không hợp lệ: {e}")
+                continue
+            yield row
+
+
+def read_records(paths):
+    """Stream record từ nhiều file, chọn parser theo phần mở rộng"""
+    for path in paths:
+        name = path[:-3] if path.endswith(".gz") else path
+        if name.endswith(".csv"):
+            yield from read_csv(path)
+        elif name.endswith((".jsonl", ".ndjson", ".json")):
+            yield from read_jsonl(path)
+        else:
+            raise ValueError(f"Không hỗ trợ định dạng file: {path}")
+
+
+def format_error(e, record=None):
+    """1 dòng mô tả lỗi validate (field đầu tiên bị lỗi với ValidationError)"""
+    if isinstance(e, ValidationError):
+        error = legacy_errors(e.errors(), record)[0]
+        location = ".".join(str(part) for part in error["loc"])
+        return f"{location}: {error['msg']}" if location else error["msg"]
+    return str(e).splitlines()[0] if str(e) else type(e).__name__
+
+
+def validate_records(records):
+    """
+    Validate record theo TrainInput
+    Returns: (items hợp lệ, [(vị trí trong records, lỗi)])
+    """
+    items, errors = [], []
+    for i, record in enumerate(records):
+        if isinstance(record, ParseError):
+            errors.append((i, record.message))
+            continue
+        try:
+            items.append(TrainInput.model_validate(record))
+        except (ValidationError, ValueError, TypeError) as e:
+            errors.append((i, format_error(e, record)))
+    return items, errors
+
+
+def encode_transitions(items):
+    """TrainInput đã validate → (states, actions, rewards, next_states, dones) cho push_batch"""
+    states = encode_states([(item.raw_data, item.position) for item in items])
+    next_states = encode_states([(item.next_raw_data, item.next_position) for item in items])
+    # Product ID (1-50) → action index (0-49)
+    actions = np.array([item.action - 1 for item in items], dtype=np.int64)
+    rewards = np.array([item.reward for item in items], dtype=np.float32)
+    dones = np.array([item.done for item in items], dtype=np.bool_)
+    return states, actions, rewards, next_states, dones
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class OfflineTrainer:
+    """
+    Đẩy dữ liệu log vào replay buffer và train DQNAgent theo chunk
+
+    - Record không hợp lệ bị bỏ qua (đếm trong rejected)
+    - Tỷ lệ train: updates_per_sample lần train cho mỗi transition
+    - Dùng chung cho POST /train/stream (push: chunk đã encode)
+    """
+    def __init__(self, agent, batch_size=32, updates_per_sample=1.0, target_update_every=100):
+        self.agent = agent
+        self.batch_size = batch_size
+        self.updates_per_sample = updates_per_sample
+        self.target_update_every = target_update_every
+        self._update_credit = 0.0
+
+        # Tracking
+        self.accepted = 0
+        self.rejected = 0
+        self.updates = 0
+
+    def validate(self, records):
+        valid, errors = validate_records(records)
+        for _, error in errors:
+            self.rejected += 1
+            if self.rejected <= 10:
+                print(f"Bỏ qua record không hợp lệ: {error}")
+        return valid
+
+    def ingest(self, records):
+        """Validate + encode + push 1 chunk vào replay buffer, sau đó train"""
+        items = self.validate(records)
+        if not items:
+            return 0
+        return self.push(*encode_transitions(items))
+
+    def push(self, states, actions, rewards, next_states, dones):
+        """push_batch các transition đã encode rồi train theo updates_per_sample"""
+        self.agent.memory.push_batch(states, actions, rewards, next_states, dones)
+        self.accepted += len(states)
+
+        self._update_credit += self.updates_per_sample * len(states)
+        while self._update_credit >= 1:
+            self._update_credit -= 1
+            self.agent.train_step(self.batch_size)
+            self.updates += 1
+            if self.agent.train_count % self.target_update_every == 0:
+                self.agent.update_target()
+        return len(states)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline bulk training DQN từ file log tương tác")
+    parser.add_argument("files", nargs="+", help="File JSONL/CSV (có thể .gz)")
+    parser.add_argument("--epochs", type=int, default=1)
+    parser.add_argument("--chunk-size", type=int, default=4096, help="Số record encode mỗi lần")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--updates-per-sample", type=float, default=UPDATES_PER_SAMPLE)
+    parser.add_argument("--target-update-every", type=int, default=TARGET_UPDATE_EVERY)
+    parser.add_argument("--replay-capacity", type=int, default=REPLAY_CAPACITY)
+    parser.add_argument("--replay-path", default=None,
+                        help="Thư mục replay buffer mmap (mặc định chỉ giữ trong RAM)")
+    parser.add_argument("--compact-replay", action="store_true",
+                        help="Lưu state nén trong replay buffer (~15x ít bộ nhớ)")
+    parser.add_argument("--model", default=MODEL_PATH, help="Checkpoint đầu ra (api.py load khi khởi động)")
+    parser.add_argument("--fresh", action="store_true", help="Không load checkpoint có sẵn, train từ đầu")
+    parser.add_argument("--report-every", type=int, default=100000, help="In tiến độ mỗi N record")
+    parser.add_argument("--save-every", type=int, default=50,
+                        help="Ghi checkpoint mỗi N chunk (0 = chỉ ghi khi kết thúc)")
+    args = parser.parse_args()
+
+    agent = create_agent(STATE_DIM, memory_capacity=args.replay_capacity,
+                         memory_path=args.replay_path, compact_replay=args.compact_replay)
+    if os.path.exists(args.model) and not args.fresh:
+        agent.load_model(args.model)
+        print(f"Đã load model từ {args.model} (train_count={agent.train_count})")
+
+    trainer = OfflineTrainer(agent, batch_size=args.batch_size,
+                             updates_per_sample=args.updates_per_sample,
+                             target_update_every=args.target_update_every)
+
+    def save():
+        agent.save_model(args.model)
+        if hasattr(agent.memory, "flush"):
+            agent.memory.flush()
+
+    start = time.perf_counter()
+    chunks = 0
+    try:
+        for epoch in range(1, args.epochs + 1):
+            epoch_start = time.perf_counter()
+            epoch_records = 0
+            next_report = args.report_every
+            for chunk in chunked(read_records(args.files), args.chunk_size):
+                trainer.ingest(chunk)
+                epoch_records += len(chunk)
+                chunks += 1
+                if epoch_records >= next_report:
+                    elapsed = time.perf_counter() - epoch_start
+                    print(f"  epoch {epoch}: {epoch_records} records, {epoch_records / elapsed:,.0f} transitions/s")
+                    next_report += args.report_every
+                if args.save_every > 0 and chunks % args.save_every == 0:
+                    save()
+
+            elapsed = time.perf_counter() - epoch_start
+            print(f"Epoch {epoch}/{args.epochs}: {epoch_records} records trong {elapsed:.1f}s "
+                  f"({epoch_records / max(elapsed, 1e-9):,.0f} transitions/s), "
+                  f"train_count={agent.train_count}, epsilon={agent.epsilon:.3f}")
+    finally:
+        # Lỗi / Ctrl+C giữa chừng vẫn giữ lại phần đã train
+        save()
+        print(f"Đã lưu model vào {args.model} (train_count={agent.train_count})")
+
+    total = time.perf_counter() - start
+    print(f"Hoàn tất: {trainer.accepted} transitions hợp lệ, {trainer.rejected} bị bỏ qua, "
+          f"{trainer.updates} lần train trong {total:.1f}s "
+          f"({trainer.accepted / max(total, 1e-9):,.0f} transitions/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# trainer.py
+import queue
+import threading
+import time
+
+
+class BackgroundTrainer:
+    """
+    Training chạy nền, tách khỏi request /train
+
+    - /train chỉ đưa transition vào hàng đợi (submit) rồi trả về ngay
+    - Thread trainer lấy transition ra, push vào replay memory và train
+      updates_per_sample lần cho mỗi sample (có thể < 1, vd 0.25 = 4 sample/1 lần train)
+    - Target network và checkpoint (CheckpointManager) chạy theo lịch riêng của trainer
+    - Hàng đợi có giới hạn (backpressure): đầy quá put_timeout → submit trả về False
+    """
+    def __init__(self, agent, checkpoints, updates_per_sample=1.0, target_update_every=100,
+                 maxsize=10000, put_timeout=0.05):
+        self.agent = agent
+        self.checkpoints = checkpoints
+        self.updates_per_sample = updates_per_sample
+        self.target_update_every = target_update_every
+        self.put_timeout = put_timeout
+        self.queue = queue.Queue(maxsize=maxsize)
+
+        self._update_credit = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="trainer", daemon=True)
+
+        # Tracking
+        self.processed = 0
+        self.rejected = 0
+        self.last_wait_sec = 0.0
+        self.last_error = None
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, timeout=10.0):
+        """Dừng trainer: xử lý nốt hàng đợi rồi lưu model lần cuối"""
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def submit(self, state, action, reward, next_state, done):
+        """Đưa 1 transition vào hàng đợi. Trả về False nếu hàng đợi đầy"""
+        try:
+            self.queue.put((time.monotonic(), (state, action, reward, next_state, done)),
+                           timeout=self.put_timeout)
+            return True
+        except queue.Full:
+            self.rejected += 1
+            return False
+
+    def submit_batch(self, states, actions, rewards, next_states, dones):
+        """
+        Đưa nhiều transition vào hàng đợi theo thứ tự
+        Hàng đợi đầy → dừng, trả về số transition đã nhận (phần còn lại bị từ chối)
+        """
+        for accepted, transition in enumerate(zip(states, actions, rewards, next_states, dones)):
+            if not self.submit(*transition):
+                self.rejected += len(states) - accepted - 1
+                return accepted
+        return len(states)
+
+    def _run(self):
+        self.agent.init_train_thread()
+        while not (self._stop.is_set() and self.queue.empty()):
+            try:
+                enqueued_at, transition = self.queue.get(timeout=0.1)
+            except queue.Empty:
+                self.checkpoints.maybe_save()
+                continue
+
+            try:
+                self._process(transition)
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Lỗi training nền: {e}")
+
+            self.processed += 1
+            self.last_wait_sec = time.monotonic() - enqueued_at
+            self.checkpoints.maybe_save()
+
+        self.checkpoints.flush()
+
+    def _process(self, transition):
+        self.agent.memory.push(*transition)
+
+        self._update_credit += self.updates_per_sample
+        while self._update_credit >= 1:
+            self._update_credit -= 1
+            self.agent.train_step()
+
+            # Update target network theo số lần train
+            if self.agent.train_count % self.target_update_every == 0:
+                self.agent.update_target()
+
+    def lag_sec(self):
+        """Thời gian transition cũ nhất trong hàng đợi đã phải chờ"""
+        with self.queue.mutex:
+            if not self.queue.queue:
+                return 0.0
+            oldest = self.queue.queue[0][0]
+        return time.monotonic() - oldest
+
+    def status(self):
+        """Trạng thái trainer cho /status"""
+        return {
+            "running": self._thread.is_alive(),
+            "queue_depth": self.queue.qsize(),
+            "queue_capacity": self.queue.maxsize,
+            "lag_sec": round(self.lag_sec(), 4),
+            "last_wait_sec": round(self.last_wait_sec, 4),
+            "processed": self.processed,
+            "rejected": self.rejected,
+            "updates_per_sample": self.updates_per_sample,
+            "last_error": self.last_error
+        }
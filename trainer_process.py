@@ -0,0 +1,216 @@
+# trainer_process.py
+"""
+Trainer process cho chế độ multi-worker
+
+    DQN_TRAINER_AUTHKEY=... python trainer_process.py
+    DQN_TRAINER_AUTHKEY=... DQN_SERVING_MODE=worker uvicorn api:app --workers 4
+
+- 1 process duy nhất sở hữu DQNAgent.train_step, replay buffer và checkpoint
+- API workers gửi transition qua local IPC (multiprocessing.connection)
+- Weights mới được publish vào shared memory, workers map read-only và nạp theo version
+"""
+import os
+import signal
+import threading
+from multiprocessing.connection import Client, Listener
+from agent import create_agent
+from checkpoint import CheckpointManager
+from registry import ModelRegistry
+from shared_weights import SharedWeights
+from state_encoder import STATE_DIM
+from trainer import BackgroundTrainer
+from config import (
+    MODEL_PATH, REPLAY_CAPACITY, REPLAY_PATH, REPLAY_COMPACT,
+    TRAIN_QUEUE_MAXSIZE, TRAIN_QUEUE_TIMEOUT_SEC, UPDATES_PER_SAMPLE, TARGET_UPDATE_EVERY,
+    CHECKPOINT_EVERY_STEPS, CHECKPOINT_INTERVAL_SEC, BACKUP_DIR, BACKUP_EVERY_STEPS,
+    BACKUP_KEEP_LAST, BACKUP_KEEP_EVERY, PUBLISH_EVERY, TRAIN_NUM_THREADS,
+    TRAINER_ADDRESS, TRAINER_AUTHKEY, TRAINER_AUTHKEY_FILE, SHARED_WEIGHTS_NAME, WEIGHTS_SYNC_INTERVAL_SEC
+)
+
+
+def load_authkey(key=TRAINER_AUTHKEY, path=TRAINER_AUTHKEY_FILE):
+    """
+    Khóa IPC từ DQN_TRAINER_AUTHKEY hoặc file DQN_TRAINER_AUTHKEY_FILE
+    Không có khóa → RuntimeError (không dùng khóa mặc định: ai kết nối được là chạy được code trong trainer)
+    """
+    if not key and path:
+        with open(path, encoding="utf-8") as f:
+            key = f.read().strip()
+    if not key:
+        raise RuntimeError("Chưa cấu hình khóa IPC của trainer: đặt DQN_TRAINER_AUTHKEY hoặc DQN_TRAINER_AUTHKEY_FILE")
+    return key.encode()
+
+
+class TrainerClient:
+    """
+    Phía API worker: gửi transition tới trainer process
+
+    Mỗi message là 1 request/response trên cùng 1 connection (có lock),
+    tự kết nối lại nếu trainer restart
+    """
+    def __init__(self, address=TRAINER_ADDRESS, authkey=None):
+        self.address = address
+        self.authkey = authkey if authkey is not None else load_authkey()
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _call(self, message):
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._conn is None:
+                        self._conn = Client(self.address, authkey=self.authkey)
+                    self._conn.send(message)
+                    return self._conn.recv()
+                except (OSError, EOFError):
+                    if self._conn is not None:
+                        self._conn.close()
+                    self._conn = None
+                    if attempt == 1:
+                        raise ConnectionError(f"Không kết nối được trainer process tại {self.address}")
+
+    def submit(self, state, action, reward, next_state, done):
+        """Trả về (accepted, status) của trainer"""
+        return self._call(("push", (state, action, reward, next_state, done)))
+
+    def submit_batch(self, states, actions, rewards, next_states, dones):
+        """Gửi cả chunk trong 1 message, trả về (số transition trainer nhận, status)"""
+        return self._call(("push_batch", (states, actions, rewards, next_states, dones)))
+
+    def status(self):
+        return self._call(("status",))
+
+    def registry(self, op, arg=None):
+        """Thao tác ModelRegistry trên trainer process; lỗi → ValueError"""
+        ok, result = self._call(("registry", op, arg))
+        if not ok:
+            raise ValueError(result)
+        return result
+
+
+class TrainerServer:
+    """Nhận transition từ các workers, train nền và publish weights vào shared memory"""
+    def __init__(self):
+        self.authkey = load_authkey()
+        self.agent = create_agent(STATE_DIM, memory_capacity=REPLAY_CAPACITY,
+                                  memory_path=REPLAY_PATH, compact_replay=REPLAY_COMPACT,
+                                  publish_every=PUBLISH_EVERY,
+                                  train_threads=TRAIN_NUM_THREADS)
+        if os.path.exists(MODEL_PATH):
+            self.agent.load_model(MODEL_PATH)
+            print(f"Đã load model từ {MODEL_PATH} (train_count={self.agent.train_count})")
+
+        self.checkpoints = CheckpointManager(
+            self.agent, MODEL_PATH,
+            every_steps=CHECKPOINT_EVERY_STEPS,
+            interval_sec=CHECKPOINT_INTERVAL_SEC,
+            backup_dir=BACKUP_DIR,
+            backup_every=BACKUP_EVERY_STEPS,
+            keep_last=BACKUP_KEEP_LAST,
+            keep_every=BACKUP_KEEP_EVERY
+        )
+        self.trainer = BackgroundTrainer(
+            self.agent, self.checkpoints,
+            updates_per_sample=UPDATES_PER_SAMPLE,
+            target_update_every=TARGET_UPDATE_EVERY,
+            maxsize=TRAIN_QUEUE_MAXSIZE,
+            put_timeout=TRAIN_QUEUE_TIMEOUT_SEC
+        )
+
+        self.registry = ModelRegistry()
+
+        num_params = sum(p.numel() for p in self.agent.model.parameters())
+        self.shared = SharedWeights(SHARED_WEIGHTS_NAME, num_params, create=True)
+        self._published_version = None
+        self._publish_lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def publish(self):
+        """Publish inference_model vào shared memory nếu có version mới"""
+        agent = self.agent
+        with self._publish_lock:
+            if agent.inference_version == self._published_version:
+                return
+            version = agent.inference_version
+            self.shared.publish(agent.inference_model.state_dict(), agent.epsilon,
+                                agent.train_count, agent.is_trained)
+            self._published_version = version
+
+    def _publish_loop(self):
+        while not self._stop.is_set():
+            self.publish()
+            self._stop.wait(WEIGHTS_SYNC_INTERVAL_SEC)
+
+    def status(self):
+        status = self.trainer.status()
+        status.update({
+            "memory_size": len(self.agent.memory),
+            "train_count": int(self.agent.train_count),
+            "epsilon": float(self.agent.epsilon),
+            "weights_version": self.shared.version()
+        })
+        return status
+
+    def _handle(self, conn):
+        with conn:
+            while not self._stop.is_set():
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    return
+                if message[0] == "push":
+                    accepted = self.trainer.submit(*message[1])
+                    conn.send((accepted, {"queue_depth": self.trainer.queue.qsize()}))
+                elif message[0] == "push_batch":
+                    accepted = self.trainer.submit_batch(*message[1])
+                    conn.send((accepted, {"queue_depth": self.trainer.queue.qsize()}))
+                elif message[0] == "status":
+                    conn.send(self.status())
+                elif message[0] == "registry":
+                    conn.send(self._registry(*message[1:]))
+                else:
+                    conn.send(None)
+
+    def _registry(self, op, arg):
+        try:
+            result = self.registry.command(self.agent, op, arg)
+        except (ValueError, RuntimeError) as e:
+            return False, str(e)
+        if op in ("activate", "rollback"):
+            # Lưu weights mới vào checkpoint, publish_loop đưa tới các worker
+            self.checkpoints.request_save()
+        return True, result
+
+    def serve(self):
+        self.trainer.start()
+        self.publish()
+        threading.Thread(target=self._publish_loop, name="weight-publisher", daemon=True).start()
+
+        listener = Listener(TRAINER_ADDRESS, authkey=self.authkey)
+        print(f"Trainer process sẵn sàng tại {TRAINER_ADDRESS}, shared memory: {SHARED_WEIGHTS_NAME}")
+
+        def shutdown(*_):
+            self._stop.set()
+            listener.close()
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+
+        while not self._stop.is_set():
+            try:
+                conn = listener.accept()
+            except OSError:
+                break
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+        # Xử lý nốt hàng đợi, lưu checkpoint và publish lần cuối
+        self.trainer.stop()
+        self.checkpoints.close()
+        if hasattr(self.agent.memory, "flush"):
+            self.agent.memory.flush()
+        self.publish()
+        self.shared.close()
+        print("Trainer process đã dừng")
+
+
+if __name__ == "__main__":
+    TrainerServer().serve()